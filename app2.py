@@ -1,306 +1,101 @@
-from flask import Flask, request, render_template_string, redirect, url_for
+import os
+
+from flask import Flask, request
 from flask_babel import Babel, _
-import pandas as pd
-import re
+from compression import init_compression
+from data_manager import DataManager
+from instrumentation import init_instrumentation
+from web_helpers import init_assets, init_readiness, init_search_routes, pattern_params
 
-app = Flask(__name__)
+# This form's length conditions, in the search engine's terms.
+CONDITIONS = {"exact": "equal", "less": "equal_or_lower", "greater": "equal_or_higher"}
 
-# Configuration for Babel
-app.config['BABEL_DEFAULT_LOCALE'] = 'en'
-app.config['BABEL_SUPPORTED_LOCALES'] = ['en', 'es']
+def read_query(values):
+    """
+    Reads a search query from the request values (the search form or the API parameters).
 
-babel = Babel(app)
+    Returns (fields, query): the raw field values, to show them again in the form, and
+    the query as search engine arguments (condition, numbers, letters, gender, countries,
+    pattern).
+    """
+    num_letters = values.get("num_letters", "")
+    condition = values.get("condition", "exact")
+    # Countries to search in (none selected: all of them)
+    country_filter = [country for country in values.getlist("country") if country]
+    try:
+        n = int(num_letters)
+    except ValueError:
+        n = 0
+    
+    # Retrieve the letter inputs (one per position)
+    letters = values.getlist("letters")
+    # Ensure the list has exactly n items (pad with empty strings if necessary)
+    if len(letters) < n:
+        letters += [""] * (n - len(letters))
+    elif len(letters) > n:
+        letters = letters[:n]
+    
+    # Name pattern (glob or limited regex); with no number of letters, it matches names of any length
+    pattern = pattern_params(values)
+    query_condition = CONDITIONS.get(condition)
+    if pattern is not None and not num_letters:
+        query_condition = "equal_or_higher"
 
-@babel.localeselector
-def get_locale():
-    # Check if a language was passed as query parameter (?lang=es)
-    lang = request.args.get('lang')
-    if lang in app.config['BABEL_SUPPORTED_LOCALES']:
-        return lang
-    # Otherwise, use best match from Accept-Language header
-    return request.accept_languages.best_match(app.config['BABEL_SUPPORTED_LOCALES'])
+    fields = {"num_letters": num_letters, "letters": letters, "condition": condition, "country_filter": country_filter,
+              "pattern": values.get("pattern", ""), "pattern_syntax": values.get("pattern_syntax", "glob"),
+              "similar_to": values.get("similar_to", ""), "max_distance": values.get("max_distance", "1")}
+    return fields, (query_condition, n, letters, "Any", country_filter, pattern)
 
-# Load the Excel file (which should contain columns: Name, Frequency, Country)
-try:
-    df = pd.read_excel("names.xlsx")
-except Exception as e:
-    raise Exception(_("Error reading 'names.xlsx'. Please ensure the file exists and is valid.")) from e
+def create_app(data=None):
+    """
+    Returns the app, serving the DataManager 'data' (by default one for names.xlsx).
 
-# If headers are missing, assume default names.
-if df.columns.size >= 3 and not all(col in df.columns for col in ["Name", "Frequency", "Country"]):
-    df.columns = ["Name", "Frequency", "Country"]
+    Creating it is cheap: by default the dataset is loaded in the background
+    (NAMES_DATA_LOAD: "background", "lazy" to wait for the first request, or "now"), the
+    server starts listening right away and /ready says when the data is loaded. A
+    missing or broken workbook makes the searches answer 503 instead of failing the import.
+    """
+    app = Flask(__name__)
 
-@app.route("/", methods=["GET", "POST"])
-def search():
-    results = None
-    num_letters = ""
-    letters = []      # The list of letter inputs
-    condition = "exact"  # Default condition
-    
-    if request.method == "POST":
-        num_letters = request.form.get("num_letters", "")
-        condition = request.form.get("condition", "exact")
-        try:
-            n = int(num_letters)
-        except ValueError:
-            n = 0
-        
-        # Retrieve the letter inputs (one per position)
-        letters = request.form.getlist("letters")
-        # Ensure the list has exactly n items (pad with empty strings if necessary)
-        if len(letters) < n:
-            letters += [""] * (n - len(letters))
-        elif len(letters) > n:
-            letters = letters[:n]
-        
-        # Custom matching function
-        def matches_name(name, pattern, cond, n):
-            """Return True if name meets the length condition and letter pattern."""
-            name = str(name)
-            l = len(name)
-            if cond == "exact":
-                if l != n:
-                    return False
-                for i in range(n):
-                    if pattern[i].strip() and name[i].lower() != pattern[i].lower():
-                        return False
-                return True
-            elif cond == "less":
-                if l > n:
-                    return False
-                for i in range(l):
-                    if pattern[i].strip() and name[i].lower() != pattern[i].lower():
-                        return False
-                return True
-            elif cond == "greater":
-                if l < n:
-                    return False
-                for i in range(n):
-                    if pattern[i].strip() and name[i].lower() != pattern[i].lower():
-                        return False
-                return True
-            return False
-        
-        # Filter the DataFrame rows using the custom matching function.
-        results = []
-        for _, row in df.iterrows():
-            if matches_name(row["Name"], letters, condition, n):
-                results.append(row.to_dict())
-    
-    # Render the HTML template.
-    # Notice all user-facing texts are wrapped in _() for translation.
-    return render_template_string('''
-<!DOCTYPE html>
-<html lang="{{ get_locale() }}">
-<head>
-  <meta charset="UTF-8">
-  <title>{{ _("Advanced Name Search") }}</title>
-  <style>
-    body {
-      font-family: 'Helvetica Neue', Helvetica, Arial, sans-serif;
-      background: linear-gradient(135deg, #f5f7fa, #c3cfe2);
-      margin: 0;
-      padding: 20px;
-    }
-    .container {
-      max-width: 800px;
-      background: #fff;
-      margin: 40px auto;
-      padding: 30px;
-      border-radius: 8px;
-      box-shadow: 0 10px 20px rgba(0,0,0,0.2);
-    }
-    h1, h2 {
-      text-align: center;
-      color: #333;
-    }
-    form {
-      margin-top: 20px;
-    }
-    .form-group {
-      margin-bottom: 20px;
-    }
-    label {
-      font-weight: bold;
-      display: block;
-      margin-bottom: 8px;
-      color: #555;
-    }
-    input[type="number"] {
-      width: 100px;
-      padding: 5px;
-      font-size: 16px;
-      border: 1px solid #ccc;
-      border-radius: 4px;
-    }
-    .condition-group {
-      display: flex;
-      align-items: center;
-      gap: 10px;
-    }
-    .condition-group input[type="radio"] {
-      margin-right: 5px;
-    }
-    #letterInputs {
-      margin-top: 15px;
-      text-align: center;
-    }
-    #letterInputs input {
-      width: 45px;
-      height: 45px;
-      font-size: 24px;
-      text-align: center;
-      margin: 5px;
-      border: 1px solid #bbb;
-      border-radius: 4px;
-      transition: border-color 0.3s;
-    }
-    #letterInputs input:focus {
-      border-color: #007BFF;
-      outline: none;
-    }
-    button {
-      display: block;
-      margin: 20px auto;
-      padding: 10px 25px;
-      font-size: 18px;
-      background-color: #007BFF;
-      color: #fff;
-      border: none;
-      border-radius: 5px;
-      cursor: pointer;
-      transition: background-color 0.3s;
-    }
-    button:hover {
-      background-color: #0056b3;
-    }
-    .results {
-      margin-top: 30px;
-    }
-    table {
-      width: 100%;
-      border-collapse: collapse;
-      margin-top: 15px;
-    }
-    table th, table td {
-      border: 1px solid #ddd;
-      padding: 12px;
-      text-align: left;
-    }
-    table th {
-      background-color: #f2f2f2;
-    }
-    .lang-switcher {
-      text-align: right;
-    }
-    .lang-switcher a {
-      margin-left: 10px;
-      text-decoration: none;
-      color: #007BFF;
-    }
-    .lang-switcher a:hover {
-      text-decoration: underline;
-    }
-    @media (max-width: 600px) {
-      #letterInputs input {
-        width: 35px;
-        height: 35px;
-        font-size: 18px;
-      }
-      button {
-        font-size: 16px;
-      }
-    }
-  </style>
-</head>
-<body>
-  <div class="container">
-    <div class="lang-switcher">
-      <a href="{{ url_for('search', lang='en') }}">English</a> | 
-      <a href="{{ url_for('search', lang='es') }}">Español</a>
-    </div>
-    <h1>{{ _("Advanced Name Search") }}</h1>
-    <form method="post" id="searchForm">
-      <div class="form-group">
-        <label for="num_letters">{{ _("Number of Letters:") }}</label>
-        <input type="number" id="num_letters" name="num_letters" min="1" value="{{ num_letters if num_letters else '' }}">
-      </div>
-      <div class="form-group">
-        <label>{{ _("Length Condition:") }}</label>
-        <div class="condition-group">
-          <input type="radio" name="condition" value="exact" id="cond_exact" 
-            {% if condition == 'exact' %}checked{% endif %}>
-          <label for="cond_exact">{{ _("Exact") }}</label>
-          <input type="radio" name="condition" value="less" id="cond_less" 
-            {% if condition == 'less' %}checked{% endif %}>
-          <label for="cond_less">{{ _("Less than or equal") }}</label>
-          <input type="radio" name="condition" value="greater" id="cond_greater" 
-            {% if condition == 'greater' %}checked{% endif %}>
-          <label for="cond_greater">{{ _("Greater than or equal") }}</label>
-        </div>
-      </div>
-      <div id="letterInputs">
-        <!-- Letter input boxes will be generated here -->
-      </div>
-      <button type="submit">{{ _("Search") }}</button>
-    </form>
-    
-    <div class="results">
-      {% if results is not none %}
-        <h2>{{ _("Results") }}</h2>
-        {% if results %}
-          <table>
-            <thead>
-              <tr>
-                <th>{{ _("Name") }}</th>
-                <th>{{ _("Frequency") }}</th>
-                <th>{{ _("Country") }}</th>
-              </tr>
-            </thead>
-            <tbody>
-              {% for row in results %}
-                <tr>
-                  <td>{{ row["Name"] }}</td>
-                  <td>{{ row["Frequency"] }}</td>
-                  <td>{{ row["Country"] }}</td>
-                </tr>
-              {% endfor %}
-            </tbody>
-          </table>
-        {% else %}
-          <p style="text-align: center;">{{ _("No matching names found.") }}</p>
-        {% endif %}
-      {% endif %}
-    </div>
-  </div>
-  
-  <script>
-    // Dynamically generate letter input boxes based on the number entered.
-    function generateLetterInputs() {
-      var numLetters = document.getElementById("num_letters").value;
-      var container = document.getElementById("letterInputs");
-      container.innerHTML = "";
-      var prefilled = {{ letters|tojson|safe }};
-      numLetters = parseInt(numLetters);
-      if (isNaN(numLetters) || numLetters < 1) return;
-      for (var i = 0; i < numLetters; i++) {
-        var input = document.createElement("input");
-        input.setAttribute("type", "text");
-        input.setAttribute("name", "letters");
-        input.setAttribute("maxlength", "1");
-        if (prefilled && prefilled[i]) {
-          input.value = prefilled[i];
-        }
-        container.appendChild(input);
-      }
-    }
-    window.addEventListener("load", generateLetterInputs);
-    document.getElementById("num_letters").addEventListener("change", generateLetterInputs);
-  </script>
-</body>
-</html>
-''', results=results, num_letters=num_letters, letters=letters, condition=condition)
+    # Configuration for Babel
+    app.config['BABEL_DEFAULT_LOCALE'] = 'en'
+    app.config['BABEL_SUPPORTED_LOCALES'] = ['en', 'es']
 
-if __name__ == '__main__':
-    app.run(debug=True)
+    babel = Babel(app)
+
+    @babel.localeselector
+    def get_locale():
+        # Check if a language was passed as query parameter (?lang=es)
+        lang = request.args.get('lang')
+        if lang in app.config['BABEL_SUPPORTED_LOCALES']:
+            return lang
+        # Otherwise, use best match from Accept-Language header
+        return request.accept_languages.best_match(app.config['BABEL_SUPPORTED_LOCALES'])
 
+    # Static CSS/JS, and the page template compiled once at startup.
+    # Notice all user-facing texts in the template are wrapped in _() for translation.
+    init_assets(app)
+    app.jinja_env.globals["get_locale"] = get_locale
+    search_template = app.jinja_env.get_template("app2.html")
+
+    # The Excel file should contain columns: Name, Frequency, Country. It is reloaded in
+    # the background whenever the file changes.
+    if data is None:
+        data = DataManager("names.xlsx", load=os.environ.get("NAMES_DATA_LOAD", "background"))
+
+    # Server-Timing headers, /metrics and opt-in sampled profiling (see init_instrumentation()).
+    init_instrumentation(app, data.cache)
+
+    # gzip/Brotli compression of the pages and API responses (see init_compression()).
+    init_compression(app)
+
+    # /ready, and 503 responses (translated) while the dataset isn't loaded (see init_readiness()).
+    init_readiness(app, data, _)
+
+    # The search page, the search API, /suggest and the stats endpoints (see init_search_routes()).
+    init_search_routes(app, data, read_query, search_template, CONDITIONS)
+
+    return app
+
+if __name__ == '__main__':
+    create_app().run(debug=True)
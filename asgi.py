@@ -0,0 +1,33 @@
+"""
+ASGI entry point for the Flask apps:
+
+    uvicorn asgi:app              # flask_app.py
+    uvicorn asgi:app2             # app2.py
+
+Requests are accepted on uvicorn's event loop and handed to the Flask app on a pool of
+HANDLER_THREADS threads (NAMES_HANDLER_THREADS). Expensive searches run on the app's
+SearchPool, which is smaller and bounded, so the handler threads stay available for
+cheap queries, static files and the stats endpoints while scans are running.
+
+Each app is created (with create_app()) when uvicorn asks for it, so serving one of them
+doesn't import the other one or load a second copy of the data.
+"""
+import importlib
+import os
+
+from a2wsgi import WSGIMiddleware
+
+# Threads running Flask requests: more than the search pool can hold (workers plus its
+# queue), so requests waiting on the pool never take all of them.
+HANDLER_THREADS = int(os.environ.get("NAMES_HANDLER_THREADS", 32))
+
+# ASGI app name -> module of the Flask app.
+APPS = {"app": "flask_app", "app2": "app2"}
+
+
+def __getattr__(name):
+    if name not in APPS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    app = WSGIMiddleware(importlib.import_module(APPS[name]).create_app(), workers=HANDLER_THREADS)
+    globals()[name] = app
+    return app
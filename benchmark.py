@@ -0,0 +1,310 @@
+"""
+Benchmarks the name search on synthetic datasets of growing size.
+
+Usage: python benchmark.py [--sizes 10000,100000,1000000,10000000] [--queries N]
+                           [--repeat N] [--workers 1,2,4] [--baseline-max-rows N]
+                           [--countries N] [--no-views] [--json PATH] [names.xlsx]
+
+The synthetic datasets are sampled from the names workbook: every row copies the length,
+country, gender and frequency of a random real row, and its name is the real name with
+one character replaced by the character another real name has at that position, so the
+distributions of lengths and of letters per position (which decide how selective a query
+is) are those of the real data while the names aren't all duplicates. With --countries N
+the rows are spread at random over N synthetic countries instead of the real ones.
+
+Every implementation answers the same fixed mix of queries (all four matches_name()
+conditions, with and without letters and the gender filter), with the result cache off:
+
+  - iterrows: the original loop over df.iterrows() calling matches_name(). Only run on
+    datasets up to --baseline-max-rows rows, as it takes seconds per query.
+  - mask: SearchEngine, NumPy masks over the whole dataset, in one thread.
+  - mask xN: the same, scanning shards on N threads (--workers; datasets smaller than
+    search_engine.PARALLEL_MIN_ROWS are always scanned in one thread).
+  - index: NameIndex, posting lists.
+  - index sorted / top 10: NameIndex, all the matches sorted by Frequency / only the 10
+    most frequent, with early termination.
+  - batch: NameIndex.match_batch() on the whole mix at once (its latency is per mix).
+  - suggest: the 10 most frequent names starting with the first 1 to 3 letters of a
+    name of the dataset, with the gender of the mix's query (a mix of its own).
+  - similar 1 / 2: the names within 1 / 2 edits of those names, with the same genders.
+  - country scan / mask / index: with --countries, the same mix restricted to one
+    country: masks over every row that discard the other countries' rows, then
+    SearchEngine and NameIndex on that country's partition only.
+
+Then the search() views of flask_app.py and app2.py are driven through the Flask test
+client on the same data, with the result cache emptied before every request so they
+measure the search and the rendering, not the cache.
+
+Reported per implementation: queries per second, p50/p99 latency and peak memory
+allocated while answering the mix (measured in a separate pass under tracemalloc, as
+tracing slows everything down).
+"""
+import argparse
+import json
+import os
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from name_index import NameIndex
+from names_data import BUILD_CHUNK_SIZE, NamesDataset, load_dataset
+from search_engine import CONDITIONS, SearchEngine, matches_name
+
+SIZES = [10_000, 100_000, 1_000_000, 10_000_000]
+
+# Thread counts of the sharded scan: powers of two up to the number of CPUs.
+WORKERS = [2**i for i in range((os.cpu_count() or 1).bit_length()) if 2**i <= (os.cpu_count() or 1)]
+
+# app2.py's names for the conditions it has.
+APP2_CONDITIONS = {"equal": "exact", "equal_or_lower": "less", "equal_or_higher": "greater"}
+
+
+def synthetic_dataset(seed, rows, rng, countries=None):
+    """
+    Returns a NamesDataset of 'rows' rows sampled from the seed dataset (see the module
+    docstring), spread over 'countries' synthetic countries if given.
+    """
+    names = np.array(seed.names(), dtype=str)
+    # One row of UTF-32 code points per name, padded with 0.
+    chars = names.view(np.uint32).reshape(len(names), -1)
+    picked = rng.integers(len(seed), size=rows)
+    synthetic_names = []
+    for start in range(0, rows, BUILD_CHUNK_SIZE):
+        chunk = picked[start:start + BUILD_CHUNK_SIZE]
+        lengths = seed.lengths[chunk]
+        synthetic = chars[chunk]
+        positions = (rng.random(len(chunk)) * np.maximum(lengths, 1)).astype(np.int64)
+        replacements = chars[rng.integers(len(seed), size=len(chunk)), positions]
+        replaced = np.flatnonzero((replacements != 0) & (positions < lengths))
+        synthetic[replaced, positions[replaced]] = replacements[replaced]
+        synthetic_names += synthetic.view(names.dtype).ravel().tolist()
+
+    data = pd.DataFrame({
+        "Name": synthetic_names,
+        **{name: seed.values(name, picked) for name in seed.column_names if name != "Name"},
+    })
+    if countries:
+        labels = np.array([f"Country {i + 1}" for i in range(countries)], dtype=object)
+        data["Country"] = labels[rng.integers(countries, size=rows)]
+    return NamesDataset.from_frame(data)
+
+
+def query_mix(dataset, count, rng):
+    """
+    Returns a fixed mix of 'count' queries (condition, numbers, letters, gender).
+
+    Conditions and genders take turns; the letters are taken from a random name of the
+    dataset, so most queries match something, and a third of the queries have none.
+    """
+    genders = ["Any", "Boy", "Girl"]
+    queries = []
+    for i in range(count):
+        condition = CONDITIONS[i % len(CONDITIONS)]
+        gender = genders[(i // len(CONDITIONS)) % len(genders)]
+        name = dataset.names([rng.integers(len(dataset))])[0]
+        length = max(len(name), 1)
+        if condition == "between":
+            numbers = (max(length - 1, 1), length + 1)
+            width = numbers[1]
+        else:
+            numbers = length
+            width = length
+        letters = [""] * width
+        for position in rng.choice(length, size=min(i % 3, len(name)), replace=False):
+            letters[position] = name[position]
+        queries.append((condition, numbers, letters, gender))
+    return queries
+
+
+def iterrows_search(data, condition, numbers, letters, gender="Any", countries=None):
+    """The original search: a loop over df.iterrows() calling matches_name()."""
+    countries = {country.strip().lower() for country in countries or ()}
+    results = []
+    for index, row in data.iterrows():
+        if gender != "Any" and str(row["Gender"]).strip().lower() != gender.lower():
+            continue
+        if countries and str(row["Country"]).strip().lower() not in countries:
+            continue
+        if matches_name(row["Name"], condition, numbers, letters):
+            results.append(index)
+    return results
+
+
+def measure(run, queries):
+    """Returns (latencies in seconds, results) of running every query through 'run'."""
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        results.append(run(query))
+        latencies.append(time.perf_counter() - started)
+    return latencies, results
+
+
+def peak_memory(run, queries):
+    """Returns the peak memory (bytes) allocated while running the queries."""
+    tracemalloc.start()
+    try:
+        for query in queries:
+            run(query)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def summary(name, latencies, queries, peak):
+    latencies = np.array(latencies)
+    return {
+        "implementation": name,
+        "queries": queries,
+        "qps": queries / latencies.sum() if latencies.sum() else float("inf"),
+        "p50_ms": np.percentile(latencies, 50) * 1000,
+        "p99_ms": np.percentile(latencies, 99) * 1000,
+        "peak_mb": peak / 2**20,
+    }
+
+
+def engine_runs(dataset, queries, baseline, workers):
+    """Yields (implementation, run(query), queries) for every search implementation."""
+    if baseline:
+        frame = dataset.to_frame()
+        yield "iterrows", lambda query: iterrows_search(frame, *query), queries
+    mask = SearchEngine(dataset, workers=1)
+    yield "mask", lambda query: mask.match_ids(*query), queries
+    for count in workers:
+        if count > 1:
+            sharded = SearchEngine(dataset, workers=count)
+            yield f"mask x{count}", lambda query, sharded=sharded: sharded.match_ids(*query), queries
+    index = NameIndex(dataset)
+    yield "index", lambda query: index.match_ids(*query), queries
+    yield "index sorted", lambda query: index.sort_by_frequency(index.match_ids(*query)), queries
+    yield "index top 10", lambda query: index.top_ids(*query, k=10), queries
+    # One "query" of the batch is the whole mix.
+    yield "batch", lambda mix: index.match_batch(mix), [queries]
+    names = dataset.names(np.linspace(0, len(dataset) - 1, len(queries)).astype(np.int64))
+    prefixes = [(name[:1 + i % 3], query[3]) for i, (name, query) in enumerate(zip(names, queries))]
+    yield "suggest", lambda query: index.suggest_ids(*query), prefixes
+    similar = [(name, query[3]) for name, query in zip(names, queries)]
+    for distance in (1, 2):
+        yield (f"similar {distance}", lambda query, distance=distance: index.similar_ids(query[0], distance, query[1]),
+               similar)
+    if len(mask.country_names) > 1:
+        scoped = [query + ([mask.country_names[0]],) for query in queries]
+        yield "country scan", lambda query: np.flatnonzero(mask.match_mask(*query)), scoped
+        yield "country mask", lambda query: mask.match_ids(*query), scoped
+        yield "country index", lambda query: index.match_ids(*query), scoped
+
+
+def view_runs(dataset, queries):
+    """Yields (view, run(query), queries) for the search() views of the Flask apps."""
+    import app2
+    import flask_app
+    from data_manager import DataManager
+
+    def form(query, conditions=None):
+        condition, numbers, letters, gender = query[:4]
+        fields = {"condition": conditions[condition] if conditions else condition, "letters": letters}
+        if condition == "between":
+            fields["num_letters_lower"], fields["num_letters_upper"] = numbers
+        else:
+            fields["num_letters"] = numbers
+        if conditions is None:
+            fields["gender"] = gender
+        return fields
+
+    for name, module, conditions in (("flask_app", flask_app, None), ("app2", app2, APP2_CONDITIONS)):
+        data = DataManager(load="lazy")
+        data.pin(dataset)
+        client = module.create_app(data).test_client()
+
+        def run(query, data=data, client=client, conditions=conditions):
+            data.cache.clear()
+            response = client.post("/", data=form(query, conditions))
+            assert response.status_code == 200, response.status
+            return response.data
+
+        supported = [query for query in queries if conditions is None or query[0] in conditions]
+        yield f"{name} view", run, supported
+
+
+def check(name, results, expected):
+    """Warns when an implementation's results differ from the mask engine's."""
+    for query_results, query_expected in zip(results, expected):
+        if not np.array_equal(np.asarray(query_results), query_expected):
+            print(f"  WARNING: {name} results differ from mask")
+            return
+
+
+def benchmark(dataset, queries, repeat, baseline, views, workers):
+    reports = []
+    reference = SearchEngine(dataset)
+    expected = [reference.match_ids(*query) for query in queries]
+    runs = list(engine_runs(dataset, queries, baseline, workers))
+    if views:
+        runs += list(view_runs(dataset, queries))
+    for name, run, mix in runs:
+        # The slow baseline runs the mix once; the rest run it 'repeat' times after a warm-up.
+        passes = 1 if name == "iterrows" else repeat
+        if name != "iterrows":
+            measure(run, mix[:1])
+        latencies = []
+        for _ in range(passes):
+            pass_latencies, results = measure(run, mix)
+            latencies += pass_latencies
+        if name == "batch":
+            check(name, results[0], expected)
+        elif name.startswith("mask") or name == "index":
+            check(name, results, expected)
+        elif name == "index sorted":
+            check(name, [np.sort(ids) for ids in results], expected)
+        elif name.startswith("country"):
+            check(name, results, [np.flatnonzero(reference.match_mask(*query)) for query in mix])
+        peak = peak_memory(run, mix[:max(len(mix) // 4, 1)] if name == "iterrows" else mix)
+        report = summary(name, latencies, len(latencies) * (len(queries) if name == "batch" else 1), peak)
+        if name == "batch":
+            # Per mix, not per query.
+            report["p50_ms"] = report["p99_ms"] = None
+        reports.append(report)
+        print_report(report)
+    return reports
+
+
+def print_report(report):
+    latency = "" if report["p50_ms"] is None else f"{report['p50_ms']:>9.2f} {report['p99_ms']:>9.2f}"
+    print(f"  {report['implementation']:<16} {report['qps']:>10.1f} {latency:>19} {report['peak_mb']:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the name search on synthetic datasets.")
+    parser.add_argument("path", nargs="?", default="names.xlsx")
+    parser.add_argument("--sizes", default=",".join(map(str, SIZES)), help="comma-separated numbers of rows")
+    parser.add_argument("--queries", type=int, default=48, help="queries in the mix")
+    parser.add_argument("--repeat", type=int, default=5, help="times the mix is run per implementation")
+    parser.add_argument("--workers", default=",".join(map(str, WORKERS)),
+                        help="comma-separated numbers of threads for the sharded scan")
+    parser.add_argument("--baseline-max-rows", type=int, default=100_000,
+                        help="largest dataset the iterrows baseline runs on")
+    parser.add_argument("--countries", type=int, help="spread the rows over this many synthetic countries")
+    parser.add_argument("--no-views", action="store_true", help="don't benchmark the Flask views")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    seed = load_dataset(args.path)
+    workers = [int(count) for count in args.workers.split(",")]
+    results = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        rng = np.random.default_rng(args.seed)
+        started = time.perf_counter()
+        dataset = synthetic_dataset(seed, size, rng, args.countries)
+        queries = query_mix(dataset, args.queries, rng)
+        print(f"{size} rows (built in {time.perf_counter() - started:.1f}s), {len(queries)} queries:")
+        print(f"  {'implementation':<16} {'queries/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'peak MB':>9}")
+        reports = benchmark(dataset, queries, args.repeat, size <= args.baseline_max_rows, not args.no_views, workers)
+        results += [dict(report, rows=size) for report in reports]
+        del dataset
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
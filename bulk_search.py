@@ -0,0 +1,203 @@
+"""
+Searches the names for many queries at once, offline, and writes every match to CSV,
+NDJSON or Parquet.
+
+Usage: python bulk_search.py [--queries FILE] [--output FILE] [--format csv|ndjson|parquet]
+                             [--snapshot PATH] [--order file|frequency] [--limit N]
+                             [--batch-size N] [--workers N] [names.xlsx]
+
+The dataset is loaded once: from names.xlsx's snapshot (built first if it is missing or
+stale, see names_data.py), or straight from a prebuilt snapshot with --snapshot.
+
+Queries are read from --queries (stdin by default), one per line: a JSON object with
+the matches_name() parameters (condition, numbers, letters) and optionally gender,
+countries, pattern and pattern_syntax, or a JSON array in that order. Blank lines and
+lines starting with # are skipped. For example:
+
+    {"condition": "equal", "numbers": 5, "letters": ["m", "a"], "gender": "Girl"}
+    {"condition": "equal_or_higher", "numbers": 0, "pattern": "*ia", "countries": ["Spain"]}
+    ["between", [3, 6], ["", "", "n"]]
+
+Every match is written as one row with the number of its query (0 for the first query
+of the file) followed by the dataset's columns, to --output (stdout by default; Parquet
+needs a file and the pyarrow package). Queries are read --batch-size at a time and
+answered with NameIndex.match_batch(), and the rows are decoded and written a chunk at a
+time, so memory stays flat however many queries and matches there are. With --workers N,
+N batches are searched at once on as many threads (the rows are still written in query
+order).
+
+A throughput summary is printed to stderr at the end.
+"""
+import argparse
+import csv
+import itertools
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from name_index import NameIndex
+from name_pattern import PatternError
+from names_data import NamesDataset
+from names_delta import load_current
+from search_engine import ORDERS, read_query
+
+FORMATS = ["csv", "ndjson", "parquet"]
+
+# Rows decoded and written at a time.
+WRITE_CHUNK_ROWS = 10_000
+
+
+def read_queries(lines):
+    """
+    Yields the queries of the lines (see the module docstring) as match_batch() tuples.
+
+    Exits with an error naming the line of the first invalid query.
+    """
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            yield read_query(json.loads(line))
+        except (KeyError, TypeError, ValueError, PatternError) as e:
+            # PatternError and json.JSONDecodeError are ValueErrors; KeyError: a missing parameter.
+            sys.exit(f"Line {number}: invalid query {line!r} ({e!r})")
+
+
+def batches(queries, size):
+    """Yields lists of up to 'size' queries."""
+    queries = iter(queries)
+    while batch := list(itertools.islice(queries, size)):
+        yield batch
+
+
+def search_batches(index, batches, workers):
+    """
+    Yields the results of index.match_batch() for every batch, in order. With several
+    workers, that many batches are searched at once (and held until their turn comes).
+    """
+    if workers <= 1:
+        for batch in batches:
+            yield index.match_batch(batch)
+        return
+    with ThreadPoolExecutor(workers, thread_name_prefix="bulk-search") as executor:
+        pending = deque()
+        for batch in batches:
+            pending.append(executor.submit(index.match_batch, batch))
+            if len(pending) >= workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+class CsvWriter:
+    def __init__(self, output, columns):
+        self.file = open(output, "w", newline="", encoding="utf-8") if output else sys.stdout
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+
+    def write(self, columns, rows):
+        self.writer.writerows(rows)
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class NdjsonWriter:
+    def __init__(self, output, columns):
+        self.file = open(output, "w", encoding="utf-8") if output else sys.stdout
+
+    def write(self, columns, rows):
+        self.file.writelines(json.dumps(dict(zip(columns, row)), separators=(",", ":"), ensure_ascii=False) + "\n"
+                             for row in rows)
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+class ParquetWriter:
+    # One row group per chunk of rows; the schema is that of the first chunk.
+    def __init__(self, output, columns):
+        if not output:
+            sys.exit("Parquet output needs --output FILE.")
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            sys.exit("Parquet output needs the pyarrow package (pip install pyarrow).")
+        self.pyarrow = pyarrow
+        self.output = output
+        self.writer = None
+
+    def write(self, columns, rows):
+        table = self.pyarrow.table(dict(zip(columns, map(list, zip(*rows)))))
+        if self.writer is None:
+            self.writer = self.pyarrow.parquet.ParquetWriter(self.output, table.schema)
+        self.writer.write_table(table.cast(self.writer.schema))
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+WRITERS = {"csv": CsvWriter, "ndjson": NdjsonWriter, "parquet": ParquetWriter}
+
+
+def query_rows(dataset, query_number, ids, chunk_rows=WRITE_CHUNK_ROWS):
+    """Yields the rows of the given matches, with their query number first, a chunk at a time."""
+    for start in range(0, len(ids), chunk_rows):
+        chunk = ids[start:start + chunk_rows]
+        values = [dataset.values(name, chunk).tolist() for name in dataset.column_names]
+        yield [(query_number,) + row for row in zip(*values)]
+
+
+def main(args):
+    started = time.perf_counter()
+    dataset = NamesDataset.open(args.snapshot) if args.snapshot else load_current(args.path)[0]
+    index = NameIndex(dataset)
+    loaded = time.perf_counter() - started
+    print(f"Loaded {len(dataset)} rows in {loaded:.2f}s", file=sys.stderr)
+
+    columns = ["query"] + dataset.column_names
+    writer = WRITERS[args.format](args.output, columns)
+    lines = open(args.queries, encoding="utf-8") if args.queries else sys.stdin
+    query_count = row_count = 0
+    started = time.perf_counter()
+    try:
+        for results in search_batches(index, batches(read_queries(lines), args.batch_size), args.workers):
+            for ids in results:
+                if args.order == "frequency":
+                    ids = index.sort_by_frequency(ids) if args.limit is None else index.most_frequent(ids, args.limit)
+                if args.limit is not None:
+                    ids = ids[:args.limit]
+                for rows in query_rows(dataset, query_count, ids):
+                    writer.write(columns, rows)
+                query_count += 1
+                row_count += len(ids)
+    finally:
+        writer.close()
+        if lines is not sys.stdin:
+            lines.close()
+    elapsed = time.perf_counter() - started
+    print(f"{query_count} queries, {row_count} rows written ({args.format}) in {elapsed:.2f}s: "
+          f"{query_count / elapsed if elapsed else 0:.1f} queries/s, {row_count / elapsed if elapsed else 0:.0f} rows/s",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Search the names for many queries and export the matches.")
+    parser.add_argument("path", nargs="?", default="names.xlsx", help="the names workbook")
+    parser.add_argument("--snapshot", help="open this prebuilt snapshot instead of the workbook's")
+    parser.add_argument("--queries", help="file of queries, one JSON object or array per line (default: stdin)")
+    parser.add_argument("--output", help="file to write the matches to (default: stdout)")
+    parser.add_argument("--format", choices=FORMATS, default="csv")
+    parser.add_argument("--order", choices=ORDERS, default="file",
+                        help="order of each query's matches: as in the file, or most frequent first")
+    parser.add_argument("--limit", type=int, help="write at most this many matches per query")
+    parser.add_argument("--batch-size", type=int, default=256, help="queries searched together")
+    parser.add_argument("--workers", type=int, default=1, help="batches searched at once, on as many threads")
+    main(parser.parse_args())
@@ -0,0 +1,88 @@
+import os
+import zlib
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:  # Optional (pip install brotli): gzip only without it.
+    brotli = None
+
+# Responses worth compressing: result pages, JSON and NDJSON results, metrics.
+COMPRESSIBLE_TYPES = {"text/html", "application/json", "application/x-ndjson", "text/plain", "text/css",
+                      "application/javascript", "text/javascript"}
+
+# A streamed response is flushed every STREAM_FLUSH_SIZE bytes (before compression): the
+# client gets the rows as they come without every small chunk being compressed on its own.
+STREAM_FLUSH_SIZE = 64 * 1024
+
+
+def _compressor(encoding, config):
+    """Returns (compress, flush, finish) functions of a streaming compressor for the encoding."""
+    if encoding == "br":
+        compressor = brotli.Compressor(mode=brotli.MODE_TEXT, quality=config["COMPRESS_BROTLI_QUALITY"])
+        return compressor.process, compressor.flush, compressor.finish
+    # wbits 31: a gzip header and trailer around the deflate stream.
+    compressor = zlib.compressobj(config["COMPRESS_GZIP_LEVEL"], zlib.DEFLATED, 31)
+    return compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush
+
+
+def _compressed_stream(chunks, encoding, config):
+    """Yields the compressed chunks of a streamed response, flushed regularly so it keeps streaming."""
+    compress, flush, finish = _compressor(encoding, config)
+    pending = 0  # Bytes compressed since the last flush
+    try:
+        for chunk in chunks:
+            chunk = chunk.encode("utf-8") if isinstance(chunk, str) else chunk
+            data = compress(chunk)
+            pending += len(chunk)
+            if pending >= STREAM_FLUSH_SIZE:
+                data += flush()
+                pending = 0
+            if data:
+                yield data
+        yield finish()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def init_compression(app):
+    """
+    Compresses the app's responses with Brotli (if the brotli package is installed) or
+    gzip, whichever the client prefers among those it accepts.
+
+    Only text responses (HTML, JSON, NDJSON...) of at least COMPRESS_MIN_SIZE bytes
+    (NAMES_COMPRESS_MIN_SIZE, default 1024) are compressed: below that the headers cost
+    about as much as they save. Streamed responses (every result at once) are compressed
+    as they stream. COMPRESS_GZIP_LEVEL (NAMES_COMPRESS_GZIP_LEVEL, default 6) and
+    COMPRESS_BROTLI_QUALITY (NAMES_COMPRESS_BROTLI_QUALITY, default 5) trade CPU for size;
+    the repetitive markup of result pages compresses well at the fast settings already.
+    Static files are left alone, as they are cached by the browsers.
+    """
+    app.config.setdefault("COMPRESS_MIN_SIZE", int(os.environ.get("NAMES_COMPRESS_MIN_SIZE", 1024)))
+    app.config.setdefault("COMPRESS_GZIP_LEVEL", int(os.environ.get("NAMES_COMPRESS_GZIP_LEVEL", 6)))
+    app.config.setdefault("COMPRESS_BROTLI_QUALITY", int(os.environ.get("NAMES_COMPRESS_BROTLI_QUALITY", 5)))
+    encodings = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+    @app.after_request
+    def compress(response):
+        if (response.mimetype not in COMPRESSIBLE_TYPES or response.status_code != 200
+                or response.direct_passthrough or "Content-Encoding" in response.headers):
+            return response
+        response.vary.add("Accept-Encoding")
+        encoding = request.accept_encodings.best_match(encodings)
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = _compressed_stream(response.response, encoding, app.config)
+            response.headers.pop("Content-Length", None)
+        else:
+            data = response.get_data()
+            if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+                return response
+            compress, _, finish = _compressor(encoding, app.config)
+            response.set_data(compress(data) + finish())
+        response.headers["Content-Encoding"] = encoding
+        return response
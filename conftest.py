@@ -0,0 +1,24 @@
+"""
+Fixtures of the tests in tests/. Being at the top of the repository, this also makes its
+modules importable when running pytest from there.
+"""
+import pandas as pd
+import pytest
+
+# A small workbook with the columns of names.xlsx.
+ROWS = [
+    ("MARIA", 5600, "Spain", "Girl"),
+    ("Lucía", 3400, "Spain", "Girl"),
+    ("HUGO", 2900, "Spain", "Boy"),
+    ("Zoë", 800, "France", "Girl"),
+    ("Ærin", 35, "Denmark", "Boy"),
+    ("Ana", 5600, "Portugal", " girl "),
+]
+
+
+@pytest.fixture
+def workbook(tmp_path):
+    """Returns the path of a copy of the small workbook in a temporary directory."""
+    path = str(tmp_path / "names.xlsx")
+    pd.DataFrame(ROWS, columns=["Name", "Frequency", "Country", "Gender"]).to_excel(path, index=False)
+    return path
@@ -0,0 +1,348 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import names_data
+import names_delta
+from name_index import NameIndex
+from names_data import read_snapshot_header, snapshot_is_fresh, snapshot_path, source_version
+from names_delta import append_changes, apply_log, delta_path, load_current, read_changes
+from query_cache import QueryCache
+
+# How to load the dataset: at once, in a background thread, or at the first request.
+LOAD_MODES = ["now", "background", "lazy"]
+
+
+class DataNotReady(RuntimeError):
+    """
+    Raised when the dataset is needed but isn't loaded: its loading failed ('error' says
+    why), or it is still loading after 'wait' seconds.
+    """
+
+    def __init__(self, error=None):
+        super().__init__(error or "The names data is still loading")
+        self.error = error
+
+
+def _error_message(error):
+    """Returns what is recorded in 'last_error' for an error raised while loading."""
+    if isinstance(error, subprocess.CalledProcessError):
+        errors = error.stderr.decode(errors="replace").strip().splitlines()
+        return errors[-1] if errors else str(error)
+    return f"{type(error).__name__}: {error}"
+
+
+class DataManager:
+    """
+    Holds the current names dataset and its search index, and hot-reloads them when the
+    workbook changes.
+
+    A background thread polls the workbook's version (mtime and size) every 'interval'
+    seconds. On a change, the snapshot is rebuilt in a child process, so parsing the
+    workbook doesn't hold this process's GIL while it serves requests, and the new
+    snapshot is opened and indexed; then the new engine replaces the old one in a single
+    assignment. Requests read 'engine' once and keep using that engine (and its dataset)
+    until they finish, so in-flight requests complete on the old version.
+
+    If a reload fails (e.g. the workbook is still being written) the current version
+    keeps serving, the error is recorded in 'last_error' and the reload is retried at the
+    next poll.
+
+    Changes appended to the delta log (see names_delta.py), by upsert() or by another
+    process, are applied to the current dataset at the next poll without a reload, and
+    swapped in the same way. Once 'compact_changes' changes (NAMES_DELTA_COMPACT_CHANGES,
+    default 10000; 0 never compacts) are applied on top of the snapshot, they are
+    compacted into a new snapshot in a child process. Whenever the snapshot is replaced
+    (compacted, rebuilt or reset, by any process) the new one is opened, and when it is
+    rebuilt from the workbook the whole log is applied to it again.
+
+    With load="now" (the default) the dataset is loaded by the constructor, which raises
+    if it can't be. With "background" it is loaded on a thread started by the
+    constructor, and with "lazy" on one started by the first use of 'engine': either way
+    the constructor returns at once and a broken workbook doesn't prevent starting (e.g.
+    an app's import). Until it is loaded, 'engine' waits for it for up to 'wait' seconds
+    (NAMES_DATA_WAIT, default 30) and then raises DataNotReady, as it does right away if
+    loading failed; a failed load is retried at the next poll. 'ready' says whether it
+    is loaded.
+    """
+
+    def __init__(self, path="names.xlsx", interval=5.0, cache=None, compact_changes=None, load="now", wait=None):
+        if load not in LOAD_MODES:
+            raise ValueError(f"load must be one of {LOAD_MODES}")
+        self.path = path
+        self.interval = interval
+        self.cache = cache if cache is not None else QueryCache()
+        if compact_changes is None:
+            compact_changes = int(os.environ.get("NAMES_DELTA_COMPACT_CHANGES", 10_000))
+        self.compact_changes = compact_changes
+        self.reloads = 0
+        self.updates = 0
+        self.last_reload_seconds = None
+        self.last_update_seconds = None
+        self.last_error = None
+        self._reload_lock = threading.Lock()
+        self._compacting = threading.Lock()
+        self.wait = wait if wait is not None else float(os.environ.get("NAMES_DATA_WAIT", 30))
+        self._watcher_pid = None
+        self._start_lock = threading.Lock()  # So each process starts one loader and one watcher
+        self._stopped = threading.Event()
+        self._engine = None
+        # The loaded snapshot's version, and the delta log's id and offset of its next changes.
+        self._log_base, self._log, self._log_offset, self._log_changes = None, None, 0, 0
+        self.loaded_at = None
+        self._loader_pid = None    # Process whose loader thread is (or was) loading the dataset
+        self._loaded = threading.Event()  # Set when that thread is done, loaded or not
+
+        if load == "now":
+            started = time.perf_counter()
+            self._engine, self._log_base, self._log, self._log_offset, self._log_changes = self._load()
+            self.loaded_at = time.time()
+            self.last_reload_seconds = time.perf_counter() - started
+            self._loaded.set()
+        elif load == "background":
+            self._start_loading()
+
+    def _load(self):
+        """
+        Returns (engine, base, log, offset, changes): the engine of the snapshot with its
+        delta log applied, the snapshot's version, the log's id and offset and the number
+        of changes applied from the log.
+        """
+        dataset, base, log, offset, changes = load_current(self.path)
+        return NameIndex(dataset, cache=self.cache), base, log, offset, changes
+
+    def _load_latest(self):
+        """Same as _load(), after rebuilding the snapshot in a child process if the workbook changed."""
+        if not snapshot_is_fresh(self.path):
+            # Another worker may be rebuilding it already: the child waits on the
+            # snapshot lock and then finds it fresh.
+            subprocess.run([sys.executable, names_data.__file__, self.path, "--if-stale"],
+                           check=True, capture_output=True)
+        return self._load()
+
+    def _start_loading(self):
+        self._loader_pid = os.getpid()
+        self._loaded.clear()
+        threading.Thread(target=self._load_initial, name="names-data-loader", daemon=True).start()
+
+    def _load_initial(self):
+        started = time.perf_counter()
+        try:
+            # A stale snapshot is rebuilt in a child process, like on a reload, so the
+            # requests served in the meantime (e.g. the readiness probe) don't wait for the GIL.
+            loaded = self._load_latest()
+        except Exception as e:
+            self.last_error = _error_message(e)
+        else:
+            with self._reload_lock:
+                if self._engine is None:  # Unless a dataset was pinned in the meantime
+                    self._engine, self._log_base, self._log, self._log_offset, self._log_changes = loaded
+                    self.loaded_at = time.time()
+                    self.last_reload_seconds = time.perf_counter() - started
+                    self.last_error = None
+        finally:
+            self._loaded.set()
+
+    @property
+    def ready(self):
+        """True once the dataset is loaded."""
+        return self._engine is not None
+
+    @property
+    def engine(self):
+        """
+        The current search engine. Its 'dataset' is the dataset it searches.
+
+        Raises DataNotReady if the dataset isn't loaded (see the class docstring).
+        """
+        # The watcher is started lazily, so each worker forked from a preloading parent
+        # (threads don't survive fork) gets its own. So is the loader, if the dataset
+        # wasn't loaded before the fork.
+        engine = self._engine
+        pid = os.getpid()
+        if (engine is None and self._loader_pid != pid) or (self.interval and self._watcher_pid != pid):
+            # Concurrent first requests: only the first one starts them.
+            with self._start_lock:
+                if self._engine is None and self._loader_pid != pid:
+                    self._start_loading()
+                if self.interval and self._watcher_pid != pid:
+                    self.start()
+        if engine is None:
+            self._loaded.wait(self.wait)
+            engine = self._engine
+            if engine is None:
+                raise DataNotReady(self.last_error if self._loaded.is_set() else None)
+        return engine
+
+    @property
+    def dataset(self):
+        """The current dataset."""
+        return self.engine.dataset
+
+    @property
+    def version(self):
+        """Version of the current dataset (the workbook's version when it was loaded), None until it is loaded."""
+        return self._engine.dataset.version if self._engine is not None else None
+
+    def start(self):
+        """Starts the background thread that watches the workbook."""
+        self._watcher_pid = os.getpid()
+        self._stopped.clear()
+        threading.Thread(target=self._watch, name="names-data-watcher", daemon=True).start()
+
+    def stop(self):
+        """Stops watching the workbook."""
+        self._stopped.set()
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            if self._engine is None:
+                with self._start_lock:
+                    if self._engine is None and self._loaded.is_set():
+                        self._start_loading()  # The last attempt failed: try again.
+                continue
+            try:
+                changed = source_version(self.path) != self._engine.dataset.source
+            except OSError:
+                changed = False  # The workbook is being replaced: check again later.
+            if changed:
+                self.reload()
+            else:
+                self.refresh()
+
+    def pin(self, dataset):
+        """
+        Serves the given dataset from now on and stops watching the workbook (e.g. to run
+        the apps on a synthetic dataset in the benchmarks).
+        """
+        self.interval = 0
+        self.stop()
+        with self._reload_lock:
+            self._engine = NameIndex(dataset, cache=self.cache)
+            self.cache.clear()
+        self._loaded.set()
+
+    def _swap(self, engine):
+        previous = self._engine
+        self._engine = engine
+        if previous is not None and previous.dataset.version != engine.dataset.version:
+            # Results of the old version can't be hit any more (the key includes the
+            # version); drop them to free the memory.
+            self.cache.clear()
+
+    def reload(self):
+        """
+        Rebuilds the dataset and the index from the workbook and swaps them in.
+
+        Returns True if a new version was swapped in.
+        """
+        with self._reload_lock:
+            return self._reload()
+
+    def _reload(self):
+        started = time.perf_counter()
+        try:
+            engine, base, log, offset, changes = self._load_latest()
+        except Exception as e:
+            self.last_error = _error_message(e)
+            return False
+        self._swap(engine)
+        self._log_base, self._log, self._log_offset, self._log_changes = base, log, offset, changes
+        self.reloads += 1
+        self.last_error = None
+        self.loaded_at = time.time()
+        self.last_reload_seconds = time.perf_counter() - started
+        return True
+
+    def refresh(self):
+        """
+        Applies the changes appended to the delta log since the last refresh to the
+        current dataset and swaps the result in. When the snapshot was replaced (by this
+        process or another one: compacted, rebuilt from the workbook or reset) or the log
+        was reset, the new snapshot is opened instead.
+
+        Returns True if a new version was swapped in.
+        """
+        with self._reload_lock:
+            if self._engine is None:
+                return False  # Not loaded yet: the whole log is applied when it is.
+            started = time.perf_counter()
+            try:
+                try:
+                    header = read_snapshot_header(snapshot_path(self.path))
+                except FileNotFoundError:
+                    header = {}  # None could be written (a read-only directory).
+                # A snapshot of another workbook version is left to the workbook check.
+                if (header.get("source_version") == self._engine.dataset.source
+                        and header.get("dataset_version") != self._log_base):
+                    return self._reload()
+                changes, offset, log = read_changes(delta_path(self.path), self._log, self._log_offset)
+                if changes is None:
+                    return self._reload()
+                if not changes:
+                    return False
+                engine = NameIndex(apply_log(self._engine.dataset, changes, log, offset), cache=self.cache)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                return False
+            self._swap(engine)
+            self._log, self._log_offset = log, offset
+            self._log_changes += len(changes)
+            self.updates += 1
+            self.last_error = None
+            self.last_update_seconds = time.perf_counter() - started
+        if self.compact_changes and self._log_changes >= self.compact_changes:
+            self.compact_async(self.compact_changes)
+        return True
+
+    def upsert(self, changes):
+        """
+        Adds or updates rows (dicts with every column of the workbook, see names_delta.py)
+        and swaps in the dataset with them. Returns the number of changes.
+
+        The changes are appended to the delta log, so other processes serving the same
+        workbook apply them at their next poll and they survive restarts. Raises
+        ValueError if a change doesn't have the workbook's columns.
+        """
+        count = append_changes(self.path, changes)
+        self.refresh()
+        return count
+
+    def compact(self, min_changes=1):
+        """
+        Compacts the delta log into a new snapshot in a child process (see
+        names_delta.compact()), so building it doesn't hold this process's GIL, and opens
+        the new snapshot. Returns True if a new version was swapped in.
+        """
+        with self._compacting:
+            try:
+                subprocess.run([sys.executable, names_delta.__file__, "compact", self.path,
+                                "--min-changes", str(min_changes)], check=True, capture_output=True)
+            except subprocess.CalledProcessError as e:
+                self.last_error = _error_message(e)
+                return False
+        return self.refresh()
+
+    def compact_async(self, min_changes=1):
+        """Compacts the delta log in the background, unless a compaction is already running."""
+        if not self._compacting.locked():
+            threading.Thread(target=self.compact, args=(min_changes,), name="names-delta-compaction",
+                             daemon=True).start()
+
+    def stats(self):
+        """Returns whether the dataset is loaded, its version and the reload and update statistics."""
+        engine = self._engine
+        return {
+            "ready": engine is not None,
+            "version": engine.dataset.version if engine is not None else None,
+            "rows": len(engine.dataset) if engine is not None else None,
+            "loaded_at": self.loaded_at,
+            "last_reload_seconds": self.last_reload_seconds,
+            "reloads": self.reloads,
+            "updates": self.updates,
+            "last_update_seconds": self.last_update_seconds,
+            "log_changes": self._log_changes,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,206 @@
+import contextlib
+import cProfile
+import functools
+import os
+import pstats
+import random
+import threading
+import time
+
+from flask import Response, g, has_request_context, request
+
+from search_engine import CONDITIONS
+
+# Upper bounds (seconds) of the latency histogram buckets.
+BUCKETS = [0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+
+# Endpoints that are not instrumented.
+SKIPPED_ENDPOINTS = {"static", "metrics", "ready"}
+
+
+class Histogram:
+    """
+    A Prometheus-style latency histogram with labels. Safe to share between threads.
+
+    Every process keeps its own: with several workers, each one exposes its own /metrics.
+    """
+
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}  # label values -> [count per bucket (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, values, seconds):
+        """Records one observation for the given label values (a tuple, in 'labels' order)."""
+        index = next((i for i, bound in enumerate(self.buckets) if seconds <= bound), len(self.buckets))
+        with self._lock:
+            series = self._series.setdefault(values, [[0] * (len(self.buckets) + 1), 0.0])
+            series[0][index] += 1
+            series[1] += seconds
+
+    def render(self):
+        """Returns the histogram in the Prometheus text format, as a list of lines."""
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = sorted((values, list(counts), total) for values, (counts, total) in self._series.items())
+        for values, counts, total in series:
+            labels = ",".join(f'{label}="{value}"' for label, value in zip(self.labels, values))
+            cumulative = 0
+            for bound, count in zip(self.buckets + ["+Inf"], counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Times a stage of the current request (e.g. "parse", "search", "render").
+
+    The timings are sent in the response's Server-Timing header and recorded in the
+    names_search_stage_seconds histogram.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if "timings" in g:
+            g.timings.append((name, time.perf_counter() - started))
+
+
+def profiled(function):
+    """
+    Returns 'function', to be run on another thread (e.g. by the search pool), with the
+    current request's sampled profiling: when the request is profiled, it runs under a
+    profiler of its own, whose stats are added to the request's profile.
+    """
+    if not has_request_context() or g.get("profiler") is None:
+        return function
+    profiles = g.thread_profiles
+
+    @functools.wraps(function)
+    def run(*args, **kwargs):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # The request's profiler already sees every thread (Python 3.12+).
+            return function(*args, **kwargs)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profiler.disable()
+            profiles.append(profiler)
+
+    return run
+
+
+def set_condition(condition):
+    """Labels the current request's metrics with its length condition."""
+    g.condition = condition if condition in CONDITIONS else "other"
+
+
+def init_instrumentation(app, cache=None):
+    """
+    Records per-stage timings of every request of the app.
+
+    - Server-Timing header with the stages timed with stage() and the total so far (for
+      streamed responses, the rows rendered while streaming come after the header).
+    - /metrics, in the Prometheus text format: histograms of the stage and whole request
+      durations per endpoint and condition, and the counters of the result cache if given.
+    - Sampled profiling, opt-in: with PROFILE_DIR set in the app config (or the
+      NAMES_PROFILE_DIR environment variable), PROFILE_SAMPLE_RATE of the requests
+      (NAMES_PROFILE_SAMPLE_RATE, default 0.01) run under cProfile, and those that take at
+      least PROFILE_MIN_SECONDS (NAMES_PROFILE_MIN_SECONDS, default 0.1) are dumped to
+      PROFILE_DIR. Only the PROFILE_KEEP (NAMES_PROFILE_KEEP, default 50) slowest are kept.
+      Open them with python -m pstats or snakeviz. Work run on other threads through
+      profiled() (the search pool's) is included.
+    """
+    app.config.setdefault("PROFILE_DIR", os.environ.get("NAMES_PROFILE_DIR"))
+    app.config.setdefault("PROFILE_SAMPLE_RATE", float(os.environ.get("NAMES_PROFILE_SAMPLE_RATE", 0.01)))
+    app.config.setdefault("PROFILE_MIN_SECONDS", float(os.environ.get("NAMES_PROFILE_MIN_SECONDS", 0.1)))
+    app.config.setdefault("PROFILE_KEEP", int(os.environ.get("NAMES_PROFILE_KEEP", 50)))
+
+    stages = Histogram("names_search_stage_seconds", "Duration of each stage of a request.",
+                       ("endpoint", "condition", "stage"))
+    requests = Histogram("names_search_request_seconds", "Duration of a request, until its response is sent.",
+                         ("endpoint", "condition", "status"))
+
+    def instrumented():
+        return request.endpoint is not None and request.endpoint not in SKIPPED_ENDPOINTS
+
+    @app.before_request
+    def start_timing():
+        if not instrumented():
+            return
+        g.started = time.perf_counter()
+        g.timings = []
+        g.condition = "none"
+        g.profiler = None
+        g.thread_profiles = []
+        if app.config["PROFILE_DIR"] and random.random() < app.config["PROFILE_SAMPLE_RATE"]:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                return  # Another profiler is running (e.g. under a debugger).
+            g.profiler = profiler
+
+    @app.after_request
+    def finish_timing(response):
+        if "timings" not in g:
+            return response
+        total = time.perf_counter() - g.started
+        metrics = [f"{name};dur={seconds * 1000:.3f}" for name, seconds in g.timings]
+        response.headers["Server-Timing"] = ", ".join(metrics + [f"total;dur={total * 1000:.3f}"])
+
+        endpoint, condition, started, profiler = request.endpoint, g.condition, g.started, g.profiler
+        thread_profiles = g.thread_profiles
+        for name, seconds in g.timings:
+            stages.observe((endpoint, condition, name), seconds)
+
+        def finished():
+            # Called once the response has been sent, streamed ones included.
+            duration = time.perf_counter() - started
+            requests.observe((endpoint, condition, str(response.status_code)), duration)
+            if profiler is not None and duration >= app.config["PROFILE_MIN_SECONDS"]:
+                save_profile(profiler, thread_profiles, endpoint, duration)
+
+        response.call_on_close(finished)
+        return response
+
+    @app.teardown_request
+    def stop_profiler(exception):
+        # In the thread that enabled the profiler (disabling it stops the current thread's
+        # profiling), and even if the response is never closed. Streamed responses keep
+        # the request context until they end (stream_with_context), so they are included.
+        if g.get("profiler") is not None:
+            g.profiler.disable()
+
+    def save_profile(profiler, thread_profiles, endpoint, duration):
+        directory = app.config["PROFILE_DIR"]
+        os.makedirs(directory, exist_ok=True)
+        stats = pstats.Stats(profiler)
+        for thread_profile in list(thread_profiles):
+            stats.add(thread_profile)
+        # The duration leads the name, so sorting the names sorts the profiles by duration.
+        stats.dump_stats(os.path.join(directory, f"{duration * 1000:012.3f}ms-{endpoint}-{time.time_ns()}.prof"))
+        profiles = sorted(name for name in os.listdir(directory) if name.endswith(".prof"))
+        for name in profiles[:-app.config["PROFILE_KEEP"]]:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(directory, name))
+
+    @app.route("/metrics")
+    def metrics():
+        lines = stages.render() + requests.render()
+        if cache is not None:
+            for name, value in cache.stats().items():
+                kind = "counter" if name in ("hits", "misses", "evictions", "expirations") else "gauge"
+                metric = f"names_search_cache_{name}" + ("_total" if kind == "counter" else "")
+                lines += [f"# TYPE {metric} {kind}", f"{metric} {value}"]
+        return Response("\n".join(lines) + "\n", mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,151 @@
+"""
+Load test of the search API under mixed traffic: cheap queries (a few letters on a
+given length, answered from the index or the cache) sent alongside expensive ones (wide
+"between" ranges, a different one every time so the cache can't answer them).
+
+Usage: python load_test.py [--server asgi|wsgi] [--url URL] [--rows N] [--duration SECONDS]
+                           [--cheap-clients N] [--expensive-clients N] [--pool-workers N]
+
+Unless --url points at a running server, it starts flask_app.py under uvicorn (asgi.py)
+or under the threaded Flask development server (wsgi), on a synthetic dataset of --rows
+rows built like benchmark.py's (1M by default; 0 serves names.xlsx) and with
+--pool-workers search pool threads (0 runs every search in its request's thread,
+without the pool's limits).
+Each client sends requests back to back; latency percentiles are reported per kind of
+query, with the number of requests rejected (503) or timed out (504).
+"""
+import argparse
+import itertools
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+
+CHEAP_QUERIES = [
+    "condition=equal&num_letters=5&letters=&letters=a&gender=Girl",
+    "condition=equal&num_letters=6&letters=m&gender=Any",
+    "condition=equal_or_lower&num_letters=4&letters=&letters=&letters=n&gender=Boy",
+]
+
+
+def expensive_queries():
+    # Every name length, with a different upper bound each time.
+    for upper_bound in itertools.count(30):
+        yield f"condition=between&num_letters_lower=1&num_letters_upper={upper_bound}&gender=Any"
+
+
+def serve(kind, port, rows):
+    """Serves flask_app.py on a synthetic dataset of 'rows' rows (or names.xlsx if 0)."""
+    import flask_app
+    from data_manager import DataManager
+    data = DataManager()
+    if rows:
+        from benchmark import synthetic_dataset
+        data.pin(synthetic_dataset(data.dataset, rows, np.random.default_rng(0)))
+    app = flask_app.create_app(data)
+    if kind == "asgi":
+        import uvicorn
+        from a2wsgi import WSGIMiddleware
+        import asgi
+        uvicorn.run(WSGIMiddleware(app, workers=asgi.HANDLER_THREADS), port=port, log_level="warning")
+    else:
+        app.run(port=port, threaded=True)
+
+
+def start_server(kind, port, pool_workers, rows):
+    env = dict(os.environ, NAMES_SEARCH_WORKERS=str(pool_workers))
+    command = [sys.executable, __file__, "--serve", kind, "--port", str(port), "--rows", str(rows)]
+    server = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(300):
+        try:
+            urllib.request.urlopen(url + "/stats/data", timeout=1).read()
+            return server, url
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise RuntimeError(f"The {kind} server didn't start")
+
+
+def client(url, queries, stop, results):
+    for query in queries:
+        if stop.is_set():
+            return
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(f"{url}/api/search?{query}", timeout=60) as response:
+                response.read()
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        results.append((status, time.perf_counter() - started))
+
+
+def report(kind, results):
+    latencies = np.array([seconds for status, seconds in results if status == 200]) * 1000
+    statuses = [status for status, _ in results]
+    line = f"  {kind:<10} {len(results):>8} {statuses.count(503):>6} {statuses.count(504):>6}"
+    if len(latencies):
+        line += "".join(f" {np.percentile(latencies, p):>9.1f}" for p in (50, 95, 99)) + f" {latencies.max():>9.1f}"
+    print(line)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the search API with cheap and expensive queries.")
+    parser.add_argument("--server", choices=["asgi", "wsgi"], default="asgi")
+    parser.add_argument("--url", help="test this running server instead of starting one")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--pool-workers", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--cheap-clients", type=int, default=8)
+    parser.add_argument("--expensive-clients", type=int, default=8)
+    parser.add_argument("--rows", type=int, default=1_000_000,
+                        help="rows of the synthetic dataset served (0 serves names.xlsx)")
+    parser.add_argument("--serve", choices=["asgi", "wsgi"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port, args.rows)
+        sys.exit(0)
+
+    server = None
+    if args.url:
+        url = args.url.rstrip("/")
+    else:
+        server, url = start_server(args.server, args.port, args.pool_workers, args.rows)
+    try:
+        stop = threading.Event()
+        cheap, expensive = [], []
+        shared = expensive_queries()
+        lock = threading.Lock()
+
+        def next_expensive():
+            while True:
+                with lock:
+                    query = next(shared)
+                yield query
+
+        threads = [threading.Thread(target=client, args=(url, itertools.cycle(CHEAP_QUERIES), stop, cheap))
+                   for _ in range(args.cheap_clients)]
+        threads += [threading.Thread(target=client, args=(url, next_expensive(), stop, expensive))
+                    for _ in range(args.expensive_clients)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        served = args.url or f"{args.server}, {args.rows or 'names.xlsx'} rows, pool workers: {args.pool_workers}"
+        print(f"{served}, {args.duration:.0f}s:")
+        print(f"  {'queries':<10} {'requests':>8} {'503':>6} {'504':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        report("cheap", cheap)
+        report("expensive", expensive)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
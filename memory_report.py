@@ -0,0 +1,100 @@
+"""
+Reports resident and shared memory per worker process, for the old and the new way of
+holding the names dataset:
+
+  - frame: every worker holds a pandas DataFrame of the names (the old module-level df)
+    and scans it with df.iterrows().
+  - mmap: every worker opens the memory-mapped snapshot and builds a NameIndex on it.
+
+Usage: python memory_report.py [--workers N] [--preload] [--columns] [names.xlsx]
+
+With --preload the data is loaded once in the parent and the workers are forked from it,
+like gunicorn --preload; otherwise every worker loads the data itself.
+
+With --columns it only reports the size of each column: in the workbook's DataFrame (one
+Python string per cell of Name, Country and Gender) and in the dataset (a string buffer for
+Name, integer codes plus a label table for Country and Gender, a fixed-width Frequency),
+plus the search arrays built on top of them.
+"""
+import argparse
+import multiprocessing
+
+from name_index import NameIndex
+from names_data import load_dataset, memory_usage, read_workbook
+from search_engine import matches_name
+
+QUERY = ("equal", 5, ["", "a", "", "i", ""], "Girl")
+
+
+def load(mode, path):
+    if mode == "frame":
+        return load_dataset(path).to_frame()
+    return NameIndex(load_dataset(path))
+
+
+def serve(mode, data):
+    """Runs a search the way the app does in this mode."""
+    condition, numbers, letters, gender = QUERY
+    if mode == "frame":
+        return [row.to_dict() for _, row in data.iterrows()
+                if str(row["Gender"]).strip().lower() == gender.lower()
+                and matches_name(row["Name"], condition, numbers, letters)]
+    return data.search(condition, numbers, letters, gender).to_dict("records")
+
+
+def worker(mode, path, preloaded, queue):
+    data = preloaded if preloaded is not None else load(mode, path)
+    serve(mode, data)
+    queue.put(memory_usage())
+
+
+def report(mode, path, workers, preload):
+    preloaded = load(mode, path) if preload else None
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    processes = [context.Process(target=worker, args=(mode, path, preloaded, queue)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    usages = [queue.get() for _ in processes]
+    for process in processes:
+        process.join()
+
+    print(f"{mode}{' (preload)' if preload else ''}:")
+    print(f"  {'worker':>6} {'rss MB':>8} {'shared MB':>10} {'private MB':>11} {'pss MB':>8}")
+    for i, usage in enumerate(usages):
+        print(f"  {i:>6} {usage['rss'] / 2**20:>8.1f} {usage['shared'] / 2**20:>10.1f} "
+              f"{usage['private'] / 2**20:>11.1f} {usage['pss'] / 2**20:>8.1f}")
+    print(f"  total pss: {sum(usage['pss'] for usage in usages) / 2**20:.1f} MB")
+
+
+def column_report(path):
+    frame = read_workbook(path)
+    dataset = load_dataset(path)
+    frame_bytes = frame.memory_usage(index=False, deep=True)
+    print(f"{path}, {len(dataset)} rows:")
+    print(f"  {'column':<10} {'frame MB':>9} {'dataset MB':>11}  stored as")
+    for name in dataset.column_names:
+        entry = dataset.column(name)
+        arrays = [array for key, array in dataset.arrays.items() if key.startswith(f"{name}.")]
+        stored = ", ".join(f"{array.dtype}" for array in arrays)
+        if entry["kind"] == "categorical":
+            stored += f" codes, {len(entry['labels'])} labels"
+        print(f"  {name:<10} {frame_bytes[name] / 2**20:>9.2f} {sum(array.nbytes for array in arrays) / 2**20:>11.2f}  {stored}")
+    columns = sum(array.nbytes for key, array in dataset.arrays.items() if not key.startswith("search."))
+    search = sum(array.nbytes for key, array in dataset.arrays.items() if key.startswith("search."))
+    print(f"  {'total':<10} {frame_bytes.sum() / 2**20:>9.2f} {columns / 2**20:>11.2f}")
+    print(f"  search arrays (lengths, chars, frequency order, posting lists): {search / 2**20:.2f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report memory per worker for the frame and mmap datasets.")
+    parser.add_argument("path", nargs="?", default="names.xlsx")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--preload", action="store_true")
+    parser.add_argument("--columns", action="store_true", help="only report the size of each column")
+    args = parser.parse_args()
+    if args.columns:
+        column_report(args.path)
+        raise SystemExit
+    for mode in ("frame", "mmap"):
+        report(mode, args.path, args.workers, args.preload)
@@ -0,0 +1,103 @@
+import numpy as np
+
+# Largest edit distance a similar-name search accepts: further than that, most short
+# names are "similar" to each other.
+MAX_DISTANCE = 3
+
+
+def edit_distance(a, b):
+    """
+    Returns the Levenshtein distance between two strings: the number of characters to
+    insert, delete or replace to turn one into the other.
+
+    This is the reference (one pair at a time) implementation; edit_distances() must give
+    the same answers.
+    """
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        current = [i]
+        for j, other in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other)))
+        previous = current
+    return previous[-1]
+
+
+def letter_counts(chars, query, max_distance, rows=slice(None)):
+    """
+    Returns, for every row, how many characters of the query the row's name has within
+    max_distance positions of theirs.
+
+    A name within max_distance edits of the query keeps at least len(query) - max_distance
+    of the query's characters, each shifted by at most max_distance positions, so rows
+    with fewer can be left out without computing their distance.
+
+    Parameters:
+      - chars: the dataset's lowercased characters, one row per position
+      - query: the lowercased name looked for
+      - rows: the rows to count (all by default), a slice or an array of row ids
+    """
+    width = chars.shape[0]
+    count = len(range(chars.shape[1])[rows]) if isinstance(rows, slice) else len(rows)
+    counts = np.zeros(count, dtype=np.uint8 if len(query) < 256 else np.int64)
+    for i, char in enumerate(query):
+        code = ord(char)
+        if code > np.iinfo(chars.dtype).max:
+            continue  # No name has it.
+        hit = np.zeros(count, dtype=bool)
+        for position in range(max(i - max_distance, 0), min(i + max_distance + 1, width)):
+            hit |= chars[position][rows] == code
+        counts += hit
+    return counts
+
+
+def edit_distances(columns, row_lengths, query, max_distance):
+    """
+    Returns the edit distance between the query and the name of every row, or
+    max_distance + 1 for the rows further than max_distance.
+
+    Parameters:
+      - columns: the rows' lowercased characters, one row per position, 0-padded
+      - row_lengths: the length of the rows' lowercased names
+      - query: the lowercased name looked for
+    """
+    # The dynamic programming table of all the rows at once, one query character at a
+    # time. Only its band of 2 * max_distance + 1 diagonals can hold distances up to
+    # max_distance, so only those are kept (band[b] is D[i][i + b - max_distance]), and
+    # every value is capped at max_distance + 1.
+    far = max_distance + 1
+    codes = [ord(char) for char in query]
+    width, count = columns.shape
+    result = np.full(count, far, dtype=np.int8)
+    rows = np.arange(count)
+    band = [np.full(count, d if 0 <= d < far else far, dtype=np.int8) for d in range(-max_distance, far)]
+    for i in range(1, len(codes) + 1):
+        following = []
+        for b, d in enumerate(range(-max_distance, far)):
+            j = i + d
+            if j <= 0:
+                cell = np.full(len(rows), min(i, far) if j == 0 else far, dtype=np.int8)
+            else:
+                # Replace (or keep) the j-th character, delete the query's i-th character
+                # or insert the name's j-th character.
+                cell = band[b] + (columns[j - 1] != codes[i - 1] if j <= width else np.int8(1))
+                if b + 1 < len(band):
+                    np.minimum(cell, band[b + 1] + 1, out=cell)
+                if b:
+                    np.minimum(cell, following[b - 1] + 1, out=cell)
+                np.minimum(cell, far, out=cell)
+            following.append(cell)
+        band = following
+        # A row whose whole band is past max_distance can't come back: drop those rows
+        # once they are half of them.
+        live = np.minimum.reduce(band) < far
+        remaining = np.count_nonzero(live)
+        if not remaining:
+            return result
+        if remaining * 2 < len(rows):
+            rows, columns, row_lengths = rows[live], columns[:, live], row_lengths[live]
+            band = [cell[live] for cell in band]
+    # The distance to a name of length n is D[len(query)][n], on diagonal n - len(query).
+    diagonal = row_lengths.astype(np.int64) - len(codes) + max_distance
+    inside = (diagonal >= 0) & (diagonal < len(band))
+    result[rows[inside]] = np.stack(band)[diagonal[inside], np.flatnonzero(inside)]
+    return result
@@ -0,0 +1,186 @@
+import numpy as np
+
+from name_pattern import read_pattern
+from search_engine import SearchEngine, normalize_label
+
+EMPTY = np.zeros(0, dtype=np.int64)
+
+# Queries whose candidates would be more than this fraction of the rows scan every row.
+SCAN_FRACTION = 0.1
+
+
+class NameIndex(SearchEngine):
+    """
+    Inverted index over the names.
+
+    Maps (position, lowercase character), name length and normalized gender to sorted
+    arrays of row ids, so a query like "5 letters, 2nd = 'a', 4th = 'i', Girl" only looks
+    at the names with 5 letters (or with 'a' second, if fewer) instead of every name.
+
+    Results are the same as SearchEngine (and matches_name()).
+    """
+
+    def __init__(self, dataset, cache=None, workers=None):
+        super().__init__(dataset, cache, workers)
+        # The posting lists are precomputed by the dataset (and memory-mapped with it).
+        self.by_length = dataset.postings("length")
+        # Labels that only differ in case or spaces share one posting list.
+        self.by_gender = {}
+        for code, ids in dataset.postings("gender").items():
+            label = self.gender_labels[code]
+            self.by_gender[label] = np.union1d(self.by_gender[label], ids) if label in self.by_gender else ids
+        self.by_position = {(position, chr(code)): ids for (position, code), ids in dataset.postings("position").items()}
+
+    def length_ids(self, lower_bound, upper_bound):
+        """Returns the sorted row ids of the names with lower_bound <= length <= upper_bound."""
+        parts = [ids for length, ids in self.by_length.items() if lower_bound <= length <= upper_bound]
+        if not parts:
+            return EMPTY
+        if len(parts) == 1:
+            return parts[0]
+        return np.sort(np.concatenate(parts))
+
+    def length_count(self, lower_bound, upper_bound):
+        """Returns the number of names with lower_bound <= length <= upper_bound."""
+        return sum(len(ids) for length, ids in self.by_length.items() if lower_bound <= length <= upper_bound)
+
+    def position_ids(self, position, letter):
+        """Returns the sorted row ids of the names with 'letter' at 'position'."""
+        return self.by_position.get((position, letter), EMPTY)
+
+    def gender_ids(self, gender):
+        """Returns the sorted row ids of the rows with the given gender (ignoring case and spaces)."""
+        return self.by_gender.get(normalize_label(gender), EMPTY)
+
+    def length_bounds(self, condition, numbers, pattern=None):
+        """
+        Returns the (lower, upper) bounds of the name lengths the condition (and the
+        pattern, if any) accepts, or None.
+        """
+        if condition == "equal":
+            bounds = numbers, numbers
+        elif condition == "equal_or_lower":
+            bounds = 0, numbers
+        elif condition == "equal_or_higher":
+            bounds = numbers, self.chars.shape[0]
+        elif condition == "between":
+            bounds = tuple(numbers)
+        else:
+            return None
+        pattern = read_pattern(pattern)
+        if pattern is not None and not len(self.uneven_ids):
+            # A pattern measures the lowercased name, as long as the name unless it is uneven.
+            lower, upper = pattern.length_bounds()
+            bounds = max(bounds[0], lower), bounds[1] if upper is None else min(bounds[1], upper)
+        return bounds
+
+    def required_letters(self, condition, numbers, letters, pattern=None):
+        """
+        Returns the (position, letter) pairs every match has: the letter filters for
+        "equal" and "equal_or_higher" (which only check positions every candidate has) and
+        the letters at the start of the pattern.
+        """
+        required = []
+        if condition in ("equal", "equal_or_higher"):
+            required += self.letter_filters(condition, numbers, letters)
+        pattern = read_pattern(pattern)
+        if pattern is not None:
+            required += [letter for letter in pattern.letters if letter not in required]
+        return required
+
+    def estimate(self, condition, numbers, letters, gender="Any", countries=None, pattern=None):
+        """
+        Returns an upper bound of the number of rows match_ids() looks at for the query:
+        the names whose length meets the condition (and the pattern's), or the names with
+        the most selective required letter (see required_letters()) if there are fewer, or
+        the rows of the selected countries if there are fewer still.
+        """
+        bounds = self.length_bounds(condition, numbers, pattern)
+        if bounds is None:
+            return 0
+        count = self.length_count(*bounds)
+        for position, letter in self.required_letters(condition, numbers, letters, pattern):
+            count = min(count, len(self.position_ids(position, letter)))
+        return min(count, self.country_count(countries))
+
+    def match_ids(self, condition, numbers, letters, gender="Any", countries=None, pattern=None, trace=None):
+        """
+        Returns the sorted row ids of the rows that match the query.
+
+        Parameters are the same as SearchEngine.match_ids(). If 'trace' is a list, a
+        (step, candidates left) pair is appended to it after every step of the plan.
+
+        The candidates are the smallest posting list that every match must be in (the
+        names of the right length, or of the rarest required letter); the other filters
+        are then checked on the candidates' own rows, and the pattern, if any, last. When
+        the candidates would be more than SCAN_FRACTION of the rows, or the selected
+        countries' partitions are smaller, the partitions (every row without a country
+        filter) are scanned instead, in parallel on large datasets, as that is faster than
+        gathering the candidates.
+        """
+        def record(step, ids):
+            if trace is not None:
+                trace.append((step, len(ids)))
+            return ids
+
+        pattern = read_pattern(pattern)
+        bounds = self.length_bounds(condition, numbers, pattern)
+        if bounds is None:
+            return record(f"length {condition} {numbers}", EMPTY)
+        estimate = self.estimate(condition, numbers, letters, gender, countries, pattern)
+        if estimate > len(self) * SCAN_FRACTION or estimate >= self.country_count(countries):
+            selected = self.selected_countries(countries)
+            step = "scan" if selected is None else f"scan country in {', '.join(selected)}"
+            return record(step, SearchEngine.match_ids(self, condition, numbers, letters, gender, countries, pattern))
+
+        lower_bound, upper_bound = bounds
+        filters = self.letter_filters(condition, numbers, letters)
+        required = self.required_letters(condition, numbers, letters, pattern)
+        rarest = None
+        if required:
+            # Every match has every required letter: start from the rarest one if fewer names have it.
+            rarest = min(required, key=lambda f: len(self.position_ids(*f)))
+            if len(self.position_ids(*rarest)) >= self.length_count(lower_bound, upper_bound):
+                rarest = None
+        if rarest is None:
+            candidates = record(f"length {condition} {numbers}", self.length_ids(lower_bound, upper_bound))
+        else:
+            ids = self.position_ids(*rarest)
+            lengths = self.lengths[ids]
+            candidates = ids[(lengths >= lower_bound) & (lengths <= upper_bound)]
+            if rarest in filters:
+                filters.remove(rarest)
+            candidates = record(f"letter {rarest[0] + 1} = {rarest[1]!r}, length {condition} {numbers}", candidates)
+
+        if gender != "Any":
+            candidates = record(f"gender = {gender}", candidates[self.gender_mask(gender, candidates)])
+        selected = self.selected_countries(countries)
+        if selected is not None and self.country_count(selected) < len(self):
+            candidates = record(f"country in {', '.join(selected)}", candidates[self.country_mask(selected, candidates)])
+        for position, letter in filters:
+            if not len(candidates):
+                break
+            # Names that end before this position are not checked against it.
+            candidates = record(f"letter {position + 1} = {letter!r}", candidates[self.position_mask(position, letter, candidates)])
+        if pattern is not None and len(candidates):
+            candidates = record(f"pattern {pattern.source!r}",
+                                candidates[pattern.match_rows(self.chars, self.lengths, candidates, self.uneven_ids)])
+        return candidates
+
+    def top_ids(self, condition, numbers, letters, gender="Any", countries=None, pattern=None, k=10):
+        """
+        Returns the row ids of the k most frequent matches, most frequent first.
+
+        Queries with few candidates are answered from the index and the matches sorted;
+        the others are checked in Frequency order until k matches are found (see
+        SearchEngine.top_ids()).
+        """
+        if self.estimate(condition, numbers, letters, gender, countries, pattern) > len(self) * SCAN_FRACTION:
+            return super().top_ids(condition, numbers, letters, gender, countries, pattern, k)
+        return self.most_frequent(self.match_ids(condition, numbers, letters, gender, countries, pattern), k)
+
+    def explain(self, condition, numbers, letters, gender="Any", countries=None, pattern=None):
+        """Returns the (step, candidates left) pairs of the query plan, for checking the speedup."""
+        trace = []
+        self.match_ids(condition, numbers, letters, gender, countries, pattern, trace=trace)
+        return trace
@@ -0,0 +1,407 @@
+import functools
+import re
+
+import numpy as np
+
+# Pattern syntaxes: shell-style globs and a limited regular expression syntax.
+SYNTAXES = ["glob", "regex"]
+
+# A character class: (code point ranges, negated), the ranges being (low, high) pairs,
+# merged and sorted. ANY matches every character, ANY_RUN is the "any characters" token
+# (glob *, regex .*).
+ANY = (frozenset(), True)
+ANY_RUN = (ANY, "*")
+
+# Limits of a pattern: the count of a regex {m,n} repetition, and the number of tokens
+# once repetitions are expanded (names are much shorter: longer patterns can't match).
+MAX_REPEAT = 100
+MAX_TOKENS = 256
+
+
+class PatternError(ValueError):
+    """Raised for a pattern that can't be compiled."""
+
+
+def _lower(char):
+    # Names are compared lowercased, one character per position (see SearchEngine).
+    lowered = char.lower()
+    return lowered if len(lowered) == 1 else char
+
+
+def _merged(ranges):
+    """Returns code point ranges merged (overlapping or adjacent ones) and sorted, as a frozenset."""
+    merged = []
+    for low, high in sorted(ranges):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], high)
+        else:
+            merged.append([low, high])
+    return frozenset((low, high) for low, high in merged)
+
+
+def _char_class(char):
+    """Returns the class of a single (lowercased) character."""
+    code = ord(_lower(char))
+    return frozenset([(code, code)]), False
+
+
+def _parse_class(pattern, i):
+    """Parses the [...] class starting at pattern[i]. Returns (class, index after it)."""
+    i += 1
+    negated = i < len(pattern) and pattern[i] in "!^"
+    if negated:
+        i += 1
+    ranges = []
+    first = True
+    while i < len(pattern) and (pattern[i] != "]" or first):
+        first = False
+        char = pattern[i]
+        if char == "\\" and i + 1 < len(pattern):
+            i += 1
+            char = pattern[i]
+        if i + 2 < len(pattern) and pattern[i + 1] == "-" and pattern[i + 2] != "]":
+            low, high = _lower(char), _lower(pattern[i + 2])
+            if low > high:
+                raise PatternError(f"Invalid range {char}-{pattern[i + 2]} in {pattern!r}")
+            ranges.append((ord(low), ord(high)))
+            i += 3
+        else:
+            ranges.append((ord(_lower(char)),) * 2)
+            i += 1
+    if i >= len(pattern):
+        raise PatternError(f"Unterminated character class in {pattern!r}")
+    return (_merged(ranges), negated), i + 1
+
+
+def _glob_tokens(pattern):
+    """
+    Returns the tokens of a glob: * (any characters), ? (one character), [abc], [a-z],
+    [!abc] (one character in or not in the class); \\ escapes the next character. Globs
+    match the whole name.
+    """
+    tokens = []
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == "*":
+            tokens.append(ANY_RUN)
+            i += 1
+        elif char == "?":
+            tokens.append((ANY, "1"))
+            i += 1
+        elif char == "[":
+            cls, i = _parse_class(pattern, i)
+            tokens.append((cls, "1"))
+        else:
+            if char == "\\" and i + 1 < len(pattern):
+                i += 1
+                char = pattern[i]
+            tokens.append((_char_class(char), "1"))
+            i += 1
+        if len(tokens) > MAX_TOKENS:
+            raise PatternError(f"Pattern too long (more than {MAX_TOKENS} characters): {pattern!r}")
+    return tokens
+
+
+def _regex_tokens(pattern):
+    """
+    Returns the tokens of a limited regular expression: literal characters, . and [...]
+    classes, each optionally followed by ?, *, + or {m}, {m,}, {m,n}; ^ and $ anchor it
+    at the start and the end of the name (otherwise it can match anywhere in the name);
+    \\ escapes a punctuation character. Groups and alternation are not supported.
+    """
+    source = pattern
+    start_anchored = pattern.startswith("^")
+    end_anchored = pattern.endswith("$") and not pattern.endswith("\\$")
+    pattern = pattern[1 if start_anchored else 0:len(pattern) - 1 if end_anchored else len(pattern)]
+    tokens = [] if start_anchored else [ANY_RUN]
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char in "()|":
+            raise PatternError(f"Groups and alternation are not supported: {source!r}")
+        if char in "?*+{":
+            raise PatternError(f"Nothing to repeat at position {i + 1} of {source!r}")
+        if char in "^$":
+            raise PatternError(f"^ and $ are only allowed at the start and the end: {source!r}")
+        if char == ".":
+            cls = ANY
+            i += 1
+        elif char == "[":
+            cls, i = _parse_class(pattern, i)
+        else:
+            if char == "\\":
+                if i + 1 >= len(pattern) or pattern[i + 1].isalnum():
+                    raise PatternError(f"Unsupported escape in {source!r}")
+                i += 1
+                char = pattern[i]
+            cls = _char_class(char)
+            i += 1
+
+        low, high = 1, 1
+        if i < len(pattern) and pattern[i] in "?*+":
+            low, high = {"?": (0, 1), "*": (0, None), "+": (1, None)}[pattern[i]]
+            i += 1
+        elif i < len(pattern) and pattern[i] == "{":
+            match = re.match(r"\{(\d+)(,(\d*))?\}", pattern[i:])
+            if match is None:
+                raise PatternError(f"Invalid repetition in {source!r}")
+            low = int(match.group(1))
+            high = low if match.group(2) is None else (int(match.group(3)) if match.group(3) else None)
+            if high is not None and high < low:
+                raise PatternError(f"Invalid repetition in {source!r}")
+            if max(low, high or 0) > MAX_REPEAT:
+                raise PatternError(f"Repetitions are limited to {MAX_REPEAT}: {source!r}")
+            i += match.end()
+        tokens += [(cls, "1")] * low
+        tokens += [(cls, "*")] if high is None else [(cls, "?")] * (high - low)
+        if len(tokens) > MAX_TOKENS:
+            raise PatternError(f"Pattern too long (more than {MAX_TOKENS} characters): {source!r}")
+    if not end_anchored:
+        tokens.append(ANY_RUN)
+    return tokens
+
+
+def _class_mask(cls, codes):
+    """Returns a boolean mask of the code points (0 is the padding after a name) in the class."""
+    ranges, negated = cls
+    if len(ranges) > 2 and codes.dtype.itemsize <= 2:
+        # A lookup table over every code point of the array's type.
+        table = np.zeros(2 ** (8 * codes.dtype.itemsize), dtype=bool)
+        for low, high in ranges:
+            table[low:high + 1] = True
+        hit = table[codes]
+    else:
+        hit = np.zeros(len(codes), dtype=bool)
+        for low, high in ranges:
+            hit |= (codes == low) if low == high else (codes >= low) & (codes <= high)
+    return (~hit & (codes != 0)) if negated else hit
+
+
+def _class_regex(cls):
+    ranges, negated = cls
+    if cls == ANY:
+        return "."
+    body = "".join(re.escape(chr(low)) if low == high else f"{re.escape(chr(low))}-{re.escape(chr(high))}"
+                   for low, high in sorted(ranges))
+    return f"[{'^' if negated else ''}{body}]"
+
+
+class NamePattern:
+    """
+    A compiled name pattern (see compile_pattern()).
+
+    The pattern is a sequence of tokens, each a character class repeated once ("1"), at
+    most once ("?") or any number of times ("*"), matched against the whole lowercased
+    name. match_rows() runs it on many names at once, with NumPy masks over the names'
+    characters: it first checks the cheap necessary conditions (length bounds, the
+    classes at fixed positions from the start and from the end). Most patterns are
+    fixed runs of classes separated by "any characters" (globs like "*ia", "*ar*",
+    "?[aeiou]*"): each run in the middle is then found at its leftmost place after the
+    previous one. Other patterns run as an automaton, one character position at a time
+    with a mask per state.
+    """
+
+    def __init__(self, source, syntax, tokens):
+        self.source = source
+        self.syntax = syntax
+        # Optional tokens next to "any characters" are redundant (e.g. "l+" is "*l*"), and
+        # so are runs of "*" tokens of the same class.
+        tokens = list(tokens)
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            absorbed = token[1] != "1" and token != ANY_RUN and ANY_RUN in tokens[max(i - 1, 0):i] + tokens[i + 1:i + 2]
+            repeated = token[1] == "*" and tokens[i + 1:i + 2] == [token]
+            if absorbed or repeated:
+                del tokens[i]
+                i = max(i - 1, 0)  # The previous token may now be next to "any characters".
+            else:
+                i += 1
+        self.tokens = tuple(tokens)
+        quantifiers = [quantifier for _, quantifier in self.tokens]
+        self.min_length = quantifiers.count("1")
+        self.max_length = None if "*" in quantifiers else len(quantifiers)
+        # Classes every match has at a fixed position: (position, class) from the start,
+        # (position from the end, starting at 1, class) from the end.
+        self.prefix = []
+        for position, (cls, quantifier) in enumerate(self.tokens):
+            if quantifier != "1":
+                break
+            self.prefix.append((position, cls))
+        self.suffix = []
+        for position, (cls, quantifier) in enumerate(reversed(self.tokens), 1):
+            if quantifier != "1":
+                break
+            self.suffix.append((position, cls))
+        # (position, letter) pairs every match has, to look up in the index.
+        self.letters = [(position, chr(low)) for position, (ranges, negated) in self.prefix
+                        if not negated and len(ranges) == 1 for low, high in ranges if low == high]
+        # Runs of classes between "any characters" tokens, when that is all the pattern
+        # has: the first and the last are the prefix and the suffix, the others (None
+        # when the pattern has other tokens) are searched for in between.
+        self.middle = None
+        if all(token[1] == "1" or token == ANY_RUN for token in self.tokens):
+            runs = [[]]
+            for cls, quantifier in self.tokens:
+                if quantifier == "*":
+                    runs.append([])
+                else:
+                    runs[-1].append(cls)
+            self.middle = [run for run in runs[1:-1] if run]
+        self.regex = re.compile("".join(_class_regex(cls) + ("" if quantifier == "1" else quantifier)
+                                        for cls, quantifier in self.tokens), re.DOTALL)
+
+    def __repr__(self):
+        return f"NamePattern({self.source!r}, {self.syntax!r})"
+
+    @property
+    def key(self):
+        """Patterns with the same key match the same names (e.g. the glob *ia and the regex ia$)."""
+        return self.tokens
+
+    def matches(self, name):
+        """Returns True if the name matches the pattern (the reference, one name at a time)."""
+        return self.regex.fullmatch(str(name).lower()) is not None
+
+    def length_bounds(self):
+        """Returns the (lower, upper) bounds of the lengths of the matches (upper is None when unbounded)."""
+        return self.min_length, self.max_length
+
+    def match_rows(self, chars, lengths, ids, uneven=None):
+        """
+        Returns a boolean mask of the rows (an array of row ids) whose name matches.
+
+        chars and lengths are the dataset's search arrays. 'uneven' are the sorted ids of
+        the rows whose lowercased name isn't as long as the name: as the masks rely on
+        the name's length, those (rare) rows are matched one at a time instead.
+        """
+        ids = np.asarray(ids)
+        result = np.zeros(len(ids), dtype=bool)
+        regular = np.arange(len(ids))
+        if uneven is not None and len(uneven):
+            at = np.searchsorted(uneven, ids)
+            odd = np.flatnonzero(uneven[np.minimum(at, len(uneven) - 1)] == ids)
+            for i in odd:
+                codes = chars[:, ids[i]]
+                result[i] = self.regex.fullmatch("".join(map(chr, codes[codes != 0]))) is not None
+            regular = np.setdiff1d(regular, odd, assume_unique=True)
+
+        width = chars.shape[0]
+        rows = ids[regular]
+        row_lengths = lengths[rows]
+        fits = row_lengths >= self.min_length
+        if self.max_length is not None:
+            fits &= row_lengths <= self.max_length
+        for position, cls in self.prefix:
+            fits &= _class_mask(cls, chars[position][rows]) if position < width else False
+        for position, cls in self.suffix:
+            at = np.clip(row_lengths - position, 0, max(width - 1, 0))
+            fits &= _class_mask(cls, chars[at, rows]) if width else False
+        regular, rows, row_lengths = regular[fits], rows[fits], row_lengths[fits]
+        if self.middle is None:
+            result[regular] = self._run_automaton(chars.take(rows, axis=1))
+        elif self.middle:
+            result[regular] = self._find_middle(chars.take(rows, axis=1), row_lengths)
+        else:
+            result[regular] = True
+        return result
+
+    def _find_middle(self, columns, row_lengths):
+        # columns: the rows' characters, one row per position. Each run is looked for at
+        # its leftmost place after the previous one and before the suffix; the last one
+        # only needs to be found somewhere.
+        width, count = columns.shape
+        dtype = np.int16 if width < 2**15 else np.int64
+        limit = (row_lengths - len(self.suffix)).astype(dtype) if self.suffix else None
+        start = None  # Right after the prefix
+        found = np.ones(count, dtype=bool)
+        last = int(row_lengths.max(initial=0)) - len(self.suffix)
+        masks = {}  # (class, position) -> mask, shared by the offsets and the runs
+        for number, run in enumerate(self.middle, 1):
+            final = number == len(self.middle)
+            place = None if final else np.full(count, -1, dtype=dtype)
+            pending = found.copy()
+            found_run = np.zeros(count, dtype=bool)
+            for offset in range(len(self.prefix), min(width, last) - len(run) + 1):
+                hit = pending.copy()
+                for i, cls in enumerate(run):
+                    if (cls, offset + i) not in masks:
+                        masks[(cls, offset + i)] = _class_mask(cls, columns[offset + i])
+                    hit &= masks[(cls, offset + i)]
+                # Characters past the end of a name are 0, which no class matches: only
+                # the suffix and the place of the previous run need checking.
+                if limit is not None:
+                    hit &= limit >= offset + len(run)
+                if start is not None:
+                    hit &= start <= offset
+                if final:
+                    found_run |= hit
+                else:
+                    np.copyto(place, offset, where=hit)
+                pending &= ~hit
+            if final:
+                return found & found_run
+            found &= place >= 0
+            start = place + len(run)
+        return found
+
+    def _run_automaton(self, columns):
+        # columns: the rows' characters, one row per position. State i means "the first
+        # i tokens matched"; rows holds the indexes of the rows still in columns and
+        # states, which drop the rows with no state left once they are half of them.
+        width, count = columns.shape
+        result = np.zeros(count, dtype=bool)
+        rows = np.arange(count)
+        states = np.zeros((len(self.tokens) + 1, count), dtype=bool)
+        states[0] = True
+        self._close(states)
+        for position in range(width + 1):
+            codes = columns[position] if position < width else np.zeros(len(rows), dtype=columns.dtype)
+            # Names that end here match if every token matched.
+            result[rows[(codes == 0) & states[-1]]] = True
+            following = np.zeros_like(states)
+            for i, (cls, quantifier) in enumerate(self.tokens):
+                if states[i].any():
+                    following[i if quantifier == "*" else i + 1] |= states[i] & _class_mask(cls, codes)
+            self._close(following)
+            states = following
+            live = states.any(axis=0)
+            remaining = np.count_nonzero(live)
+            if not remaining:
+                break
+            if remaining * 2 < len(rows):
+                rows, states, columns = rows[live], states[:, live], columns[:, live]
+        return result
+
+    def _close(self, states):
+        # Optional tokens can be skipped: state i also reaches state i + 1.
+        for i, (_, quantifier) in enumerate(self.tokens):
+            if quantifier != "1":
+                states[i + 1] |= states[i]
+
+
+@functools.lru_cache(maxsize=1024)
+def compile_pattern(pattern, syntax="glob"):
+    """
+    Compiles a name pattern, ignoring case.
+
+    Parameters:
+      - pattern: with syntax="glob", a glob matching the whole name: "*ia" (ends with
+        "ia"), "*ar*" (contains "ar"), "?[aeiou]*" (second letter is a vowel). With
+        syntax="regex", a limited regular expression: "ia$", "ar", "^.[aeiou]".
+      - syntax: "glob" or "regex"
+
+    Raises PatternError for an invalid pattern. Compiled patterns are cached.
+    """
+    if syntax not in SYNTAXES:
+        raise PatternError(f"Unknown pattern syntax {syntax!r}")
+    tokens = _glob_tokens(pattern) if syntax == "glob" else _regex_tokens(pattern)
+    return NamePattern(pattern, syntax, tokens)
+
+
+def read_pattern(pattern):
+    """Returns a NamePattern from a compiled pattern, a glob string, or None (no pattern) for None or ""."""
+    if pattern is None or isinstance(pattern, NamePattern):
+        return pattern
+    return compile_pattern(pattern) if pattern else None
@@ -0,0 +1,501 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import uuid
+
+import numpy as np
+
+# pandas is imported by the functions reading the workbook or building DataFrames: serving
+# from the snapshot doesn't need it, and importing it takes as long as the rest of an
+# app's startup.
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Column names used when the Excel file doesn't have the expected headers.
+COLUMNS = ["Name", "Frequency", "Country", "Gender"]
+
+# Columns always stored as codes plus a label table.
+CATEGORICAL_COLUMNS = ["Country", "Gender"]
+
+# Columns always stored as numbers (cells that aren't numbers read as NaN).
+NUMERIC_COLUMNS = ["Frequency"]
+
+# ------------------------------------------------
+# Snapshot file layout: MAGIC, the header length (uint64), a JSON header describing
+# every array, then the arrays, each starting on an ALIGNMENT boundary so they can
+# be used straight from a memory map.
+# ------------------------------------------------
+MAGIC = b"NAMESNAP"
+SNAPSHOT_VERSION = 6
+ALIGNMENT = 64
+
+# Rows converted at a time when building a dataset, to bound the temporary memory.
+BUILD_CHUNK_SIZE = 1_000_000
+
+
+def read_workbook(path="names.xlsx"):
+    """
+    Reads the names workbook and applies the header fix-up shared by all the apps.
+
+    Workbooks with four or more columns are assumed to be Name, Frequency, Country, Gender;
+    older three-column workbooks get Name, Frequency, Country.
+    """
+    import pandas as pd
+
+    data = pd.read_excel(path)
+    if data.columns.size >= 4 and not all(col in data.columns for col in COLUMNS):
+        data.columns = COLUMNS
+    elif data.columns.size == 3 and not all(col in data.columns for col in COLUMNS[:3]):
+        data.columns = COLUMNS[:3]
+    return data
+
+
+def snapshot_path(path):
+    """Returns where the snapshot of the given workbook is stored (names.xlsx -> names.snapshot)."""
+    return os.path.splitext(path)[0] + ".snapshot"
+
+
+def encode_strings(values):
+    """Encodes strings as one UTF-8 buffer plus an offsets array (len(values) + 1 entries)."""
+    values = list(values)
+    parts, sizes = [], []
+    # In chunks, so there is never a bytes object per row for millions of rows at once.
+    for start in range(0, len(values), BUILD_CHUNK_SIZE):
+        encoded = [str(value).encode("utf-8") for value in values[start:start + BUILD_CHUNK_SIZE]]
+        sizes.append(np.fromiter(map(len, encoded), dtype=np.int64, count=len(encoded)))
+        parts.append(b"".join(encoded))
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    if sizes:
+        np.cumsum(np.concatenate(sizes), out=offsets[1:])
+    return np.frombuffer(b"".join(parts), dtype=np.uint8), offsets
+
+
+def decode_strings(data, offsets, ids=None):
+    """Inverse of encode_strings(): returns the list of strings (only the given row ids, if any)."""
+    raw = memoryview(data)
+    if ids is None:
+        bounds = zip(offsets[:-1].tolist(), offsets[1:].tolist())
+    else:
+        ids = np.asarray(ids)
+        bounds = zip(offsets[ids].tolist(), offsets[ids + 1].tolist())
+    return [str(raw[start:end], "utf-8") for start, end in bounds]
+
+
+def _narrow(values):
+    """Returns an integer array in the smallest dtype that holds its values (other arrays as they are)."""
+    if values.dtype.kind not in "iu" or not len(values):
+        return values
+    low, high = values.min(), values.max()
+    dtype = np.result_type(np.min_scalar_type(low), np.min_scalar_type(high))
+    return values.astype(dtype) if dtype.kind in "iu" else values
+
+
+def _encode_column(name, values):
+    """
+    Returns (column entry, arrays) for one DataFrame column.
+
+    Numeric columns (Frequency always) are stored as fixed-width arrays, integers in the
+    smallest dtype that holds them; Country/Gender and other repetitive text as codes plus
+    a label table, and the Name column and other mostly-unique text as a string buffer.
+    """
+    import pandas as pd
+
+    entry = {"name": name}
+    if name in NUMERIC_COLUMNS:
+        values = pd.to_numeric(values, errors="coerce")
+    if name != "Name" and pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        entry["kind"] = "numeric"
+        return entry, {"values": _narrow(values.to_numpy())}
+
+    values = [str(value) for value in values]
+    labels = sorted(set(values))
+    if name in CATEGORICAL_COLUMNS or (name != "Name" and len(labels) <= len(values) // 2):
+        lookup = {label: code for code, label in enumerate(labels)}
+        dtype = np.min_scalar_type(max(len(labels) - 1, 0))
+        entry["kind"] = "categorical"
+        entry["labels"] = labels
+        return entry, {"codes": np.fromiter((lookup[value] for value in values), dtype=dtype, count=len(values))}
+
+    entry["kind"] = "strings"
+    data, offsets = encode_strings(values)
+    return entry, {"data": data, "offsets": offsets}
+
+
+def group_ids(keys, skip_zero=False, rows=None):
+    """
+    Groups row ids by key, as compressed posting lists.
+
+    Returns (ids, keys, offsets): the row ids of unique key keys[i] are
+    ids[offsets[i]:offsets[i + 1]], in ascending order (or in the order of 'rows', if
+    given). With skip_zero, rows whose key is 0 are left out.
+    """
+    if rows is None:
+        rows = np.flatnonzero(keys) if skip_zero else np.arange(len(keys))
+    order = rows[np.argsort(keys[rows], kind="stable")]
+    sorted_keys = keys[order]
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]]) if len(order) else np.zeros(0, dtype=np.int64)
+    offsets = np.r_[starts, len(order)].astype(np.int64)
+    ids_dtype = np.int32 if len(keys) < 2**31 else np.int64
+    return order.astype(ids_dtype), sorted_keys[starts], offsets
+
+
+def _search_arrays(names, gender_codes, country_codes, frequencies):
+    """
+    Returns the per-row arrays and posting lists the search engines work on:
+      - lengths: len(str(name)), as matches_name() measures it
+      - chars: the lowercased names as code points, one contiguous row per position.
+        Names shorter than the widest one are padded with 0.
+      - length_*, gender_*: row ids grouped by name length and by Gender code
+      - country_*: the rows of every Country code (the per-country partitions), in file
+        order, and country_frequency_*: the same partitions in Frequency order
+      - position_*: row ids grouped by (position, lowercase code point); padding is left out
+      - by_frequency: the row ids from the highest Frequency to the lowest (ties in file
+        order, missing values last), and frequency_rank: each row's place in that order
+      - uneven_ids: the rows whose lowercased name is longer than the name (e.g. "İ"
+        lowercases to two characters), so their chars don't end at their length
+      - by_name: the row ids sorted by lowercased name (ties in Frequency order), so the
+        names starting with a prefix are a range of it, and name_rank: each row's place
+        in that order
+    """
+    lengths = np.fromiter(map(len, names), dtype=np.int32, count=len(names))
+    # Lowercasing can change a name's length (e.g. "İ"), so the width is measured after it.
+    width = max((len(name.lower()) for name in names), default=0)
+    # The UTF-32 buffer takes 4 bytes per character, so it is built a chunk of names at a
+    # time and each chunk narrowed to the smallest type that holds its characters.
+    blocks, uneven = [], []
+    for start in range(0, len(names), BUILD_CHUNK_SIZE):
+        lowered = [name.lower().ljust(width, "\0") for name in names[start:start + BUILD_CHUNK_SIZE]]
+        block = np.frombuffer("".join(lowered).encode("utf-32-le"), dtype=np.uint32).reshape(len(lowered), width)
+        blocks.append(block.astype(np.min_scalar_type(int(block.max()) if block.size else 0)))
+        uneven.append(np.flatnonzero((block != 0).sum(axis=1) != lengths[start:start + len(lowered)]) + start)
+    chars = np.empty((width, len(names)), dtype=np.result_type(np.uint8, *blocks))
+    start = 0
+    for block in blocks:
+        chars[:, start:start + len(block)] = block.T
+        start += len(block)
+    ids_dtype = np.int32 if len(names) < 2**31 else np.int64
+    by_frequency = np.argsort(-frequencies, kind="stable").astype(ids_dtype)
+    frequency_rank = np.empty(len(names), dtype=ids_dtype)
+    frequency_rank[by_frequency] = np.arange(len(names), dtype=ids_dtype)
+    # The chars are padded with 0, so sorting them position by position sorts the names
+    # the way Python compares strings (a name before the longer ones it starts).
+    by_name = np.lexsort([frequency_rank] + [column for column in chars[::-1]]).astype(ids_dtype)
+    name_rank = np.empty(len(names), dtype=ids_dtype)
+    name_rank[by_name] = np.arange(len(names), dtype=ids_dtype)
+    arrays = {"lengths": lengths, "chars": chars, "by_frequency": by_frequency, "frequency_rank": frequency_rank,
+              "uneven_ids": np.concatenate(uneven).astype(ids_dtype) if uneven else np.zeros(0, dtype=ids_dtype),
+              "by_name": by_name, "name_rank": name_rank}
+
+    for name, keys in (("length", lengths), ("gender", gender_codes), ("country", country_codes)):
+        arrays[f"{name}_ids"], arrays[f"{name}_keys"], arrays[f"{name}_offsets"] = group_ids(keys)
+    grouped = group_ids(country_codes, rows=by_frequency)
+    arrays["country_frequency_ids"], arrays["country_frequency_keys"], arrays["country_frequency_offsets"] = grouped
+
+    position_ids, position_keys, position_offsets = [], [], [np.zeros(1, dtype=np.int64)]
+    for position, column in enumerate(chars):
+        ids, keys, offsets = group_ids(column, skip_zero=True)
+        position_ids.append(ids)
+        position_keys.append(np.column_stack([np.full(len(keys), position), keys]))
+        position_offsets.append(offsets[1:] + position_offsets[-1][-1])
+    arrays["position_ids"] = np.concatenate(position_ids) if position_ids else np.zeros(0, dtype=np.int32)
+    arrays["position_keys"] = np.concatenate(position_keys).astype(np.uint32) if position_keys else np.zeros((0, 2), dtype=np.uint32)
+    arrays["position_offsets"] = np.concatenate(position_offsets)
+    return arrays
+
+
+class NamesDataset:
+    """
+    The names table in columnar form.
+
+    Name is kept as one UTF-8 buffer plus an offsets array, numeric columns as arrays and
+    Country/Gender as small integer codes plus a label table, so there is no Python object
+    per row. When opened from a snapshot every array is a read-only view of a memory map
+    of the file: all the worker processes serving the app share one physical copy of the
+    data through the page cache.
+    """
+
+    def __init__(self, columns, arrays, version=None, source=None, delta=None):
+        self.columns = columns   # One entry per column: {"name", "kind", "labels" (categorical only)}
+        self.arrays = arrays     # "<column>.<part>" or "search.<part>" -> array
+        # Identifies the data this dataset holds: the workbook's source_version() when it
+        # was loaded from one, otherwise a unique id (or one derived from the changes
+        # applied to it, see names_delta.py).
+        self.version = version or uuid.uuid4().hex
+        # The version of the workbook it was built from (its own version if none).
+        self.source = source or self.version
+        # The changes of the delta log it has on top of the workbook: {"log": the log's id,
+        # "offset": where its next changes start}, None if none (see names_delta.py).
+        self.delta = delta
+        self.column_names = [entry["name"] for entry in columns]
+        self.lengths = arrays.get("search.lengths")
+        self.chars = arrays.get("search.chars")
+        self.by_frequency = arrays.get("search.by_frequency")
+        self.frequency_rank = arrays.get("search.frequency_rank")
+        self.uneven_ids = arrays.get("search.uneven_ids")
+        self.by_name = arrays.get("search.by_name")
+        self.name_rank = arrays.get("search.name_rank")
+
+    @classmethod
+    def from_frame(cls, data, version=None):
+        """Builds an in-memory dataset from a DataFrame with the workbook's columns."""
+        columns = []
+        arrays = {}
+        for name in data.columns:
+            entry, column_arrays = _encode_column(name, data[name])
+            columns.append(entry)
+            arrays.update({f"{name}.{part}": array for part, array in column_arrays.items()})
+        dataset = cls(columns, arrays)
+        names = [str(name) for name in data["Name"]]
+        if "Frequency" in data.columns:
+            frequencies = dataset.values("Frequency").astype(float)
+        else:
+            frequencies = np.zeros(len(data))
+        search = _search_arrays(names, dataset.categorical("Gender")[0], dataset.categorical("Country")[0], frequencies)
+        arrays.update({f"search.{part}": array for part, array in search.items()})
+        return cls(columns, arrays, version)
+
+    @classmethod
+    def open(cls, path):
+        """Opens a snapshot file written by write(), memory-mapping its arrays."""
+        raw = np.memmap(path, dtype=np.uint8, mode="r")
+        if raw[:len(MAGIC)].tobytes() != MAGIC:
+            raise ValueError(f"{path} is not a names snapshot")
+        header_length = int(raw[len(MAGIC):len(MAGIC) + 8].view(np.uint64)[0])
+        header_end = len(MAGIC) + 8 + header_length
+        header = json.loads(raw[len(MAGIC) + 8:header_end].tobytes())
+        if header.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(f"{path} has an unsupported snapshot version")
+        start = -(-header_end // ALIGNMENT) * ALIGNMENT
+
+        arrays = {}
+        for key, spec in header["arrays"].items():
+            dtype = np.dtype(spec["dtype"])
+            begin = start + spec["offset"]
+            count = int(np.prod(spec["shape"]))
+            arrays[key] = raw[begin:begin + count * dtype.itemsize].view(dtype).reshape(spec["shape"])
+        return cls(header["columns"], arrays, header.get("dataset_version"), header.get("source_version"),
+                   header.get("delta"))
+
+    def write(self, path):
+        """
+        Writes the dataset to a snapshot file.
+
+        The file is written next to its final location and renamed into place, so readers
+        never see a partial snapshot.
+        """
+        specs = {}
+        offset = 0
+        for key, array in self.arrays.items():
+            specs[key] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        header = {"version": SNAPSHOT_VERSION, "dataset_version": self.version, "source_version": self.source,
+                  "delta": self.delta, "columns": self.columns, "arrays": specs}
+        header = json.dumps(header).encode("utf-8")
+        start = -(-(len(MAGIC) + 8 + len(header)) // ALIGNMENT) * ALIGNMENT
+
+        tmp_path = f"{path}.tmp-{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(MAGIC)
+            f.write(np.uint64(len(header)).tobytes())
+            f.write(header)
+            for key, array in self.arrays.items():
+                f.seek(start + specs[key]["offset"])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(start + offset)
+        os.replace(tmp_path, path)
+
+    def __len__(self):
+        first = self.columns[0]
+        if first["kind"] == "strings":
+            return len(self.arrays[f"{first['name']}.offsets"]) - 1
+        return len(self.arrays[f"{first['name']}.{'values' if first['kind'] == 'numeric' else 'codes'}"])
+
+    def postings(self, name):
+        """
+        Returns the posting lists precomputed for 'length', 'gender', 'country',
+        'country_frequency' or 'position' as a dict mapping each key to its row ids (sorted,
+        except for 'country_frequency', in Frequency order). The row id arrays are views,
+        not copies.
+        """
+        ids = self.arrays[f"search.{name}_ids"]
+        keys = self.arrays[f"search.{name}_keys"].tolist()
+        offsets = self.arrays[f"search.{name}_offsets"].tolist()
+        keys = [tuple(key) if isinstance(key, list) else key for key in keys]
+        return {key: ids[start:end] for key, start, end in zip(keys, offsets[:-1], offsets[1:])}
+
+    def column(self, name):
+        """Returns the entry describing a column."""
+        return self.columns[self.column_names.index(name)]
+
+    def categorical(self, name):
+        """
+        Returns (codes, labels) for a column stored as categorical.
+
+        A missing column reads as an empty label on every row, like str() of a blank cell would.
+        """
+        if name not in self.column_names:
+            return np.zeros(len(self), dtype=np.uint8), [""]
+        return self.arrays[f"{name}.codes"], self.column(name)["labels"]
+
+    def values(self, name, ids=None):
+        """Returns the values of a column (only the given row ids, if any) as an array."""
+        entry = self.column(name)
+        if entry["kind"] == "numeric":
+            values = self.arrays[f"{name}.values"]
+            return np.array(values if ids is None else values[ids])
+        elif entry["kind"] == "categorical":
+            codes = self.arrays[f"{name}.codes"]
+            return np.array(entry["labels"], dtype=object)[codes if ids is None else codes[ids]]
+        return np.array(decode_strings(self.arrays[f"{name}.data"], self.arrays[f"{name}.offsets"], ids), dtype=object)
+
+    def names(self, ids=None):
+        """Returns the names (only the given row ids, if any) as a list of strings."""
+        return decode_strings(self.arrays["Name.data"], self.arrays["Name.offsets"], ids)
+
+    def records(self, ids):
+        """Returns the given rows as a list of dicts (column name -> value)."""
+        columns = [self.values(name, ids).tolist() for name in self.column_names]
+        return [dict(zip(self.column_names, row)) for row in zip(*columns)]
+
+    def iter_records(self, ids, chunk_size=1000):
+        """Yields the given rows as dicts, decoding chunk_size rows at a time."""
+        for start in range(0, len(ids), chunk_size):
+            yield from self.records(ids[start:start + chunk_size])
+
+    def to_frame(self, ids=None):
+        """
+        Returns the rows (only the given row ids, if any) as a DataFrame.
+
+        The index holds the row ids, like the workbook's DataFrame index.
+        """
+        import pandas as pd
+
+        index = np.arange(len(self)) if ids is None else np.asarray(ids)
+        return pd.DataFrame({name: self.values(name, ids) for name in self.column_names}, index=index)
+
+
+def source_version(path):
+    """Returns a version string for a workbook, which changes whenever the file does."""
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+def read_snapshot_header(snapshot):
+    """Returns the JSON header of a snapshot file (without its arrays)."""
+    with open(snapshot, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{snapshot} is not a names snapshot")
+        header_length = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = json.loads(f.read(header_length))
+    if header.get("version") != SNAPSHOT_VERSION:
+        raise ValueError(f"{snapshot} has an unsupported snapshot version")
+    return header
+
+
+def read_snapshot_version(snapshot):
+    """Returns the version of the workbook a snapshot file was built from, reading only its header."""
+    header = read_snapshot_header(snapshot)
+    return header.get("source_version", header.get("dataset_version"))
+
+
+def snapshot_is_fresh(path):
+    """
+    Returns True if the workbook has a snapshot built from its current contents (changes
+    compacted into it since, see names_delta.py, don't make it stale).
+    """
+    try:
+        return read_snapshot_version(snapshot_path(path)) == source_version(path)
+    except (OSError, ValueError):
+        return False
+
+
+@contextlib.contextmanager
+def snapshot_lock(snapshot):
+    """
+    Holds an exclusive lock on a snapshot while it is rebuilt, so that when several
+    processes find it stale only one of them reads the workbook. No-op where fcntl
+    isn't available (Windows).
+    """
+    with open(snapshot + ".lock", "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        yield
+
+
+def build_snapshot(path="names.xlsx", if_stale=False):
+    """
+    Reads the workbook and (re)writes its snapshot. Returns True if it was written.
+
+    With if_stale, nothing is done when the snapshot is already fresh, which is checked
+    again once the lock is held: another process may have just rebuilt it.
+    """
+    snapshot = snapshot_path(path)
+    with snapshot_lock(snapshot):
+        if if_stale and snapshot_is_fresh(path):
+            return False
+        version = source_version(path)
+        NamesDataset.from_frame(read_workbook(path), version).write(snapshot)
+        return True
+
+
+def load_dataset(path="names.xlsx"):
+    """
+    Loads the names dataset, memory-mapped from the binary snapshot of the workbook.
+
+    When the snapshot is missing or was built from an older version of the workbook, it is
+    rebuilt first. If it can't be written (a read-only directory) an in-memory dataset is
+    returned instead.
+    """
+    snapshot = snapshot_path(path)
+    if not snapshot_is_fresh(path):
+        if not os.access(os.path.dirname(os.path.abspath(snapshot)), os.W_OK):
+            return NamesDataset.from_frame(read_workbook(path), source_version(path))
+        build_snapshot(path, if_stale=True)
+    return NamesDataset.open(snapshot)
+
+
+def memory_usage():
+    """
+    Returns this process's memory usage in bytes: rss, shared, private and pss.
+
+    Read from /proc/self/smaps_rollup (Linux). pss (proportional set size) splits shared
+    pages between the processes that map them, so it is the fair per-worker figure.
+    """
+    fields = {"Rss": "rss", "Pss": "pss", "Shared_Clean": "shared", "Shared_Dirty": "shared",
+              "Private_Clean": "private", "Private_Dirty": "private"}
+    usage = {"rss": 0, "shared": 0, "private": 0, "pss": 0}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            key, _, value = line.partition(":")
+            if key in fields:
+                usage[fields[key]] += int(value.split()[0]) * 1024
+    return usage
+
+
+if __name__ == "__main__":
+    # Build step: python names_data.py [names.xlsx] [--if-stale]
+    parser = argparse.ArgumentParser(description="Build the binary snapshot of the names workbook.")
+    parser.add_argument("path", nargs="?", default="names.xlsx")
+    parser.add_argument("--if-stale", action="store_true", help="only rebuild it if the workbook changed")
+    args = parser.parse_args()
+    snapshot = snapshot_path(args.path)
+
+    started = time.perf_counter()
+    if not build_snapshot(args.path, if_stale=args.if_stale):
+        print(f"{snapshot} is up to date")
+        sys.exit(0)
+    workbook_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    dataset = NamesDataset.open(snapshot)
+    snapshot_seconds = time.perf_counter() - started
+
+    print(f"Wrote {snapshot} ({len(dataset)} rows, {os.path.getsize(snapshot)} bytes)")
+    print(f"Startup from workbook: {workbook_seconds:.3f}s (read and convert)")
+    print(f"Startup from snapshot: {snapshot_seconds:.3f}s")
@@ -0,0 +1,442 @@
+"""
+Incremental updates of the names dataset: a log of upserts on top of its snapshot.
+
+Names are added and frequencies change a few at a time; instead of rewriting names.xlsx
+(and rebuilding everything from it), the changes are appended to a delta log next to
+the snapshot (names.xlsx -> names.delta), one JSON object per line:
+
+    {"log": "<id of the log>"}
+    {"Name": "MARIA", "Frequency": 559600, "Country": "Spain", "Gender": "Girl"}
+    {"Name": "NAIA", "Frequency": 850, "Country": "Spain", "Gender": "Girl"}
+
+Every change is a whole row, with every column of the workbook. Name, Country and Gender
+identify the row: a change replaces the row with the same ones (an update of its other
+columns) or adds a new row at the end (an insertion). apply_changes() applies them to
+the columnar dataset and its search arrays without rebuilding it: only the arrays the
+changes touch are copied and patched, the others stay memory-mapped from the snapshot.
+
+Compaction folds the changes into a new snapshot, which records how much of the log it
+holds (its 'delta'), so the workers share one memory-mapped copy again and only apply
+the changes after it. The log itself is kept: when the workbook changes (or is just
+touched or copied), its snapshot is rebuilt from it and the whole log is applied again
+on top, so no change that was accepted is lost. Only reset drops them.
+
+Usage: python names_delta.py upsert [names.xlsx] [--changes FILE]   (stdin by default)
+       python names_delta.py compact [names.xlsx] [--min-changes N]
+       python names_delta.py reset [names.xlsx]   (drops every change not in the workbook)
+"""
+import argparse
+import bisect
+import hashlib
+import json
+import os
+import sys
+import uuid
+from numbers import Number
+
+import numpy as np
+
+from names_data import (NamesDataset, build_snapshot, decode_strings, encode_strings, group_ids, load_dataset,
+                        snapshot_lock, snapshot_path)
+
+# Columns identifying a row (those the workbook has).
+KEY_COLUMNS = ["Name", "Country", "Gender"]
+
+
+def delta_path(path):
+    """Returns where the delta log of the given workbook is stored (names.xlsx -> names.delta)."""
+    return os.path.splitext(path)[0] + ".delta"
+
+
+def changed_version(source, log, offset):
+    """
+    Returns the version of the dataset of the workbook version 'source' with the changes
+    of the delta log 'log' (its id) up to 'offset' applied. It only depends on those, so
+    every process applying them (incrementally, all at once or from a compacted snapshot)
+    agrees on it.
+    """
+    digest = hashlib.sha1(f"{log}:{offset}".encode("utf-8")).hexdigest()[:12]
+    return f"{source}+{digest}"
+
+
+def read_change(columns, change):
+    """
+    Returns a change (a dict with every column of the dataset) with its text values
+    converted the way the workbook's cells are (str()).
+
+    Raises ValueError if it doesn't have the dataset's columns or a numeric value isn't a
+    number.
+    """
+    if not isinstance(change, dict):
+        raise ValueError(f"A change must be an object with the columns {[entry['name'] for entry in columns]}")
+    names = [entry["name"] for entry in columns]
+    missing = [name for name in names if name not in change]
+    unknown = [name for name in change if name not in names]
+    if missing or unknown:
+        raise ValueError(f"Invalid change {change!r}: missing columns {missing}, unknown columns {unknown}")
+    row = {}
+    for entry in columns:
+        value = change[entry["name"]]
+        if entry["kind"] == "numeric":
+            if isinstance(value, bool) or not isinstance(value, Number):
+                raise ValueError(f"Invalid change {change!r}: {entry['name']} must be a number")
+            row[entry["name"]] = value
+        else:
+            row[entry["name"]] = str(value)
+    return row
+
+
+def _start_log(log):
+    """Writes an empty delta log with a new id."""
+    tmp_path = f"{log}.tmp-{os.getpid()}"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"log": uuid.uuid4().hex}) + "\n")
+    os.replace(tmp_path, log)
+
+
+def read_changes(log, log_id=None, offset=0):
+    """
+    Returns (changes, offset, log_id): the changes of the delta log after byte 'offset',
+    the offset to read the next ones from and the log's id. A line still being written is
+    left for later. Without a log, returns ([], 0, None).
+
+    Returns (None, None, None) if a 'log_id' is given and the log isn't that one any more
+    (it was reset).
+    """
+    try:
+        f = open(log, "rb")
+    except FileNotFoundError:
+        return ([], 0, None) if log_id is None else (None, None, None)
+    with f:
+        header = f.readline()
+        if not header.endswith(b"\n"):
+            return ([], 0, None) if log_id is None else (None, None, None)  # Still being started
+        header = json.loads(header)
+        found_id = header.get("log", header.get("base"))  # Logs written before logs had ids
+        if log_id is not None and found_id != log_id:
+            return None, None, None
+        start = max(offset, f.tell())
+        f.seek(start)
+        data = f.read()
+    end = data.rfind(b"\n") + 1
+    return [json.loads(line) for line in data[:end].splitlines() if line.strip()], start + end, found_id
+
+
+def pending_changes(dataset, log):
+    """
+    Returns (changes, offset, log_id): the changes of the delta log the dataset doesn't
+    have yet (see read_changes()). A dataset built from the workbook has none of them; one
+    compacted from the log has those up to its delta's offset.
+    """
+    delta = dataset.delta or {}
+    changes, offset, log_id = read_changes(log, delta.get("log"), delta.get("offset", 0))
+    if changes is None:
+        # The log the dataset was compacted from was reset: the new one applies from its start.
+        changes, offset, log_id = read_changes(log)
+    return changes, offset, log_id
+
+
+def apply_log(dataset, changes, log_id, offset):
+    """
+    Returns the dataset with the changes read from the delta log 'log_id' up to 'offset'
+    applied, with the version every process applying them agrees on.
+    """
+    changed = apply_changes(dataset, changes, changed_version(dataset.source, log_id, offset))
+    changed.delta = {"log": log_id, "offset": offset}
+    return changed
+
+
+def append_changes(path, changes):
+    """
+    Checks the changes and appends them to the workbook's delta log. Returns how many
+    were appended.
+
+    The snapshot is rebuilt first if the workbook changed (its columns are needed to
+    check the changes). The log is appended under the snapshot lock, so appends from
+    several processes don't interleave and never land in a log being compacted or reset.
+    """
+    build_snapshot(path, if_stale=True)
+    snapshot = snapshot_path(path)
+    log = delta_path(path)
+    with snapshot_lock(snapshot):
+        dataset = NamesDataset.open(snapshot)
+        changes = [read_change(dataset.columns, change) for change in changes]
+        if not os.path.exists(log):
+            _start_log(log)
+        with open(log, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(change, ensure_ascii=False) + "\n" for change in changes)
+            f.flush()
+            os.fsync(f.fileno())
+    return len(changes)
+
+
+def load_current(path="names.xlsx"):
+    """
+    Returns (dataset, base, log_id, offset, count): the dataset of the workbook's snapshot
+    with the changes of the delta log it doesn't have applied, the version of the
+    snapshot, the log's id, the offset of its next changes and the number of changes
+    applied.
+    """
+    dataset = load_dataset(path)
+    changes, offset, log_id = pending_changes(dataset, delta_path(path))
+    if not changes:
+        return dataset, dataset.version, log_id, offset, 0
+    return apply_log(dataset, changes, log_id, offset), dataset.version, log_id, offset, len(changes)
+
+
+def compact(path="names.xlsx", min_changes=1):
+    """
+    Folds the delta log into the snapshot: writes the snapshot of the dataset with the
+    changes it doesn't have applied, recording up to where in the log they go. Returns
+    True if it did.
+
+    Nothing is done when fewer than min_changes changes are pending, which is checked
+    once the lock is held: another process may have just compacted them. The log is
+    kept, to apply it again if the snapshot is rebuilt from the workbook.
+    """
+    snapshot = snapshot_path(path)
+    log = delta_path(path)
+    with snapshot_lock(snapshot):
+        dataset = NamesDataset.open(snapshot)
+        changes, offset, log_id = pending_changes(dataset, log)
+        if not changes or len(changes) < min_changes:
+            return False
+        apply_log(dataset, changes, log_id, offset).write(snapshot)
+        return True
+
+
+def reset(path="names.xlsx"):
+    """
+    Drops every change of the delta log: rebuilds the snapshot from the workbook and
+    removes the log. Returns the number of changes dropped.
+    """
+    build_snapshot(path)
+    log = delta_path(path)
+    with snapshot_lock(snapshot_path(path)):
+        changes = read_changes(log)[0]
+        if os.path.exists(log):
+            os.remove(log)
+    return len(changes)
+
+
+def add_postings(ids, keys, offsets, added_keys, added_ids):
+    """
+    Returns the posting lists (ids, keys, offsets) of group_ids() with rows added.
+
+    The added row ids must be higher than the existing ones, so they go at the end of
+    their key's ids (or make a new key).
+    """
+    if not len(added_ids):
+        return ids, keys, offsets
+    order = np.argsort(added_keys, kind="stable")
+    added_keys, added_ids = added_keys[order], added_ids[order]
+    new_keys, counts = np.unique(added_keys, return_counts=True)
+    where = np.searchsorted(keys, new_keys)
+    found = where < len(keys)
+    found[found] = keys[where[found]] == new_keys[found]
+    # The end of a key's ids, or where they start for a new key.
+    ends = offsets[where + found]
+    ids = np.insert(ids, np.repeat(ends, counts), added_ids.astype(ids.dtype))
+    sizes = np.diff(offsets)
+    sizes[where[found]] += counts[found]
+    sizes = np.insert(sizes, where[~found], counts[~found])
+    keys = np.insert(keys.astype(np.result_type(keys, new_keys)), where[~found], new_keys[~found])
+    return ids, keys, np.r_[0, np.cumsum(sizes)].astype(np.int64)
+
+
+def _lowered(chars, row):
+    """Returns the lowercased name of a row, from the chars array."""
+    codes = chars[:, row]
+    return "".join(map(chr, codes[codes != 0].tolist()))
+
+
+def find_rows(dataset, rows):
+    """Returns the row id of each row's key (Name, Country, Gender) in the dataset, or -1."""
+    keys = [name for name in KEY_COLUMNS if name in dataset.column_names]
+    key_values = {name: dataset.categorical(name) for name in keys if name != "Name"}
+    by_name, chars = np.asarray(dataset.by_name), np.asarray(dataset.chars)
+    found = []
+    for row in rows:
+        # by_name has the rows sorted by lowercased name: the rows with this name are a range of it.
+        lowered = row["Name"].lower()
+        start = bisect.bisect_left(by_name, lowered, key=lambda i: _lowered(chars, i))
+        end = bisect.bisect_right(by_name, lowered, lo=start, key=lambda i: _lowered(chars, i))
+        candidates = [i for i in by_name[start:end].tolist() if dataset.names([i])[0] == row["Name"]]
+        found.append(next((i for i in candidates
+                           if all(labels[codes[i]] == row[name] for name, (codes, labels) in key_values.items())), -1))
+    return found
+
+
+def _changed_column(entry, arrays, updated, updates, added):
+    """
+    Returns the arrays of a column with the updated rows' values replaced and the added
+    rows appended, and updates its entry (new labels).
+    """
+    name = entry["name"]
+    if entry["kind"] == "numeric":
+        values = arrays[f"{name}.values"]
+        new = np.asarray(updates + added)
+        if new.dtype.kind in "iu" and len(new):
+            new = new.astype(np.result_type(np.min_scalar_type(new.min()), np.min_scalar_type(new.max())))
+        dtype = np.result_type(values, new) if len(new) else values.dtype
+        values = np.concatenate([values.astype(dtype), new[len(updates):].astype(dtype)])
+        values[updated] = new[:len(updates)]
+        return {"values": values}
+    if entry["kind"] == "categorical":
+        labels = entry["labels"]
+        lookup = {label: code for code, label in enumerate(labels)}
+        for value in updates + added:
+            if value not in lookup:
+                lookup[value] = len(labels)
+                labels.append(value)  # Codes of the existing rows stay valid.
+        codes = arrays[f"{name}.codes"]
+        new = np.array([lookup[value] for value in updates + added], dtype=np.min_scalar_type(len(labels) - 1))
+        codes = np.concatenate([codes.astype(np.result_type(codes, new)), new[len(updates):]])
+        codes[updated] = new[:len(updates)]
+        return {"codes": codes}
+    data, offsets = arrays[f"{name}.data"], arrays[f"{name}.offsets"]
+    if len(updated):
+        # Text stored as a buffer can't be patched in place: re-encode the column.
+        values = decode_strings(data, offsets)
+        for row, value in zip(updated.tolist(), updates):
+            values[row] = value
+        data, offsets = encode_strings(values)
+    added_data, added_offsets = encode_strings(added)
+    return {"data": np.concatenate([data, added_data]), "offsets": np.r_[offsets, added_offsets[1:] + offsets[-1]]}
+
+
+def apply_changes(dataset, changes, version=None):
+    """
+    Returns a new dataset with the changes (see the module docstring) applied.
+
+    The dataset's arrays are patched rather than rebuilt: the updated rows' values are
+    replaced and the added rows appended to every column, the added rows' ids are added
+    to the posting lists (they are the highest ids, so they go at the end of their lists),
+    and the changed rows are moved to their new place in the Frequency and name orders.
+    Arrays the changes don't touch are shared with the dataset (and its memory map).
+    Results are the same as building the dataset with the changes from scratch.
+    """
+    rows = {}
+    for change in changes:
+        row = read_change(dataset.columns, change)
+        rows[tuple(row.get(name) for name in KEY_COLUMNS)] = row  # The last change of a row wins.
+    rows = list(rows.values())
+    found = find_rows(dataset, rows)
+    updated = np.array([row_id for row_id in found if row_id >= 0], dtype=np.int64)
+    added_rows = [row for row, row_id in zip(rows, found) if row_id < 0]
+    count = len(dataset)
+    added = np.arange(count, count + len(added_rows), dtype=np.int64)
+
+    columns = [dict(entry, labels=list(entry["labels"])) if "labels" in entry else dict(entry)
+               for entry in dataset.columns]
+    arrays = dict(dataset.arrays)
+    for entry in columns:
+        name = entry["name"]
+        if name in KEY_COLUMNS:
+            # Updates don't change the key columns.
+            if not len(added):
+                continue
+            changed_rows, updates = updated[:0], []
+        else:
+            changed_rows, updates = updated, [row[name] for row, row_id in zip(rows, found) if row_id >= 0]
+        column = _changed_column(entry, arrays, changed_rows, updates, [row[name] for row in added_rows])
+        arrays.update({f"{name}.{part}": array for part, array in column.items()})
+    changed = NamesDataset(columns, arrays)
+
+    def search(name):
+        return arrays[f"search.{name}"]
+
+    if len(added):
+        names = [row["Name"] for row in added_rows]
+        lowered = [name.lower() for name in names]
+        lengths = np.fromiter(map(len, names), dtype=search("lengths").dtype, count=len(names))
+        chars = search("chars")
+        width = max(chars.shape[0], *map(len, lowered))
+        codes = [[ord(char) for char in name] for name in lowered]
+        dtype = np.result_type(chars, np.min_scalar_type(max(max(name, default=0) for name in codes)))
+        grown = np.zeros((width, count + len(added)), dtype=dtype)
+        grown[:chars.shape[0], :count] = chars
+        for row, name in zip(added.tolist(), codes):
+            grown[:len(name), row] = name
+        arrays["search.chars"] = grown
+        arrays["search.lengths"] = np.concatenate([search("lengths"), lengths])
+        uneven = [row for row, name, low in zip(added.tolist(), names, lowered) if len(low) != len(name)]
+        arrays["search.uneven_ids"] = np.concatenate([search("uneven_ids"), np.array(uneven, dtype=search("uneven_ids").dtype)])
+
+        added_keys = {"length": lengths, "gender": changed.categorical("Gender")[0][count:],
+                      "country": changed.categorical("Country")[0][count:]}
+        for name, keys in added_keys.items():
+            postings = add_postings(search(f"{name}_ids"), search(f"{name}_keys"), search(f"{name}_offsets"),
+                                    keys, added)
+            arrays[f"search.{name}_ids"], arrays[f"search.{name}_keys"], arrays[f"search.{name}_offsets"] = postings
+        # (position, code) keys as one integer, in the same order.
+        position_keys = search("position_keys").astype(np.int64)
+        pairs = [(position << 32 | code, row) for row, name in zip(added.tolist(), codes)
+                 for position, code in enumerate(name)]
+        ids, keys, offsets = add_postings(search("position_ids"), position_keys[:, 0] << 32 | position_keys[:, 1],
+                                          search("position_offsets"), np.array([key for key, _ in pairs], dtype=np.int64),
+                                          np.array([row for _, row in pairs], dtype=np.int64))
+        arrays["search.position_ids"], arrays["search.position_offsets"] = ids, offsets
+        arrays["search.position_keys"] = np.column_stack([keys >> 32, keys & 0xFFFFFFFF]).astype(np.uint32)
+
+    # The changed rows leave the Frequency and name orders and are inserted back at their
+    # new place; the other rows keep their relative order.
+    moved = np.concatenate([updated, added])
+    if "Frequency" in changed.column_names:
+        frequencies = changed.values("Frequency").astype(float)
+    else:
+        frequencies = np.zeros(len(changed))
+    is_moved = np.zeros(len(changed), dtype=bool)
+    is_moved[moved] = True
+    by_frequency = search("by_frequency")
+    by_frequency = by_frequency[~is_moved[by_frequency]]
+    # Highest Frequency first, ties in file order, missing values last, like np.argsort(-frequencies).
+    kept = -frequencies[by_frequency]
+    moved = moved[np.lexsort([moved, -frequencies[moved]])]
+    places = []
+    for row in moved.tolist():
+        start, end = np.searchsorted(kept, -frequencies[row], "left"), np.searchsorted(kept, -frequencies[row], "right")
+        places.append(start + np.searchsorted(by_frequency[start:end], row))
+    by_frequency = np.insert(by_frequency, places, moved.astype(by_frequency.dtype))
+    frequency_rank = np.empty(len(changed), dtype=by_frequency.dtype)
+    frequency_rank[by_frequency] = np.arange(len(changed), dtype=by_frequency.dtype)
+    arrays["search.by_frequency"], arrays["search.frequency_rank"] = by_frequency, frequency_rank
+    grouped = group_ids(changed.categorical("Country")[0], rows=by_frequency)
+    arrays["search.country_frequency_ids"], arrays["search.country_frequency_keys"], arrays["search.country_frequency_offsets"] = grouped
+
+    # Names in Python string order, ties in Frequency order (see names_data._search_arrays()).
+    chars = np.asarray(search("chars"))
+    by_name = np.asarray(search("by_name"))
+    by_name = by_name[~is_moved[by_name]]
+    moved = sorted(moved.tolist(), key=lambda row: (_lowered(chars, row), frequency_rank[row]))
+    places = [bisect.bisect_left(by_name, (_lowered(chars, row), frequency_rank[row]),
+                                 key=lambda i: (_lowered(chars, i), frequency_rank[i])) for row in moved]
+    by_name = np.insert(by_name, places, np.array(moved, dtype=by_name.dtype))
+    name_rank = np.empty(len(changed), dtype=by_name.dtype)
+    name_rank[by_name] = np.arange(len(changed), dtype=by_name.dtype)
+    arrays["search.by_name"], arrays["search.name_rank"] = by_name, name_rank
+    return NamesDataset(columns, arrays, version, dataset.source)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Update the names dataset through its delta log.")
+    parser.add_argument("command", choices=["upsert", "compact", "reset"])
+    parser.add_argument("path", nargs="?", default="names.xlsx")
+    parser.add_argument("--changes", help="upsert: file of changes, one JSON object per line (default: stdin)")
+    parser.add_argument("--min-changes", type=int, default=1, help="compact: only if the log has this many changes")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        compacted = compact(args.path, args.min_changes)
+        print(f"Compacted {delta_path(args.path)} into {snapshot_path(args.path)}" if compacted else "Nothing to compact")
+        sys.exit(0)
+    if args.command == "reset":
+        print(f"Dropped {reset(args.path)} changes from {delta_path(args.path)}")
+        sys.exit(0)
+    lines = open(args.changes, encoding="utf-8") if args.changes else sys.stdin
+    with lines:
+        changes = [json.loads(line) for line in lines if line.strip()]
+    try:
+        print(f"Appended {append_changes(args.path, changes)} changes to {delta_path(args.path)}")
+    except ValueError as e:
+        sys.exit(str(e))
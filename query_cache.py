@@ -0,0 +1,91 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class QueryCache:
+    """
+    Bounded LRU cache of search results (arrays of matching row ids).
+
+    Entries are evicted, least recently used first, once there are more than 'maxsize' of
+    them or their arrays take more than 'max_bytes'. With a 'ttl', entries also expire
+    that many seconds after they were cached. Safe to share between threads.
+    """
+
+    def __init__(self, maxsize=1024, max_bytes=64 * 2**20, ttl=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (ids, expiry time or None)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        # Doesn't count as a hit or a miss, nor refresh the entry.
+        entry = self._entries.get(key)
+        return entry is not None and not self._expired(entry)
+
+    def _expired(self, entry):
+        return entry[1] is not None and entry[1] <= time.monotonic()
+
+    def get(self, key):
+        """Returns the cached ids for a key, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry):
+                del self._entries[key]
+                self._bytes -= entry[0].nbytes
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, ids):
+        """Caches the ids for a key. Results larger than max_bytes on their own are not cached."""
+        if ids.nbytes > self.max_bytes:
+            return
+        # Cached arrays are handed to every caller of the same query.
+        ids.setflags(write=False)
+        expiry = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[0].nbytes
+            self._entries[key] = (ids, expiry)
+            self._bytes += ids.nbytes
+            while len(self._entries) > self.maxsize or self._bytes > self.max_bytes:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self._bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def clear(self):
+        """Drops every entry (the counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Returns the hit/miss/eviction/expiration counters and the current size (ttl 0: no expiry)."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "maxsize": self.maxsize,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl or 0,
+            }
@@ -0,0 +1,636 @@
+import bisect
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from name_fuzzy import MAX_DISTANCE, edit_distances, letter_counts
+from name_pattern import compile_pattern, read_pattern
+
+CONDITIONS = ["equal", "equal_or_lower", "equal_or_higher", "between"]
+
+# Result orders: as in the file, or most frequent names first.
+ORDERS = ["file", "frequency"]
+
+# Rows looked at in the first step of a top-k search (it doubles at every step), and the
+# fraction of the rows it looks at that way before finding every match instead.
+TOP_CHUNK_ROWS = 4096
+TOP_WALK_FRACTION = 0.1
+
+# Prefix suggestions: prefixes matching at most SUGGEST_SORT_ROWS names have their
+# matches sorted by Frequency; more common ones walk the rows in Frequency order instead.
+SUGGEST_SORT_ROWS = 20_000
+
+# Datasets of at least PARALLEL_MIN_ROWS rows are scanned in shards of SHARD_ROWS rows on
+# a pool of SCAN_WORKERS threads (NumPy releases the GIL while it compares arrays);
+# smaller ones in the calling thread, where handing out shards costs more than it saves.
+PARALLEL_MIN_ROWS = 500_000
+SHARD_ROWS = 250_000
+SCAN_WORKERS = int(os.environ.get("NAMES_SCAN_WORKERS", os.cpu_count() or 1))
+
+# All the rows.
+ALL_ROWS = slice(None)
+
+_scan_executors = {}
+
+
+def matches_name(name, condition, numbers, letters):
+    """
+    Returns True if the given name meets the length condition and letter filters.
+
+    This is the reference (row by row) implementation; SearchEngine must give the same answers.
+
+    Parameters:
+      - name: candidate name (string)
+      - condition: one of "equal", "equal_or_lower", "equal_or_higher", "between"
+      - numbers: an integer (for non-between) or a tuple (lower_bound, upper_bound) for "between"
+      - letters: list of letter filters (blank entries act as wildcards)
+    """
+    name = str(name)
+    L = len(name)
+    name_lower = name.lower()
+
+    if condition == "equal":
+        if L != numbers:
+            return False
+        for i in range(numbers):
+            if i < len(letters) and letters[i].strip():
+                if name_lower[i] != letters[i].lower():
+                    return False
+        return True
+
+    elif condition == "equal_or_lower":
+        if L > numbers:
+            return False
+        # Only check positions that exist in the name.
+        for i in range(L):
+            if i < len(letters) and letters[i].strip():
+                if name_lower[i] != letters[i].lower():
+                    return False
+        return True
+
+    elif condition == "equal_or_higher":
+        if L < numbers:
+            return False
+        # Check the first 'numbers' positions.
+        for i in range(numbers):
+            if i < len(letters) and letters[i].strip():
+                if name_lower[i] != letters[i].lower():
+                    return False
+        return True
+
+    elif condition == "between":
+        lower_bound, upper_bound = numbers
+        if not (lower_bound <= L <= upper_bound):
+            return False
+        # Check only for positions that exist.
+        for i in range(min(len(letters), L)):
+            if letters[i].strip():
+                if name_lower[i] != letters[i].lower():
+                    return False
+        return True
+
+    return False
+
+
+def _position_mask(chars, lengths, position, letter, rows=ALL_ROWS):
+    """Returns SearchEngine.position_mask() for the given rows of chars and lengths."""
+    shorter = lengths[rows] <= position
+    if position >= chars.shape[0]:
+        return shorter
+    if len(letter) != 1 or ord(letter) > np.iinfo(chars.dtype).max:
+        # A multi-character filter can never equal a single character, and no name
+        # has a character beyond the widest one stored.
+        return shorter
+    return (chars[position][rows] == ord(letter)) | shorter
+
+
+def normalize_label(value):
+    """Returns a Gender or Country label the way the filters compare them: ignoring case and spaces."""
+    return str(value).strip().lower()
+
+
+def _scan_executor(workers):
+    """Returns the thread pool that scans shards with the given number of threads, in this process."""
+    key = (os.getpid(), workers)  # Threads don't survive a fork: a forked worker makes its own.
+    if key not in _scan_executors:
+        _scan_executors[key] = ThreadPoolExecutor(workers, thread_name_prefix="scan")
+    return _scan_executors[key]
+
+
+def read_query(query):
+    """
+    Returns (condition, numbers, letters, gender, countries, pattern) from a query given as
+    a dict with those keys (gender, countries and pattern are optional; a pattern string
+    is read with the "pattern_syntax" key, "glob" by default) or as a tuple in that order,
+    as match_batch() accepts them.
+
+    numbers is converted to an int, or a pair of ints for "between", and the letters to
+    strings. Raises ValueError if numbers isn't one (or two) integers.
+    """
+    if isinstance(query, dict):
+        condition, numbers, letters = query["condition"], query["numbers"], query.get("letters", [])
+        gender, countries, pattern = query.get("gender", "Any"), query.get("countries"), query.get("pattern")
+        if isinstance(pattern, str) and pattern:
+            pattern = compile_pattern(pattern, query.get("pattern_syntax", "glob"))
+    else:
+        query = tuple(query)
+        condition, numbers, letters, gender, countries, pattern = (query + ("Any", None, None)[len(query) - 3:])[:6]
+    try:
+        if condition == "between":
+            if isinstance(numbers, (str, bytes)):
+                raise TypeError
+            lower_bound, upper_bound = numbers
+            numbers = (int(lower_bound), int(upper_bound))
+        else:
+            numbers = int(numbers)
+    except (TypeError, ValueError):
+        expected = "a pair of integers" if condition == "between" else "an integer"
+        raise ValueError(f"numbers must be {expected} for the condition {condition!r}, not {numbers!r}") from None
+    return condition, numbers, [str(letter) for letter in letters], gender, countries, read_pattern(pattern)
+
+
+class SearchEngine:
+    """
+    Vectorized name search over a NamesDataset.
+
+    Everything matches_name() recomputes per row (str(), len(), lower()) is precomputed by
+    the dataset and the gender filter compares integer codes, so a query is a handful of
+    NumPy comparisons instead of a Python loop over df.iterrows().
+
+    The rows are partitioned by Country: a query filtered on some countries only looks at
+    their partitions' rows. A name pattern (see name_pattern.py) is only run on the rows
+    that pass the other filters.
+    """
+
+    def __init__(self, dataset, cache=None, workers=None):
+        self.dataset = dataset
+        self.cache = cache  # Optional QueryCache of match_ids() results
+        self.workers = workers if workers is not None else SCAN_WORKERS  # Threads scanning shards
+        self.lengths = dataset.lengths
+        self.chars = dataset.chars
+        self.by_frequency = dataset.by_frequency
+        self.frequency_rank = dataset.frequency_rank
+        self.uneven_ids = dataset.uneven_ids
+        self.by_name = dataset.by_name
+        self.name_rank = dataset.name_rank
+        # Same normalization the apps used per row: str(row["Gender"]).strip().lower(),
+        # applied once per label instead.
+        self.gender_codes, labels = dataset.categorical("Gender")
+        self.gender_labels = [normalize_label(label) for label in labels]
+        self.country_codes, labels = dataset.categorical("Country")
+        self.country_labels = [normalize_label(label) for label in labels]
+        # Per-country partitions: normalized label -> the rows of that country, in file
+        # order and in Frequency order. Labels that only differ in case or spaces share one.
+        self.by_country, self.by_country_frequency = {}, {}
+        names = {}  # Normalized label -> (rows, the most common way it is written)
+        by_frequency = dataset.postings("country_frequency")
+        for code, ids in dataset.postings("country").items():
+            label = self.country_labels[code]
+            if len(ids) > names.get(label, (0, None))[0]:
+                names[label] = (len(ids), str(labels[code]).strip())
+            if label in self.by_country:
+                ids = np.union1d(self.by_country[label], ids)
+                self.by_country_frequency[label] = ids[np.argsort(self.frequency_rank[ids])]
+            else:
+                self.by_country_frequency[label] = by_frequency[code]
+            self.by_country[label] = ids
+        # The countries to choose from.
+        self.country_names = sorted(name for _, name in names.values() if name)
+
+    def __len__(self):
+        return len(self.dataset)
+
+    def length_mask(self, condition, numbers, rows=ALL_ROWS):
+        """
+        Returns a boolean mask of the rows whose name length meets the condition.
+
+        Like the other *_mask() methods, it covers the given rows: all by default, or a
+        slice or an array of row ids.
+        """
+        lengths = self.lengths[rows]
+        if condition == "equal":
+            return lengths == numbers
+        elif condition == "equal_or_lower":
+            return lengths <= numbers
+        elif condition == "equal_or_higher":
+            return lengths >= numbers
+        elif condition == "between":
+            lower_bound, upper_bound = numbers
+            return (lengths >= lower_bound) & (lengths <= upper_bound)
+        return np.zeros(len(lengths), dtype=bool)
+
+    def letter_filters(self, condition, numbers, letters):
+        """
+        Returns the (position, lowercase letter) pairs that matches_name() would check.
+
+        Blank entries are wildcards. For "equal" and "equal_or_higher" only the first
+        'numbers' positions are checked; the other conditions check every position of the name.
+        """
+        limit = len(letters)
+        if condition in ("equal", "equal_or_higher"):
+            limit = min(limit, max(numbers, 0))
+        return [(i, letters[i].lower()) for i in range(limit) if letters[i].strip()]
+
+    def position_mask(self, position, letter, rows=ALL_ROWS):
+        """
+        Returns a boolean mask of the rows that pass the filter 'letter at position'.
+
+        Names shorter than or equal to the position pass, as matches_name() only checks
+        positions that exist in the name.
+        """
+        return _position_mask(self.chars, self.lengths, position, letter, rows)
+
+    def gender_mask(self, gender, rows=ALL_ROWS):
+        """Returns a boolean mask of the rows with the given gender (ignoring case and spaces)."""
+        gender = normalize_label(gender)
+        codes = [code for code, label in enumerate(self.gender_labels) if label == gender]
+        if len(codes) == 1:
+            return self.gender_codes[rows] == codes[0]
+        # Several labels normalize the same: look the codes up in a table of the selected ones.
+        selected = np.zeros(len(self.gender_labels), dtype=bool)
+        selected[codes] = True
+        return selected[self.gender_codes[rows]]
+
+    def selected_countries(self, countries):
+        """
+        Returns the sorted, normalized countries a country filter selects, or None when it
+        doesn't filter: countries is None, empty or "Any", or a country or a list of them.
+        """
+        if isinstance(countries, str):
+            countries = [countries]
+        selected = sorted({normalize_label(country) for country in countries or ()})
+        if not selected or "any" in selected:
+            return None
+        return tuple(selected)
+
+    def country_count(self, countries):
+        """Returns the number of rows in the selected countries' partitions (every row without a filter)."""
+        selected = self.selected_countries(countries)
+        if selected is None:
+            return len(self)
+        return sum(len(self.by_country.get(country, ())) for country in selected)
+
+    def country_rows(self, countries):
+        """
+        Returns the rows of the selected countries' partitions, to pass as the rows of the
+        *_mask() methods: ALL_ROWS without a filter, a slice when the partitions are
+        contiguous (as in a workbook sorted by country), otherwise their sorted row ids.
+        """
+        selected = self.selected_countries(countries)
+        if selected is None:
+            return ALL_ROWS
+        parts = [self.by_country.get(country, np.zeros(0, dtype=np.int64)) for country in selected]
+        ids = parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+        if len(ids) == len(self):
+            return ALL_ROWS
+        if len(ids) and ids[-1] - ids[0] + 1 == len(ids):
+            return slice(int(ids[0]), int(ids[-1]) + 1)
+        return ids
+
+    def country_mask(self, countries, rows=ALL_ROWS):
+        """Returns a boolean mask of the rows from the given countries (ignoring case and spaces)."""
+        selected = self.selected_countries(countries) or ()
+        table = np.zeros(len(self.country_labels), dtype=bool)
+        table[[code for code, label in enumerate(self.country_labels) if label in selected]] = True
+        return table[self.country_codes[rows]]
+
+    def match_mask(self, condition, numbers, letters, gender="Any", countries=None, pattern=None, rows=ALL_ROWS):
+        """
+        Returns a boolean mask of the rows that match the query.
+
+        Parameters are the same as matches_name(), plus gender ("Any" disables the filter),
+        countries (one or a list of them; None or empty disables the filter) and pattern (a
+        NamePattern or a glob the names must also match; None or "" disables it).
+        """
+        mask = self.length_mask(condition, numbers, rows)
+        if condition not in CONDITIONS:
+            return mask
+        for position, letter in self.letter_filters(condition, numbers, letters):
+            mask &= self.position_mask(position, letter, rows)
+        if gender != "Any":
+            mask &= self.gender_mask(gender, rows)
+        if self.country_count(countries) < len(self):
+            mask &= self.country_mask(countries, rows)
+        pattern = read_pattern(pattern)
+        if pattern is not None:
+            # The automaton only runs on the rows left.
+            survivors = np.flatnonzero(mask)
+            ids = survivors + rows.indices(len(self))[0] if isinstance(rows, slice) else np.asarray(rows)[survivors]
+            mask[survivors] = pattern.match_rows(self.chars, self.lengths, ids, self.uneven_ids)
+        return mask
+
+    def match_ids(self, condition, numbers, letters, gender="Any", countries=None, pattern=None):
+        """
+        Returns the sorted row ids of the rows that match the query.
+
+        Only the rows of the selected countries' partitions are scanned. When there are
+        PARALLEL_MIN_ROWS rows or more to scan, they are split in shards scanned in
+        parallel; the shards' ids are concatenated in shard order, so they come out in
+        file order, as from a single scan.
+        """
+        rows = self.country_rows(countries)
+
+        def scan(shard):
+            mask = self.match_mask(condition, numbers, letters, gender, pattern=pattern, rows=shard)
+            return np.flatnonzero(mask) + (shard.start or 0) if isinstance(shard, slice) else shard[mask]
+
+        shards = self.shards(rows)
+        if len(shards) == 1:
+            return scan(rows)
+        return np.concatenate(list(_scan_executor(self.workers).map(scan, shards)))
+
+    def shards(self, rows):
+        """
+        Returns the shards (slices or arrays of row ids) to scan 'rows' in parallel: one
+        per SHARD_ROWS rows, or just 'rows' when they are fewer than PARALLEL_MIN_ROWS or
+        the engine scans in one thread.
+        """
+        if isinstance(rows, slice):
+            start, stop, _ = rows.indices(len(self))
+            if self.workers <= 1 or stop - start < PARALLEL_MIN_ROWS:
+                return [rows]
+            return [slice(begin, min(begin + SHARD_ROWS, stop)) for begin in range(start, stop, SHARD_ROWS)]
+        if self.workers <= 1 or len(rows) < PARALLEL_MIN_ROWS:
+            return [rows]
+        return [rows[begin:begin + SHARD_ROWS] for begin in range(0, len(rows), SHARD_ROWS)]
+
+    def query_key(self, condition, numbers, letters, gender="Any", countries=None, pattern=None):
+        """
+        Returns the canonical form of a query: queries with the same key have the same results.
+
+        Letters are reduced to the (position, lowercase letter) filters actually checked, so
+        blanks, trailing wildcards and letter case don't produce different keys; countries
+        to their sorted normalized labels, and patterns to their compiled tokens.
+        """
+        if condition not in CONDITIONS:
+            return (condition,)
+        numbers = tuple(numbers) if condition == "between" else numbers
+        filters = tuple(self.letter_filters(condition, numbers, letters))
+        gender = None if gender == "Any" else normalize_label(gender)
+        pattern = read_pattern(pattern)
+        return (condition, numbers, filters, gender, self.selected_countries(countries),
+                None if pattern is None else pattern.key)
+
+    def cache_key(self, condition, numbers, letters, gender="Any", countries=None, pattern=None):
+        """
+        Returns the key of a query in the result cache.
+
+        Keys include the dataset version, so results computed on other data are never returned.
+        """
+        return (self.dataset.version, self.query_key(condition, numbers, letters, gender, countries, pattern))
+
+    def cached_match_ids(self, condition, numbers, letters, gender="Any", countries=None, pattern=None):
+        """Same as match_ids(), answered from the cache when there is one."""
+        if self.cache is None:
+            return self.match_ids(condition, numbers, letters, gender, countries, pattern)
+        key = self.cache_key(condition, numbers, letters, gender, countries, pattern)
+        ids = self.cache.get(key)
+        if ids is None:
+            ids = self.match_ids(condition, numbers, letters, gender, countries, pattern)
+            self.cache.put(key, ids)
+        return ids
+
+    def estimate(self, condition, numbers, letters, gender="Any", countries=None, pattern=None):
+        """
+        Returns an upper bound of the number of rows match_ids() looks at for the query, to
+        tell cheap queries from expensive ones. The masks look at every row of the selected
+        countries' partitions.
+        """
+        return self.country_count(countries)
+
+    def match_batch(self, queries):
+        """
+        Answers many queries in one pass. Returns one array of sorted row ids per query, in order.
+
+        Each query is a dict with condition, numbers, letters and optionally gender,
+        countries and pattern (or a tuple in that order). Queries with the same length
+        condition, gender, countries and pattern share one candidate set, identical queries
+        are answered once, and each distinct (position, letter) filter is evaluated once per
+        candidate set, so the cost grows with the number of distinct filters rather than
+        queries x rows.
+        """
+        results = [None] * len(queries)
+        groups = {}  # (condition, numbers, gender, countries, pattern) -> {filters: [query indexes]}
+        patterns = {}  # Pattern key -> pattern
+        for i, query in enumerate(queries):
+            query = read_query(query)
+            key = self.query_key(*query)
+            if len(key) == 1:
+                # Unknown condition: nothing matches.
+                results[i] = np.zeros(0, dtype=np.int64)
+                continue
+            condition, numbers, filters, gender, countries, pattern = key
+            patterns[pattern] = query[5]
+            groups.setdefault((condition, numbers, gender, countries, pattern), {}).setdefault(filters, []).append(i)
+
+        for (condition, numbers, gender, countries, pattern), by_filters in groups.items():
+            candidates = self.match_ids(condition, numbers, [], "Any" if gender is None else gender, countries,
+                                        patterns[pattern])
+            # Filters are evaluated on the candidates' characters, unless the candidates
+            # are a large part of the dataset and gathering them would cost more.
+            dense = len(candidates) * 4 > len(self)
+            rows = ALL_ROWS if dense else candidates
+            masks = {}
+            for filters, indexes in by_filters.items():
+                mask = np.ones(len(self) if dense else len(candidates), dtype=bool)
+                for position, letter in filters:
+                    if (position, letter) not in masks:
+                        masks[(position, letter)] = self.position_mask(position, letter, rows)
+                    mask &= masks[(position, letter)]
+                ids = candidates[mask[candidates]] if dense else candidates[mask]
+                for i in indexes:
+                    results[i] = ids
+        return results
+
+    def sort_by_frequency(self, ids):
+        """Returns the row ids sorted from the highest Frequency to the lowest (ties in file order)."""
+        if len(ids) * 8 > len(self):
+            # Most of the rows: pick them out of the rows already sorted by Frequency.
+            selected = np.zeros(len(self), dtype=bool)
+            selected[ids] = True
+            return self.by_frequency[selected[self.by_frequency]]
+        return ids[np.argsort(self.frequency_rank[ids])]
+
+    def top_ids(self, condition, numbers, letters, gender="Any", countries=None, pattern=None, k=10):
+        """
+        Returns the row ids of the k most frequent matches, most frequent first.
+
+        The rows are checked in Frequency order, a chunk at a time (TOP_CHUNK_ROWS rows,
+        then twice as many at every step), and the search stops at the chunk where the
+        k-th match is found: the more names match, the sooner it stops. If there are
+        fewer than k matches in the first TOP_WALK_FRACTION of the rows, matches are rare:
+        they are all found and sorted instead.
+
+        With a country filter, each selected country's partition is walked that way and
+        the k most frequent of their top k are kept.
+        """
+        selected = self.selected_countries(countries)
+        if selected is None:
+            return self._walk_top(self.by_frequency, condition, numbers, letters, gender, None, pattern, k)
+        tops = [self._walk_top(self.by_country_frequency.get(country, np.zeros(0, dtype=np.int64)),
+                               condition, numbers, letters, gender, [country], pattern, k) for country in selected]
+        return tops[0] if len(tops) == 1 else self.most_frequent(np.concatenate(tops), k)
+
+    def _walk_top(self, order, condition, numbers, letters, gender, countries, pattern, k):
+        """top_ids() over the rows in 'order' (the rows of 'countries', in Frequency order)."""
+        found, count = [], 0
+        start, size = 0, max(TOP_CHUNK_ROWS, 4 * k)
+        while count < k and start < len(order):
+            if start >= len(order) * TOP_WALK_FRACTION:
+                return self.most_frequent(self.match_ids(condition, numbers, letters, gender, countries, pattern), k)
+            chunk = order[start:start + size]
+            ids = chunk[self.match_mask(condition, numbers, letters, gender, pattern=pattern, rows=chunk)]
+            found.append(ids)
+            count += len(ids)
+            start += size
+            size *= 2
+        return np.concatenate(found)[:k] if found else np.zeros(0, dtype=np.int64)
+
+    def most_frequent(self, ids, k):
+        """Returns the k most frequent of the given row ids, most frequent first."""
+        if len(ids) > k:
+            ids = ids[np.argpartition(self.frequency_rank[ids], k)[:k]]
+        return self.sort_by_frequency(ids)
+
+    def similar_ids(self, name, max_distance=1, gender="Any", countries=None):
+        """
+        Returns (row ids, edit distances) of the names within max_distance edits of 'name'
+        (characters inserted, deleted or replaced, ignoring case), closest first and then
+        most frequent first.
+
+        Candidates are the rows of a close enough length that keep enough of the name's
+        characters near their place (see name_fuzzy.letter_counts()); only their distance
+        is computed, all of them at once.
+
+        Parameters:
+          - name: the name to look for
+          - max_distance: the largest number of edits, up to MAX_DISTANCE
+          - gender, countries: the same filters as match_mask()
+        """
+        if not 0 <= max_distance <= MAX_DISTANCE:
+            raise ValueError(f"max_distance must be between 0 and {MAX_DISTANCE}")
+        query = name.strip().lower()
+        rows = self.country_rows(countries)
+
+        def scan(shard):
+            ids = np.arange(*shard.indices(len(self))) if isinstance(shard, slice) else shard
+            mask = self.length_mask("between", (len(query) - max_distance, len(query) + max_distance), shard)
+            # Lowercasing lengthens uneven names: their length tells nothing.
+            mask |= np.isin(ids, self.uneven_ids)
+            if gender != "Any":
+                mask &= self.gender_mask(gender, shard)
+            if len(query) > max_distance:
+                mask &= letter_counts(self.chars, query, max_distance, shard) >= len(query) - max_distance
+            ids = ids[mask]
+            columns = self.chars.take(ids, axis=1)
+            row_lengths = self.lengths[ids]
+            uneven = np.isin(ids, self.uneven_ids)
+            row_lengths[uneven] = np.count_nonzero(columns[:, uneven], axis=0)
+            distances = edit_distances(columns, row_lengths, query, max_distance)
+            close = distances <= max_distance
+            return ids[close], distances[close]
+
+        shards = self.shards(rows)
+        found = [scan(rows)] if len(shards) == 1 else list(_scan_executor(self.workers).map(scan, shards))
+        ids = np.concatenate([ids for ids, _ in found])
+        distances = np.concatenate([distances for _, distances in found])
+        order = np.lexsort((self.frequency_rank[ids], distances))
+        return ids[order], distances[order]
+
+    def prefix_range(self, prefix):
+        """
+        Returns the [start, end) range of by_name holding the names that start with
+        prefix (ignoring case), found by binary search on their first characters.
+        """
+        codes = [ord(char) for char in prefix.lower()]
+        if len(codes) > self.chars.shape[0]:
+            return 0, 0
+        if not codes:
+            return 0, len(self)
+        head = self.chars[:len(codes)]
+
+        def key(position):
+            return head[:, self.by_name[position]].tolist()
+
+        positions = range(len(self))
+        return bisect.bisect_left(positions, codes, key=key), bisect.bisect_right(positions, codes, key=key)
+
+    def suggest_ids(self, prefix, gender="Any", length=None, limit=10):
+        """
+        Returns the row ids of the 'limit' most frequent distinct names starting with
+        prefix (ignoring case), most frequent first: the most frequent row of each name.
+
+        Parameters:
+          - prefix: the start of the names (an empty prefix suggests the most frequent names)
+          - gender: "Any" or the gender of the names
+          - length: None or the length of the names
+          - limit: how many names to return
+        """
+        start, end = self.prefix_range(prefix)
+        if limit <= 0 or start == end:
+            return np.zeros(0, dtype=np.int64)
+        if end - start > SUGGEST_SORT_ROWS:
+            # A common prefix: its names turn up soon in Frequency order.
+            offset, size = 0, TOP_CHUNK_ROWS
+            found, seen = [], set()
+            while offset < len(self) * TOP_WALK_FRACTION:
+                chunk = self.by_frequency[offset:offset + size]
+                ranks = self.name_rank[chunk]
+                ids = self._suggest_filter(chunk[(ranks >= start) & (ranks < end)], gender, length)
+                if self._add_distinct(ids, found, seen, limit):
+                    return np.array(found, dtype=np.int64)
+                offset += size
+                size *= 2
+            # The filters leave few of its names: sort them all.
+        ids = self._suggest_filter(self.by_name[start:end], gender, length)
+        k = limit
+        while True:
+            # The k most frequent rows hold the most frequent names unless some repeat a name.
+            found, seen = [], set()
+            if self._add_distinct(self.most_frequent(ids, k), found, seen, limit) or k >= len(ids):
+                return np.array(found, dtype=np.int64)
+            k *= 2
+
+    def _add_distinct(self, ids, found, seen, limit):
+        """
+        Appends the row ids (in Frequency order) whose name is not in 'seen' yet to 'found',
+        until it holds 'limit' of them. Returns True once it does.
+        """
+        # Only decode as many names as could still be needed.
+        for start in range(0, len(ids), limit):
+            piece = ids[start:start + limit]
+            for row, name in zip(piece.tolist(), self.dataset.names(piece)):
+                name = name.lower()
+                if name not in seen:
+                    seen.add(name)
+                    found.append(row)
+                    if len(found) == limit:
+                        return True
+        return False
+
+    def _suggest_filter(self, ids, gender, length):
+        """Returns the row ids with the given gender and length ("Any" and None don't filter)."""
+        if gender != "Any":
+            ids = ids[self.gender_mask(gender, ids)]
+        if length is not None:
+            ids = ids[self.lengths[ids] == length]
+        return ids
+
+    def ordered_ids(self, condition, numbers, letters, gender="Any", countries=None, pattern=None, order="file",
+                    top_k=None):
+        """
+        Returns the row ids of the matches in the given order ("file" or "frequency").
+
+        With top_k, only the top_k most frequent matches are returned (whatever the order).
+        """
+        if top_k is not None:
+            return self.top_ids(condition, numbers, letters, gender, countries, pattern, top_k)
+        ids = self.cached_match_ids(condition, numbers, letters, gender, countries, pattern)
+        return self.sort_by_frequency(ids) if order == "frequency" else ids
+
+    def search(self, condition, numbers, letters, gender="Any", countries=None, pattern=None, order="file",
+               top_k=None):
+        """Returns the matching rows as a DataFrame, in file order unless sorted by Frequency (see ordered_ids())."""
+        return self.dataset.to_frame(self.ordered_ids(condition, numbers, letters, gender, countries, pattern, order,
+                                                      top_k))
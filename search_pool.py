@@ -0,0 +1,114 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+
+from werkzeug.exceptions import GatewayTimeout, ServiceUnavailable
+
+from instrumentation import profiled
+
+
+class PoolBusy(ServiceUnavailable):
+    description = "Too many searches are running. Please try again in a moment."
+
+
+class SearchTimeout(GatewayTimeout):
+    description = "The search took too long to complete."
+
+
+class SearchPool:
+    """
+    Runs the expensive searches on a bounded pool of threads, apart from the threads that
+    serve the requests.
+
+    Cheap queries (answered from the result cache, or whose length condition leaves at
+    most 'cheap_rows' candidates) run right away in the request's thread, so they never
+    wait behind a scan. The others run on 'workers' threads (NumPy releases the GIL while
+    it compares and sorts arrays), with at most 'max_queue' more waiting for one: past
+    that, PoolBusy (503) is raised at once instead of piling up work. A search that takes
+    longer than 'timeout' seconds raises SearchTimeout (504); its thread still finishes
+    it (threads can't be interrupted) and it counts towards the limit until then.
+
+    Defaults come from NAMES_SEARCH_WORKERS (all the CPUs but one), NAMES_SEARCH_QUEUE (8),
+    NAMES_SEARCH_TIMEOUT (10 seconds) and NAMES_SEARCH_CHEAP_ROWS (100000). With 0 workers
+    every search runs in the request's thread.
+    """
+
+    def __init__(self, workers=None, max_queue=None, timeout=None, cheap_rows=None):
+        if workers is None:
+            workers = int(os.environ.get("NAMES_SEARCH_WORKERS", max((os.cpu_count() or 2) - 1, 1)))
+        self.workers = workers
+        self.max_queue = max_queue if max_queue is not None else int(os.environ.get("NAMES_SEARCH_QUEUE", 8))
+        self.timeout = timeout if timeout is not None else float(os.environ.get("NAMES_SEARCH_TIMEOUT", 10))
+        self.cheap_rows = cheap_rows if cheap_rows is not None else int(os.environ.get("NAMES_SEARCH_CHEAP_ROWS", 100_000))
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix="search") if workers else None
+        self._slots = threading.BoundedSemaphore(workers + self.max_queue) if workers else None
+        self._lock = threading.Lock()
+        self.inline = 0
+        self.pooled = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def is_cheap(self, engine, condition, numbers, letters, gender="Any", countries=None, pattern=None):
+        """Returns True if the query can run in the request's thread."""
+        query = (condition, numbers, letters, gender, countries, pattern)
+        if engine.cache is not None and engine.cache_key(*query) in engine.cache:
+            return True
+        return engine.estimate(*query) <= self.cheap_rows
+
+    def run(self, function, *args):
+        """
+        Returns function(*args), run on the pool.
+
+        Raises PoolBusy when the pool and its queue are full, and SearchTimeout when it
+        takes longer than the timeout. In a sampled request, it is profiled on the pool's
+        thread too (see instrumentation.profiled()).
+        """
+        if self._executor is None:
+            self._count("inline")
+            return function(*args)
+        if not self._slots.acquire(blocking=False):
+            self._count("rejected")
+            raise PoolBusy()
+        try:
+            future = self._executor.submit(profiled(function), *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda future: self._slots.release())
+        self._count("pooled")
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            future.cancel()  # Only stops it if it hasn't started yet.
+            self._count("timeouts")
+            raise SearchTimeout()
+
+    def match_ids(self, engine, condition, numbers, letters, gender="Any", countries=None, pattern=None, order="file",
+                  top_k=None):
+        """
+        Returns engine.ordered_ids() for the query, in this thread if the query is cheap
+        and on the pool otherwise.
+        """
+        query = (condition, numbers, letters, gender, countries, pattern)
+        if self.is_cheap(engine, *query):
+            self._count("inline")
+            return engine.ordered_ids(*query, order, top_k)
+        return self.run(engine.ordered_ids, *query, order, top_k)
+
+    def stats(self):
+        """Returns the pool's settings and how many searches ran inline, pooled, were rejected or timed out."""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_queue": self.max_queue,
+                "timeout": self.timeout,
+                "cheap_rows": self.cheap_rows,
+                "inline": self.inline,
+                "pooled": self.pooled,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
@@ -0,0 +1,136 @@
+"""
+Reports how long a Flask app takes to start: to import it, to create it, to accept its
+first connection and to answer 200 on /ready, for each way of loading the dataset
+(NAMES_DATA_LOAD):
+
+  - now: the dataset is loaded by create_app(), before the server starts listening (like
+    the old module-level load).
+  - background: it is loaded on a thread while the server already accepts requests.
+
+Usage: python startup_report.py [--app flask_app|app2] [--runs N] [--cold] [names.xlsx]
+
+Each run starts a new server process in a temporary directory holding a copy of the
+workbook. With --cold the snapshot is removed before every run, so it is rebuilt from
+the workbook (the first start after the workbook changed); otherwise it is built once
+beforehand and every run opens it.
+"""
+import argparse
+import json
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+
+from names_data import build_snapshot, snapshot_path
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Runs in the server process: reports the import and create_app() times, then serves.
+SERVER = """
+import json, sys, time
+started = time.perf_counter()
+import {app} as module
+imported = time.perf_counter()
+app = module.create_app()
+created = time.perf_counter()
+print(json.dumps({{"import": imported - started, "create_app": created - imported}}), flush=True)
+from werkzeug.serving import run_simple
+run_simple("127.0.0.1", int(sys.argv[1]), app, threaded=True)
+"""
+
+# Longest time to wait for a server to listen and then to be ready.
+TIMEOUT = 300
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(check, process):
+    """Returns once check() is true, raising if the server exited or TIMEOUT passed."""
+    deadline = time.perf_counter() + TIMEOUT
+    while not check():
+        if process.poll() is not None:
+            raise RuntimeError(f"the server exited with status {process.returncode}")
+        if time.perf_counter() > deadline:
+            raise TimeoutError("the server took too long to start")
+        time.sleep(0.01)
+
+
+def listening(port):
+    try:
+        socket.create_connection(("127.0.0.1", port), timeout=1).close()
+    except OSError:
+        return False
+    return True
+
+
+def is_ready(port):
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/ready", timeout=TIMEOUT) as response:
+            return response.status == 200
+    except urllib.error.HTTPError:
+        return False  # 503 while the dataset is loading
+
+
+def start(app, directory, load):
+    """
+    Starts a server for 'app' in 'directory' with NAMES_DATA_LOAD='load'.
+
+    Returns a dict of the seconds it took to import the app, create it, accept a
+    connection and be ready, all but the first two from the process's start.
+    """
+    port = free_port()
+    env = dict(os.environ, NAMES_DATA_LOAD=load, PYTHONPATH=HERE)
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-c", SERVER.format(app=app), str(port)], cwd=directory, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    try:
+        wait_for(lambda: listening(port), process)
+        times = {"listening": time.perf_counter() - started}
+        wait_for(lambda: is_ready(port), process)
+        times["ready"] = time.perf_counter() - started
+        times.update(json.loads(process.stdout.readline()))
+    finally:
+        process.terminate()
+        process.wait()
+    return times
+
+
+def report(app, path, runs, cold):
+    with tempfile.TemporaryDirectory() as directory:
+        workbook = os.path.join(directory, "names.xlsx")
+        shutil.copy(path, workbook)
+        if not cold:
+            build_snapshot(workbook)
+
+        print(f"{app}, {'cold (the snapshot is rebuilt)' if cold else 'warm (the snapshot exists)'}, "
+              f"median of {runs} runs:")
+        print(f"  {'load':<11} {'import s':>9} {'create_app s':>13} {'listening s':>12} {'ready s':>8}")
+        for load in ("now", "background"):
+            samples = []
+            for _ in range(runs):
+                if cold and os.path.exists(snapshot_path(workbook)):
+                    os.remove(snapshot_path(workbook))
+                samples.append(start(app, directory, load))
+            median = {key: statistics.median(sample[key] for sample in samples) for key in samples[0]}
+            print(f"  {load:<11} {median['import']:>9.3f} {median['create_app']:>13.3f} "
+                  f"{median['listening']:>12.3f} {median['ready']:>8.3f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the startup time of the apps for each load mode.")
+    parser.add_argument("path", nargs="?", default="names.xlsx")
+    parser.add_argument("--app", choices=["flask_app", "app2"], default="flask_app")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--cold", action="store_true", help="rebuild the snapshot from the workbook on every run")
+    args = parser.parse_args()
+    report(args.app, os.path.abspath(args.path), args.runs, args.cold)
@@ -0,0 +1,21 @@
+// Dynamically generate letter input boxes based on the number entered.
+function generateLetterInputs() {
+  var numLetters = document.getElementById("num_letters").value;
+  var container = document.getElementById("letterInputs");
+  container.innerHTML = "";
+  var prefilled = JSON.parse(container.dataset.prefilled || "[]");
+  numLetters = parseInt(numLetters);
+  if (isNaN(numLetters) || numLetters < 1) return;
+  for (var i = 0; i < numLetters; i++) {
+    var input = document.createElement("input");
+    input.setAttribute("type", "text");
+    input.setAttribute("name", "letters");
+    input.setAttribute("maxlength", "1");
+    if (prefilled && prefilled[i]) {
+      input.value = prefilled[i];
+    }
+    container.appendChild(input);
+  }
+}
+window.addEventListener("load", generateLetterInputs);
+document.getElementById("num_letters").addEventListener("change", generateLetterInputs);
@@ -0,0 +1,49 @@
+// Update the numeric input fields based on the selected condition.
+function updateNumberInputs() {
+  var condition = document.getElementById("condition").value;
+  var numberInputsSpan = document.getElementById("numberInputs");
+  if (condition === "between") {
+    numberInputsSpan.innerHTML = '<input type="number" id="num_letters_lower" name="num_letters_lower" min="1" placeholder="Min"> ' +
+                                 '<input type="number" id="num_letters_upper" name="num_letters_upper" min="1" placeholder="Max">';
+  } else {
+    numberInputsSpan.innerHTML = '<input type="number" id="num_letters" name="num_letters" min="1" value="5">';
+  }
+  generateLetterInputs(); // Regenerate letter boxes
+}
+
+// Dynamically generate letter input boxes based on the number specified.
+function generateLetterInputs() {
+  var condition = document.getElementById("condition").value;
+  var numLetters;
+  if (condition === "between") {
+    // Use the upper value (if available)
+    numLetters = document.getElementById("num_letters_upper").value;
+  } else {
+    numLetters = document.getElementById("num_letters").value;
+  }
+  var container = document.getElementById("letterInputs");
+  container.innerHTML = ""; // Clear previous inputs
+
+  var prefilled = JSON.parse(container.dataset.prefilled || "[]");
+  numLetters = parseInt(numLetters);
+  if (isNaN(numLetters) || numLetters < 1) {
+    return;
+  }
+  for (var i = 0; i < numLetters; i++) {
+    var input = document.createElement("input");
+    input.setAttribute("type", "text");
+    input.setAttribute("name", "letters");
+    input.setAttribute("maxlength", "1");
+    if (prefilled && prefilled[i]) {
+      input.value = prefilled[i];
+    }
+    container.appendChild(input);
+  }
+}
+
+window.addEventListener("load", generateLetterInputs);
+document.addEventListener("change", function(e) {
+  if (e.target.id === "num_letters" || e.target.id === "num_letters_upper") {
+    generateLetterInputs();
+  }
+});
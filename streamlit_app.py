@@ -1,81 +1,75 @@
+import os
+
+import numpy as np
 import streamlit as st
-import pandas as pd
+from data_manager import DataManager
+from name_fuzzy import MAX_DISTANCE
+from name_pattern import PatternError, compile_pattern
+from query_cache import QueryCache
+
+# Results of recent queries are kept for RESULTS_TTL seconds (NAMES_RESULTS_TTL), at most
+# RESULTS_CACHE_SIZE of them (NAMES_RESULTS_CACHE_SIZE), and shown a page at a time.
+RESULTS_TTL = float(os.environ.get("NAMES_RESULTS_TTL", 600))
+RESULTS_CACHE_SIZE = int(os.environ.get("NAMES_RESULTS_CACHE_SIZE", 256))
+PAGE_SIZES = [25, 100, 500]
 
 # ------------------------------------------------
-# Load the Excel file with caching for performance.
+# Load the names (memory-mapped from the snapshot of the Excel file) and build the
+# search index once, shared across reruns and sessions without being copied (unlike
+# st.cache_data, st.cache_resource hands out the object itself). The data manager
+# reloads them in the background whenever the Excel file changes.
 # ------------------------------------------------
-@st.cache_data
+@st.cache_resource
 def load_data():
     try:
-        data = pd.read_excel("names.xlsx")
+        return DataManager("names.xlsx", cache=QueryCache(RESULTS_CACHE_SIZE, ttl=RESULTS_TTL))
     except Exception as e:
         st.error("Error reading 'names.xlsx'. Please ensure the file exists and is valid.")
         return None
 
-    # If the Excel file doesn't have the expected headers, assume the columns are in this order.
-    if data.columns.size >= 4 and not all(col in data.columns for col in ["Name", "Frequency", "Country", "Gender"]):
-        data.columns = ["Name", "Frequency", "Country", "Gender"]
-    return data
 
-df = load_data()
-if df is None:
-    st.stop()  # Stop if the data couldn’t be loaded.
-
-# ------------------------------------------------
-# Function to check if a given name meets the criteria.
-# ------------------------------------------------
-def matches_name(name, condition, numbers, letters):
+@st.cache_resource
+def results_cache():
+    """
+    The row ids of recent queries in their display order (for similar names, one array
+    of two rows: the ids and their edit distances), shared by every session, so a rerun
+    (e.g. to show another page) doesn't search again.
     """
-    Returns True if the given name meets the length condition and letter filters.
+    return QueryCache(RESULTS_CACHE_SIZE, ttl=RESULTS_TTL)
 
-    Parameters:
-      - name: candidate name (string)
-      - condition: one of "equal", "equal_or_lower", "equal_or_higher", "between"
-      - numbers: an integer (for non-between) or a tuple (lower_bound, upper_bound) for "between"
-      - letters: list of letter filters (blank entries act as wildcards)
+
+def find_results(engine, query):
+    """
+    Returns (row ids, edit distances or None) for a query saved from the form, from the
+    results cache when it was run recently.
     """
-    name = str(name)
-    L = len(name)
-    name_lower = name.lower()
-
-    if condition == "equal":
-        if L != numbers:
-            return False
-        for i in range(numbers):
-            if i < len(letters) and letters[i].strip():
-                if name_lower[i] != letters[i].lower():
-                    return False
-        return True
-
-    elif condition == "equal_or_lower":
-        if L > numbers:
-            return False
-        for i in range(L):
-            if i < len(letters) and letters[i].strip():
-                if name_lower[i] != letters[i].lower():
-                    return False
-        return True
-
-    elif condition == "equal_or_higher":
-        if L < numbers:
-            return False
-        for i in range(numbers):
-            if i < len(letters) and letters[i].strip():
-                if name_lower[i] != letters[i].lower():
-                    return False
-        return True
-
-    elif condition == "between":
-        lower_bound, upper_bound = numbers
-        if not (lower_bound <= L <= upper_bound):
-            return False
-        for i in range(min(len(letters), L)):
-            if letters[i].strip():
-                if name_lower[i] != letters[i].lower():
-                    return False
-        return True
-
-    return False
+    cache = results_cache()
+    if query["similar_to"].strip():
+        key = (engine.dataset.version, "similar", query["similar_to"].strip().lower(), query["max_distance"],
+               query["gender"], tuple(query["countries"]), query["top_k"])
+    else:
+        pattern = compile_pattern(query["pattern"], query["pattern_syntax"]) if query["pattern"] else None
+        search = (query["condition"], query["numbers"], query["letters"], query["gender"], query["countries"], pattern)
+        key = (engine.dataset.version, "search", engine.query_key(*search), query["order"], query["top_k"])
+    found = cache.get(key)
+    if found is not None:
+        return (found[0], found[1]) if found.ndim == 2 else (found, None)
+    if query["similar_to"].strip():
+        # Closest names first, then the most common.
+        ids, distances = engine.similar_ids(query["similar_to"], query["max_distance"], query["gender"],
+                                            query["countries"])
+        if query["top_k"]:
+            ids, distances = ids[:query["top_k"]], distances[:query["top_k"]]
+        cache.put(key, np.stack([ids, distances]))
+    else:
+        ids = engine.ordered_ids(*search, query["order"], query["top_k"] or None)
+        cache.put(key, ids)
+    return ids, distances
+
+data = load_data()
+if data is None:
+    st.stop()  # Stop if the data couldn’t be loaded.
+engine = data.engine  # The current version, used for the whole rerun.
 
 # ------------------------------------------------
 # Streamlit User Interface
@@ -101,6 +95,22 @@ with st.form("search_form"):
     # Select a gender filter.
     gender_filter = st.selectbox("Gender:", ["Any", "Boy", "Girl"])
 
+    # Select the countries to search in (none selected: all of them).
+    countries = st.multiselect("Country:", engine.country_names, placeholder="All countries")
+
+    # Optionally, a pattern the names must also match.
+    pattern = st.text_input("Pattern (optional):", placeholder="e.g. *ia, *ar*, ?[aeiou]*")
+    pattern_syntax = st.radio("Pattern syntax:", ["glob", "regex"], horizontal=True)
+
+    # Or names similar to a given one (then only the gender and country filters apply).
+    similar_to = st.text_input("Similar to (optional):", placeholder="e.g. Catalina")
+    max_distance = st.slider("Within this many edits:", min_value=1, max_value=MAX_DISTANCE, value=1)
+
+    # Order of the results, and optionally only the most common names.
+    order = st.selectbox("Order:", ["file", "frequency"],
+                         format_func=lambda order: "Most common first" if order == "frequency" else "File order")
+    top_k = st.number_input("Only the top (0 for all):", min_value=0, value=0, step=1, key="top_k")
+
     # Create letter input boxes dynamically.
     st.write("Enter letter filters for each position (leave blank for a wildcard):")
     letters = []
@@ -113,20 +123,40 @@ with st.form("search_form"):
     submitted = st.form_submit_button("Search")
 
 # ------------------------------------------------
-# Perform the search and display results when the form is submitted.
+# Perform the search when the form is submitted, and display the results a page at a
+# time (the query is kept in the session, so changing page reruns without resubmitting).
 # ------------------------------------------------
 if submitted:
-    results = []
-    for _, row in df.iterrows():
-        # Apply gender filter (ignoring case and extra spaces).
-        if gender_filter != "Any":
-            if str(row["Gender"]).strip().lower() != gender_filter.strip().lower():
-                continue
-        if matches_name(row["Name"], condition, numbers, letters):
-            results.append(row.to_dict())
-
-    if results:
+    try:
+        if pattern:
+            compile_pattern(pattern, pattern_syntax)
+    except PatternError as e:
+        st.error(str(e))
+        st.stop()
+    st.session_state["query"] = {
+        "condition": condition, "numbers": numbers, "letters": letters, "gender": gender_filter,
+        "countries": countries, "pattern": pattern, "pattern_syntax": pattern_syntax, "order": order,
+        "top_k": int(top_k), "similar_to": similar_to, "max_distance": max_distance,
+    }
+    st.session_state["page"] = 1
+
+if "query" in st.session_state:
+    # Gender and country are compared ignoring case and extra spaces; only the selected
+    # countries' rows are searched.
+    ids, distances = find_results(engine, st.session_state["query"])
+
+    if len(ids):
         st.write("### Results")
-        st.dataframe(pd.DataFrame(results))
+        page_size = st.selectbox("Results per page:", PAGE_SIZES, index=1)
+        pages = max(-(-len(ids) // page_size), 1)
+        page = st.number_input(f"Page (of {pages}):", min_value=1, max_value=pages, step=1, key="page")
+        start = (min(page, pages) - 1) * page_size
+        end = min(start + page_size, len(ids))
+        st.write(f"Showing {start + 1}-{end} of {len(ids)}")
+        # Only the rows of the page are decoded.
+        results = engine.dataset.to_frame(ids[start:end])
+        if distances is not None:
+            results["Distance"] = distances[start:end]
+        st.dataframe(results.reset_index(drop=True))
     else:
         st.write("No matching names found.")
@@ -0,0 +1,60 @@
+import os
+
+from data_manager import DataManager
+from names_delta import append_changes, compact, load_current, reset
+
+NAIA = {"Name": "NAIA", "Frequency": 850, "Country": "Spain", "Gender": "Girl"}
+HUGO = {"Name": "HUGO", "Frequency": 3000, "Country": "Spain", "Gender": "Boy"}
+
+
+def touch(path):
+    """Changes the workbook's version (its mtime) without changing its contents."""
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+
+def rows(dataset):
+    return {(row["Name"], row["Country"]): row["Frequency"] for row in dataset.records(range(len(dataset)))}
+
+
+def test_upsert_survives_touching_the_workbook(workbook):
+    data = DataManager(workbook, interval=0)
+    data.upsert([NAIA, HUGO])
+    assert rows(data.dataset)[("NAIA", "Spain")] == 850
+    version = data.version
+
+    touch(workbook)
+    assert data.reload()
+    assert rows(data.dataset)[("NAIA", "Spain")] == 850
+    assert rows(data.dataset)[("HUGO", "Spain")] == 3000
+    assert data.version != version
+    assert rows(load_current(workbook)[0]) == rows(data.dataset)
+
+
+def test_compacted_changes_survive_touching_the_workbook(workbook):
+    append_changes(workbook, [NAIA])
+    assert compact(workbook)
+    append_changes(workbook, [HUGO])
+    changed = rows(load_current(workbook)[0])
+
+    touch(workbook)
+    dataset, _, _, _, count = load_current(workbook)
+    assert rows(dataset) == changed
+    assert count == 2  # The snapshot was rebuilt from the workbook: the whole log applies again.
+
+
+def test_same_version_whether_compacted_or_not(workbook):
+    append_changes(workbook, [NAIA, HUGO])
+    incremental = load_current(workbook)[0]
+    compact(workbook)
+    compacted = load_current(workbook)[0]
+    assert compacted.version == incremental.version
+    assert rows(compacted) == rows(incremental)
+
+
+def test_reset_drops_the_changes(workbook):
+    before = rows(load_current(workbook)[0])
+    append_changes(workbook, [NAIA])
+    compact(workbook)
+    assert reset(workbook) == 1
+    assert rows(load_current(workbook)[0]) == before
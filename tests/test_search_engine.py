@@ -0,0 +1,70 @@
+import itertools
+
+import pandas as pd
+import pytest
+
+import name_index
+from conftest import ROWS
+from name_index import NameIndex
+from name_pattern import compile_pattern
+from names_data import NamesDataset
+from search_engine import SearchEngine, matches_name, normalize_label
+
+# The small workbook, plus names whose lowercase is longer than they are (İ), that have
+# letters without a single-character uppercase (ß), and labels written several ways.
+FRAME = pd.DataFrame(ROWS + [
+    ("İsmail", 120, "Turkey", "Boy"),
+    ("STRAßE", 5, "Germany", "GIRL"),
+    ("Mia", 900, " spain", "girl"),
+    ("Iñigo", 60, "SPAIN ", " Boy"),
+    ("Ma", 10, "France", "Girl"),
+    ("Amaia", 1200, "Spain", "Girl"),
+], columns=["Name", "Frequency", "Country", "Gender"])
+
+QUERIES = [
+    ("equal", 3), ("equal", 5), ("equal", 6), ("equal_or_lower", 4), ("equal_or_lower", 0),
+    ("equal_or_higher", 4), ("equal_or_higher", 7), ("between", (3, 5)), ("between", (5, 7)), ("between", (6, 4)),
+]
+LETTERS = [[], ["m"], ["M", "", ""], ["", "a"], [" ", "u"], ["i"], ["İ"], ["", "", "", "", "ß"], ["", "", "", "", "SS"],
+           ["æ"], ["", "", "", "", "", "", "", "", "x"]]
+GENDERS = ["Any", "Girl", " GIRL ", "boy", "Other"]
+COUNTRIES = [None, [], "Any", ["Spain"], [" SPAIN ", "france"], ["Turkey", "Germany"], ["Nowhere"]]
+PATTERNS = [None, compile_pattern("*a*"), compile_pattern("?[aeiou]*"), compile_pattern("^[a-m].*a$", "regex"),
+            compile_pattern("ß", "regex")]
+
+
+def reference_ids(condition, numbers, letters, gender, countries, pattern):
+    """Returns the ids of the rows that match, checked one row at a time with matches_name()."""
+    if isinstance(countries, str):
+        countries = [countries]
+    selected = {normalize_label(country) for country in countries or ()}
+    ids = []
+    for i, (name, _, country, row_gender) in enumerate(FRAME.itertuples(index=False)):
+        if not matches_name(name, condition, numbers, letters):
+            continue
+        if gender != "Any" and normalize_label(row_gender) != normalize_label(gender):
+            continue
+        if selected and "any" not in selected and normalize_label(country) not in selected:
+            continue
+        if pattern is not None and not pattern.matches(name):
+            continue
+        ids.append(i)
+    return ids
+
+
+@pytest.fixture(scope="module")
+def dataset():
+    return NamesDataset.from_frame(FRAME)
+
+
+@pytest.mark.parametrize("condition, numbers", QUERIES)
+def test_same_matches_as_matches_name(dataset, monkeypatch, condition, numbers):
+    # Every query the index can answer from its posting lists is, instead of scanning.
+    monkeypatch.setattr(name_index, "SCAN_FRACTION", 1.0)
+    engine, index = SearchEngine(dataset), NameIndex(dataset)
+    for letters, gender, countries, pattern in itertools.product(LETTERS, GENDERS, COUNTRIES, PATTERNS):
+        query = (condition, numbers, letters, gender, countries, pattern)
+        expected = reference_ids(*query)
+        assert engine.match_ids(*query).tolist() == expected, query
+        assert list(engine.match_mask(*query).nonzero()[0]) == expected, query
+        assert index.match_ids(*query).tolist() == expected, query
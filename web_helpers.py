@@ -0,0 +1,515 @@
+import hashlib
+import json
+import os
+
+from flask import Response, abort, current_app, jsonify, render_template, request, stream_with_context, url_for
+from werkzeug.exceptions import ServiceUnavailable
+
+from data_manager import DataNotReady
+from instrumentation import set_condition, stage
+from name_fuzzy import MAX_DISTANCE
+from name_pattern import PatternError, compile_pattern
+from search_engine import ORDERS
+from search_pool import SearchPool
+
+# Page sizes offered by the search forms; "all" streams every match instead.
+PAGE_SIZES = [25, 100, 500]
+DEFAULT_PAGE_SIZE = 100
+
+# Rows decoded per batch while streaming, and template output pieces sent per chunk.
+STREAM_CHUNK_SIZE = 500
+STREAM_BUFFER_SIZE = 200
+
+# Prefix suggestions returned by default, and at most.
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 100
+
+# max-age of the static CSS/JS (one year); their URLs change with their content.
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+# Retry-After (seconds) of the 503 responses sent while the dataset isn't loaded.
+NOT_READY_RETRY_AFTER = 5
+
+
+def page_params(values):
+    """
+    Returns (page number, page size) from the request values ('page' and 'page_size').
+
+    The page size is None when all the results were requested.
+    """
+    try:
+        page = max(int(values.get("page", 1)), 1)
+    except ValueError:
+        page = 1
+    page_size = values.get("page_size", str(DEFAULT_PAGE_SIZE))
+    if page_size == "all":
+        return page, None
+    try:
+        page_size = max(int(page_size), 1)
+    except ValueError:
+        page_size = DEFAULT_PAGE_SIZE
+    return page, page_size
+
+
+def order_params(values):
+    """
+    Returns (order, top_k) from the request values ('order' and 'top_k').
+
+    order is "file" (the default) or "frequency" (most frequent names first); top_k is
+    None unless only the top_k most frequent matches were requested.
+    """
+    order = values.get("order", "file")
+    if order not in ORDERS:
+        order = "file"
+    try:
+        top_k = max(int(values.get("top_k", "")), 0)
+    except ValueError:
+        top_k = None
+    return order, top_k
+
+
+def pattern_params(values):
+    """
+    Returns the compiled name pattern from the request values ('pattern' and
+    'pattern_syntax', "glob" by default), or None when there is none.
+
+    Aborts with 400 Bad Request on an invalid pattern.
+    """
+    pattern = values.get("pattern", "")
+    if not pattern:
+        return None
+    try:
+        return compile_pattern(pattern, values.get("pattern_syntax", "glob"))
+    except PatternError as e:
+        abort(400, str(e))
+
+
+def similar_params(values):
+    """
+    Returns (name, max_distance) from the request values ('similar_to' and
+    'max_distance', 1 by default), or None when no similar names were requested.
+
+    Aborts with 400 Bad Request when max_distance isn't a number of edits from 0 to
+    MAX_DISTANCE.
+    """
+    name = values.get("similar_to", "").strip()
+    if not name:
+        return None
+    try:
+        max_distance = int(values.get("max_distance", "") or 1)
+    except ValueError:
+        max_distance = -1
+    if not 0 <= max_distance <= MAX_DISTANCE:
+        abort(400, f"max_distance must be a number from 0 to {MAX_DISTANCE}.")
+    return name, max_distance
+
+
+def similar_search(pool, engine, similar, gender="Any", countries=None, top_k=None):
+    """
+    Returns (row ids, edit distances) of the names similar to a (name, max_distance) pair
+    from similar_params(), closest first and then most frequent first (only the first
+    top_k, if given), searched on the pool.
+    """
+    ids, distances = pool.run(engine.similar_ids, *similar, gender, countries)
+    if top_k is not None:
+        ids, distances = ids[:top_k], distances[:top_k]
+    return ids, distances
+
+
+def with_distances(records, distances):
+    """Yields the records (dicts, or an iterator of them) with their edit distance added as "Distance"."""
+    for record, distance in zip(records, distances.tolist()):
+        record["Distance"] = distance
+        yield record
+
+
+def _canonical(value):
+    # Sets (as in compiled patterns) have no fixed order from one process to the next.
+    if isinstance(value, (set, frozenset)):
+        return sorted(_canonical(item) for item in value)
+    if isinstance(value, (tuple, list)):
+        return [_canonical(item) for item in value]
+    return value
+
+
+def result_etag(*parts):
+    """
+    Returns the (weak) ETag of a result from the parts that decide it: the dataset
+    version, the normalized query and how the results are shown. It is the same in every
+    worker process, and changes whenever the data does.
+    """
+    canonical = json.dumps(_canonical(parts), default=str, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:32]
+
+
+def search_etag(engine, query, similar=None, *shown):
+    """
+    Returns result_etag() of a search: the query as engine arguments, or the (name,
+    max_distance) of a similar-name search, then whatever else changes the response
+    (page, order, format...).
+    """
+    if similar is None:
+        key = engine.query_key(*query)
+    else:
+        name, max_distance = similar
+        gender = None if query[3] == "Any" else query[3].strip().lower()
+        key = ("similar", name.strip().lower(), max_distance, gender, engine.selected_countries(query[4]))
+    return result_etag(engine.dataset.version, request.path, key, *shown)
+
+
+def not_modified(etag):
+    """
+    Returns a 304 Not Modified response when the GET request's If-None-Match has the ETag
+    (the client already has this result), otherwise None: then the result has to be built.
+    """
+    if request.method not in ("GET", "HEAD") or not request.if_none_match.contains_weak(etag):
+        return None
+    return with_etag(Response(status=304), etag)
+
+
+def with_etag(response, etag):
+    """
+    Returns the response with its ETag. Cache-Control: no-cache lets browsers and proxies
+    keep it, but makes them check it is still current (a 304, if it is) before reusing it.
+    """
+    response.set_etag(etag, weak=True)
+    response.cache_control.no_cache = True
+    return response
+
+
+def suggest_params(values):
+    """
+    Returns (prefix, gender, length, limit) from the request values ('prefix', 'gender',
+    'length' and 'limit').
+
+    gender is "Any" and length None when they are not given; limit is
+    DEFAULT_SUGGESTIONS by default and at most MAX_SUGGESTIONS.
+    """
+    prefix = values.get("prefix", "")
+    gender = values.get("gender", "") or "Any"
+    try:
+        length = int(values.get("length", ""))
+    except ValueError:
+        length = None
+    try:
+        limit = min(max(int(values.get("limit", DEFAULT_SUGGESTIONS)), 0), MAX_SUGGESTIONS)
+    except ValueError:
+        limit = DEFAULT_SUGGESTIONS
+    return prefix, gender, length, limit
+
+
+def suggest_response(dataset, prefix, ids):
+    """Returns the prefix suggestions as {"prefix", "suggestions": [...]}, one row per name."""
+    body = {"prefix": prefix, "suggestions": dataset.records(ids)}
+    return Response(json.dumps(body, separators=(",", ":"), ensure_ascii=False), mimetype="application/json")
+
+
+def paginate(ids, page, page_size):
+    """
+    Returns (page info, row ids on the page) for the sorted row ids of a result.
+
+    The page info has the page number, size, number of pages, total matches and the
+    [start, end) range of the page. Out of range page numbers are clamped.
+    """
+    total = len(ids)
+    if page_size is None:
+        pages, page, start, end = 1, 1, 0, total
+    else:
+        pages = max(-(-total // page_size), 1)
+        page = min(page, pages)
+        start = (page - 1) * page_size
+        end = min(start + page_size, total)
+    info = {"number": page, "size": page_size, "pages": pages, "total": total, "start": start, "end": end}
+    return info, ids[start:end]
+
+
+def stream_template(template, **context):
+    """
+    Renders a compiled template as a streamed response.
+
+    Like flask.stream_template(), but the output is sent in chunks of STREAM_BUFFER_SIZE
+    pieces instead of one write per template statement.
+    """
+    app = current_app._get_current_object()
+    app.update_template_context(context)
+    stream = template.stream(context)
+    stream.enable_buffering(STREAM_BUFFER_SIZE)
+    return Response(stream_with_context(stream))
+
+
+def init_assets(app):
+    """
+    Serves the static CSS/JS as long-lived cacheable files.
+
+    Static files get a one-year max-age (Flask adds ETag and Last-Modified headers), and
+    templates link them with asset_url(filename), which puts a hash of the file's content
+    in the URL so browsers fetch a file again only when it changes.
+    """
+    app.config["SEND_FILE_MAX_AGE_DEFAULT"] = STATIC_MAX_AGE
+    versions = {}
+
+    def asset_url(filename):
+        if filename not in versions:
+            with open(os.path.join(app.static_folder, filename), "rb") as f:
+                versions[filename] = hashlib.sha256(f.read()).hexdigest()[:12]
+        return url_for("static", filename=filename, v=versions[filename])
+
+    app.jinja_env.globals["asset_url"] = asset_url
+
+
+def init_readiness(app, data, gettext=None):
+    """
+    Adds /ready, the readiness probe of the app serving the DataManager 'data': 200 once
+    the dataset is loaded, 503 while it is loading or if it couldn't be, with data.stats()
+    (version, load time, last error) either way.
+
+    Requests that need the dataset while it isn't available get a 503 with a Retry-After
+    header (DataNotReady). Messages go through 'gettext' to be translated, if given.
+    """
+    gettext = gettext or (lambda message: message)
+
+    @app.route("/ready")
+    def ready():
+        stats = data.stats()
+        return jsonify(stats), 200 if stats["ready"] else 503
+
+    @app.errorhandler(DataNotReady)
+    def data_not_ready(error):
+        if error.error is None:
+            description = gettext("The names data is still loading. Please try again in a moment.")
+        else:
+            description = gettext("Error reading 'names.xlsx'. Please ensure the file exists and is valid.")
+        response = ServiceUnavailable(description).get_response()
+        response.headers["Retry-After"] = str(NOT_READY_RETRY_AFTER)
+        return response
+
+
+def search_api_response(dataset, ids, page_number, page_size, format="json", distances=None):
+    """
+    Returns the page of the results requested from the search API.
+
+    With the edit distances of a similar-name search, every row gets its "Distance".
+
+    format="json" returns one compact JSON object with the paging metadata and the rows.
+    format="ndjson" streams one JSON object per row, decoded in chunks; the paging
+    metadata goes in X-Total-Count, X-Page, X-Page-Size and X-Pages headers.
+    """
+    page, page_ids = paginate(ids, page_number, page_size)
+    if format == "ndjson":
+        def generate():
+            records = dataset.iter_records(page_ids, STREAM_CHUNK_SIZE)
+            if distances is not None:
+                records = with_distances(records, distances[page["start"]:page["end"]])
+            for record in records:
+                yield json.dumps(record, separators=(",", ":"), ensure_ascii=False) + "\n"
+        headers = {
+            "X-Total-Count": str(page["total"]),
+            "X-Page": str(page["number"]),
+            "X-Page-Size": "all" if page["size"] is None else str(page["size"]),
+            "X-Pages": str(page["pages"]),
+        }
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson", headers=headers)
+    records = dataset.records(page_ids)
+    if distances is not None:
+        records = list(with_distances(records, distances[page["start"]:page["end"]]))
+    body = {
+        "total": page["total"],
+        "page": page["number"],
+        "page_size": page["size"],
+        "pages": page["pages"],
+        "results": records,
+    }
+    return Response(json.dumps(body, separators=(",", ":"), ensure_ascii=False), mimetype="application/json")
+
+
+def read_batch(body, conditions=None):
+    """
+    Reads the queries of a batch search request.
+
+    The body is {"queries": [...], "limit": N}: every query has the matches_name()
+    parameters (condition, numbers, letters) and optionally gender, countries (a country
+    or a list of them) and pattern (with pattern_syntax). 'conditions' maps the
+    app's own condition names to the search engine's. 'limit' caps the rows returned per
+    query (the totals are always complete); it defaults to no limit.
+
+    Returns (queries, limit); aborts with 400 Bad Request on a malformed body.
+    """
+    if not isinstance(body, dict) or not isinstance(body.get("queries"), list):
+        abort(400, "Expected a JSON object with a list of queries.")
+    queries = []
+    for query in body["queries"]:
+        try:
+            condition = query["condition"]
+            condition = conditions.get(condition, condition) if conditions else condition
+            numbers = query["numbers"]
+            if condition == "between":
+                lower_bound, upper_bound = numbers
+                numbers = (int(lower_bound), int(upper_bound))
+            else:
+                numbers = int(numbers)
+            letters = [str(letter) for letter in query.get("letters", [])]
+            gender = str(query.get("gender", "Any"))
+            countries = query.get("countries", [])
+            countries = [str(country) for country in ([countries] if isinstance(countries, str) else countries)]
+            pattern = pattern_params(query)
+        except (KeyError, TypeError, ValueError):
+            abort(400, f"Invalid query: {query!r}")
+        queries.append((condition, numbers, letters, gender, countries, pattern))
+    limit = body.get("limit")
+    if limit is not None and (not isinstance(limit, int) or limit < 0):
+        abort(400, "limit must be a non-negative integer.")
+    return queries, limit
+
+
+def batch_api_response(dataset, results, limit=None, format="json"):
+    """
+    Returns the results of a batch search, one entry per query in request order, each
+    with the total number of matches and the rows (up to 'limit').
+
+    format="json" returns {"results": [...]}; format="ndjson" streams one entry per line.
+    """
+    def entries():
+        for ids in results:
+            yield {"total": len(ids), "results": dataset.records(ids if limit is None else ids[:limit])}
+
+    if format == "ndjson":
+        def generate():
+            for entry in entries():
+                yield json.dumps(entry, separators=(",", ":"), ensure_ascii=False) + "\n"
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    body = {"results": list(entries())}
+    return Response(json.dumps(body, separators=(",", ":"), ensure_ascii=False), mimetype="application/json")
+
+
+def init_search_routes(app, data, read_query, template, conditions=None):
+    """
+    Adds the search routes shared by the Flask apps, serving the DataManager 'data': the
+    search form (/), /api/search, /api/search/batch, /suggest and /stats/cache, /stats/pool
+    and /stats/data.
+
+    Parameters:
+      - read_query: the app's reader of its form and API parameters, returning (fields,
+        query) (see flask_app.read_query()). The form's defaults are the fields it reads
+        from no values.
+      - template: the compiled template of the search page
+      - conditions: maps the app's length condition names to the search engine's, for
+        the batch API
+    """
+    # Expensive searches run on a bounded thread pool, so cheap ones never wait behind them.
+    pool = SearchPool()
+
+    @app.route("/", methods=["GET", "POST"])
+    def search():
+        results = None  # Indicates that no search has been performed yet.
+        page = None       # Pagination details of the results.
+        page_size = DEFAULT_PAGE_SIZE
+        order, top_k = "file", None  # Result order, and the number of most frequent names to show
+
+        if request.method == "POST":
+            with stage("parse"):
+                fields, query = read_query(request.form)
+                similar = similar_params(request.form)
+                page_number, page_size = page_params(request.form)
+                order, top_k = order_params(request.form)
+            set_condition(query[0])
+            # The current engine and dataset: a reload in the meantime doesn't affect this request.
+            engine = data.engine
+            dataset = engine.dataset
+
+            # Filter the rows (gender and country are compared ignoring case and spaces, and
+            # only the selected countries' rows are searched) and only materialize the requested page.
+            with stage("search"):
+                if similar is None:
+                    ids, distances = pool.match_ids(engine, *query, order=order, top_k=top_k), None
+                else:
+                    # Names within a few edits of the one given, closest first (only the gender
+                    # and country filters apply).
+                    ids, distances = similar_search(pool, engine, similar, query[3], query[4], top_k)
+            page, page_ids = paginate(ids, page_number, page_size)
+            if page_size is None:
+                # All the results: decode and render them in chunks while the response streams.
+                results = dataset.iter_records(page_ids, STREAM_CHUNK_SIZE)
+            else:
+                with stage("materialize"):
+                    results = dataset.records(page_ids)
+            if distances is not None:
+                results = with_distances(results, distances[page["start"]:page["end"]])
+        else:
+            fields = read_query(request.form)[0]  # The form's defaults (a GET has no form values)
+
+        # Render the page (streamed when all the results were requested).
+        context = dict(results=results, page=page, page_size=page_size, page_sizes=PAGE_SIZES, order=order,
+                       top_k=top_k, countries=data.engine.country_names, **fields)
+        if page is not None and page_size is None:
+            return stream_template(template, **context)
+        with stage("render"):
+            return render_template(template, **context)
+
+    @app.route("/api/search", methods=["GET", "POST"])
+    def api_search():
+        # Same parameters as the search form (similar_to and max_distance included), plus page, page_size,
+        # order, top_k and format (json or ndjson).
+        with stage("parse"):
+            fields, query = read_query(request.values)
+            similar = similar_params(request.values)
+            page_number, page_size = page_params(request.values)
+            order, top_k = order_params(request.values)
+            format = request.values.get("format", "json")
+        set_condition(query[0])
+        engine = data.engine
+        # A client that already has this result (same data, same normalized query) gets a 304
+        # without searching again.
+        etag = search_etag(engine, query, similar, page_number, page_size, order, top_k, format)
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            return unchanged
+        with stage("search"):
+            if similar is None:
+                ids, distances = pool.match_ids(engine, *query, order=order, top_k=top_k), None
+            else:
+                ids, distances = similar_search(pool, engine, similar, query[3], query[4], top_k)
+        with stage("materialize"):
+            return with_etag(search_api_response(engine.dataset, ids, page_number, page_size, format, distances), etag)
+
+    @app.route("/api/search/batch", methods=["POST"])
+    def api_search_batch():
+        # JSON body: {"queries": [{"condition", "numbers", "letters", "gender", "countries", "pattern"}, ...],
+        # "limit": N}.
+        with stage("parse"):
+            queries, limit = read_batch(request.get_json(silent=True), conditions)
+        engine = data.engine
+        with stage("search"):
+            results = pool.run(engine.match_batch, queries)
+        with stage("materialize"):
+            return batch_api_response(engine.dataset, results, limit, request.args.get("format", "json"))
+
+    @app.route("/suggest")
+    def suggest():
+        # Type-ahead: the most frequent names starting with 'prefix', optionally with a given
+        # gender and length ('limit' names, 10 by default).
+        with stage("parse"):
+            prefix, gender, length, limit = suggest_params(request.values)
+        engine = data.engine
+        etag = result_etag(engine.dataset.version, request.path, prefix.lower(), gender.strip().lower(), length, limit)
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            return unchanged
+        with stage("search"):
+            ids = engine.suggest_ids(prefix, gender, length, limit)
+        with stage("materialize"):
+            return with_etag(suggest_response(engine.dataset, prefix, ids), etag)
+
+    @app.route("/stats/cache")
+    def cache_stats():
+        # Hit/miss/eviction counters of the search result cache.
+        return jsonify(data.cache.stats())
+
+    @app.route("/stats/pool")
+    def pool_stats():
+        # Searches run inline or on the pool, and those rejected or timed out.
+        return jsonify(pool.stats())
+
+    @app.route("/stats/data")
+    def data_stats():
+        # Version of the dataset being served and how long the last reload took.
+        return jsonify(data.stats())